@@ -1,22 +1,30 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict, Tuple, Literal
+import json
 import os
 from datetime import datetime
 import uuid
+import time
 import logging
 
 from .models.models import (
     ChatQuery, ChatResponse, WebSearchPermissionRequest, WebSearchPermission,
-    UploadResponse, Source, ConversationHistory
+    Source, ConversationHistory
 )
 from .services.pdf_processor import PDFProcessor
 from .services.vector_store import VectorStore
-from .services.llm_service import LLMService
+from .services.sharded_store import ShardedVectorStore
+from .services.llm_service import LLMService, WebSearchRequestDetector
 from .services.database import DatabaseService
 from .services.web_search import WebSearchService
+from .services.query_batcher import QueryBatcher
+from .services.answer_cache import SemanticAnswerCache
+from .services.ingestion import IngestionExecutor, IngestionBusyError
+from .services.reranker import CrossEncoderReranker
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,57 +41,283 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+RetrievalMode = Literal["dense", "keyword", "hybrid"]
+
+class SearchFilters(BaseModel):
+    """Restricts retrieval to chunks of these documents / files and pages"""
+    document_ids: Optional[List[str]] = None
+    filenames: Optional[List[str]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+
+class ChunkSource(Source):
+    """Source from the document store; conversations store it as a chunk reference"""
+    document_id: Optional[str] = None
+    chunk_id: Optional[int] = None
+
+class FilteredChatQuery(ChatQuery):
+    filters: Optional[SearchFilters] = None
+
+class TimedChatResponse(ChatResponse):
+    """ChatResponse with the seconds spent in each stage of answering"""
+    stage_timings: Dict[str, float] = {}
+    # Whether the cross-encoder ordered the sources (None when it is off)
+    reranked: Optional[bool] = None
+
+class BatchQuery(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    filters: Optional[SearchFilters] = None
+
+class BatchQueryResult(BaseModel):
+    query: str
+    sources: List[Source]
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult]
+
+class UploadJobResponse(BaseModel):
+    message: str
+    job_id: str
+    document_id: str
+    status: str
+
+class IngestionJob(BaseModel):
+    id: str
+    document_id: str
+    filename: str
+    status: str
+    stage: Optional[str] = None
+    pages_total: int = 0
+    pages_done: int = 0
+    chunks_total: int = 0
+    chunks_embedded: int = 0
+    pages_per_second: Optional[float] = None
+    chunks_per_second: Optional[float] = None
+    stage_timings: Dict[str, float] = {}
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Initialize services
 pdf_processor = PDFProcessor()
-vector_store = VectorStore()
+# VECTOR_SHARDS > 1 partitions the store by document and searches the shards in parallel
+vector_store = ShardedVectorStore() if int(os.getenv("VECTOR_SHARDS", "1")) > 1 else VectorStore()
 llm_service = LLMService()
+reranker = CrossEncoderReranker()
 database_service = DatabaseService()
 web_search_service = WebSearchService()
+query_batcher = QueryBatcher(
+    vector_store,
+    max_wait_ms=float(os.getenv("QUERY_BATCH_WAIT_MS", "5")),
+    max_batch_size=int(os.getenv("QUERY_BATCH_SIZE", "32"))
+)
+answer_cache = SemanticAnswerCache(
+    endpoints=[endpoint.strip() for endpoint in os.getenv("ANSWER_CACHE_ENDPOINTS", "query").split(",") if endpoint.strip()],
+    similarity_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+)
+vector_store.add_change_listener(answer_cache.invalidate)
+ingestion_executor = IngestionExecutor(
+    pdf_processor,
+    vector_store,
+    database_service,
+    mode=os.getenv("INGEST_EXECUTOR", "process"),
+    workers=int(os.getenv("INGEST_WORKERS", "2")),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", "8")),
+    embed_batch_size=int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64")),
+    extract_workers=int(os.getenv("PDF_EXTRACT_WORKERS", "2")),
+    page_batch_size=int(os.getenv("PDF_PAGE_BATCH_SIZE", "16"))
+)
 
-@app.post("/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...)):
-    """Upload and process a PDF file"""
-    try:
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-        
-        # Read file content
-        content = await file.read()
-        
-        # Process PDF
-        document_id = str(uuid.uuid4())
-        chunks = pdf_processor.process_pdf_content(content, document_id, file.filename)
+async def retrieve_context(
+    query: str,
+    top_k: int = 5,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[str] = None,
+    filters: Optional[SearchFilters] = None,
+    timings: Optional[Dict[str, float]] = None
+) -> Tuple[str, List[Source], List[Dict]]:
+    """Search the documents for a query and build the LLM context and sources
+    
+    With a cross-encoder configured, more candidates are retrieved and the
+    best top_k by its score are kept. The context holds the most relevant
+    results that fit the context token budget; the returned sources and
+    results are the ones it includes. Seconds spent per stage are added to
+    timings.
+    """
+    context = ""
+    sources = []
+    search_results = []
+    timings = timings if timings is not None else {}
+    
+    if vector_store.is_ready():
+        started = time.perf_counter()
+        search_results = await query_batcher.search(
+            query, top_k=reranker.candidates(top_k), nprobe=nprobe, ef_search=ef_search, mode=mode,
+            filters=filters.dict(exclude_none=True) if filters else None
+        )
+        timings["retrieve"] = time.perf_counter() - started
         
-        if not chunks:
-            raise HTTPException(status_code=400, detail="Could not extract text from PDF")
+        if reranker.is_available() and search_results:
+            started = time.perf_counter()
+            reranked = await run_in_threadpool(reranker.rerank, query, search_results, top_k)
+            # Past the latency budget the bi-encoder order is kept
+            search_results = reranked if reranked is not None else search_results[:top_k]
+            timings["rerank"] = time.perf_counter() - started
         
-        # Store in vector database
-        vector_store.add_documents(chunks, document_id, file.filename)
+        if search_results:
+            started = time.perf_counter()
+            context, search_results = llm_service.context_builder.build_context(search_results)
+            timings["context"] = time.perf_counter() - started
+            for result in search_results:
+                sources.append(ChunkSource(
+                    text=result['text'],
+                    source=result['source'],
+                    page=result.get('page'),
+                    score=result['score'],
+                    document_id=result.get('document_id'),
+                    chunk_id=result.get('chunk_id')
+                ))
+    
+    return context, sources, search_results
+
+def rerank_status(search_results: List[Dict]) -> Optional[bool]:
+    """Whether search_results were re-ranked, or None if re-ranking is off"""
+    if not reranker.is_available() or not search_results:
+        return None
+    return "rerank_score" in search_results[0]
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def queue_upload(file: UploadFile, document_id: str, replace: bool = False) -> UploadJobResponse:
+    """Check an uploaded PDF and queue it for processing as document_id"""
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    # Extraction, embedding and indexing run as a background job
+    try:
+        job = await ingestion_executor.submit(file.file, document_id, file.filename, replace)
+    except IngestionBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    
+    # Identical files are not processed again
+    if job['status'] == "completed" and replace:
+        message = f"{file.filename} is unchanged"
+    elif job['document_id'] != document_id:
+        message = f"{file.filename} was already uploaded"
+    elif replace:
+        message = f"Replacing document {document_id} with {file.filename}"
+    else:
+        message = f"Processing {file.filename}"
+    
+    return UploadJobResponse(
+        message=message,
+        job_id=job['id'],
+        document_id=job['document_id'],
+        status=job['status']
+    )
+
+@app.post("/upload", response_model=UploadJobResponse, status_code=202)
+async def upload_pdf(file: UploadFile = File(...)):
+    """Upload a PDF file and queue it for processing"""
+    try:
+        return await queue_upload(file, str(uuid.uuid4()))
         
-        # Store in database
-        await database_service.store_document(document_id, file.filename, len(chunks))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/documents/{document_id}", response_model=UploadJobResponse, status_code=202)
+async def replace_document(document_id: str, file: UploadFile = File(...)):
+    """Upload a new version of a document
+    
+    The current version stays searchable until the new one is indexed;
+    chunks whose text did not change reuse their stored embeddings.
+    """
+    try:
+        document = await database_service.get_document(document_id)
+        if not document and not vector_store.has_document(document_id):
+            raise HTTPException(status_code=404, detail="Document not found")
+        return await queue_upload(file, document_id, replace=True)
         
-        logger.info(f"Successfully processed PDF: {file.filename} with {len(chunks)} chunks")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error replacing document: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Remove a document from search and from the document list"""
+    try:
+        document = await database_service.get_document(document_id)
+        chunks_removed = await run_in_threadpool(vector_store.delete_document, document_id)
+        if not document and not chunks_removed:
+            raise HTTPException(status_code=404, detail="Document not found")
         
-        return UploadResponse(
-            message=f"Successfully processed {file.filename}",
-            document_id=document_id,
-            chunks_count=len(chunks)
-        )
+        await database_service.delete_document(document_id)
+        return {
+            "message": f"Document {document_id} deleted",
+            "document_id": document_id,
+            "chunks_removed": chunks_removed
+        }
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error processing PDF: {str(e)}")
+        logger.error(f"Error deleting document: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/query", response_model=ChatResponse)
-async def query_documents(request: ChatQuery):
-    """Query documents and get AI response"""
+@app.get("/jobs/{job_id}", response_model=IngestionJob)
+async def get_job(job_id: str):
+    """Get the progress of an ingestion job"""
+    job = await database_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return IngestionJob(**job)
+
+@app.get("/jobs")
+async def list_jobs(limit: int = 50):
+    """List recent ingestion jobs"""
     try:
+        jobs = await database_service.list_jobs(limit)
+        return {"jobs": [IngestionJob(**job) for job in jobs]}
+    except Exception as e:
+        logger.error(f"Error listing jobs: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/query", response_model=TimedChatResponse)
+async def query_documents(
+    request: FilteredChatQuery,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[RetrievalMode] = None
+):
+    """Query documents and get AI response
+    
+    nprobe / ef_search (query parameters) tune the approximate index
+    search breadth for this request; mode selects dense, keyword or hybrid
+    retrieval. filters in the body restrict retrieval to the given
+    documents, filenames and page range. stage_timings in the response
+    holds the seconds spent retrieving, re-ranking, building the context
+    and generating.
+    """
+    try:
+        started = time.perf_counter()
+        timings = {}
         conversation_id = request.conversation_id or str(uuid.uuid4())
         
         # Check if LLM service is available
         if not llm_service.is_available():
-            return ChatResponse(
+            return TimedChatResponse(
                 response="❌ LLM service is not available. Please configure OPENAI_API_KEY environment variable.",
                 sources=[],
                 conversation_id=conversation_id,
@@ -91,51 +325,178 @@ async def query_documents(request: ChatQuery):
             )
         
         # Get conversation history
-        conversation_history = await database_service.get_conversation_history(conversation_id)
+        conversation_history = await database_service.get_recent_history(conversation_id)
         
         # Search relevant documents
-        context = ""
-        sources = []
+        context, sources, search_results = await retrieve_context(
+            request.query, request.top_k, nprobe, ef_search, mode, request.filters, timings
+        )
         
-        if vector_store.index is not None:
-            search_results = vector_store.search(request.query, top_k=request.top_k)
-            
-            if search_results:
-                context_parts = []
-                for result in search_results:
-                    context_parts.append(result['text'])
-                    sources.append(Source(
-                        text=result['text'],
-                        source=result['source'],
-                        page=result.get('page'),
-                        score=result['score']
-                    ))
-                context = "\n\n".join(context_parts)
+        # Reuse the answer to a near-identical question over the same chunks
+        cached = None
+        # Keyword retrieval never encodes the query, so it bypasses the cache
+        use_answer_cache = answer_cache.enabled_for("query") and (mode or vector_store.search_mode) != "keyword"
+        if use_answer_cache:
+            query_embedding = (await run_in_threadpool(vector_store.encode_queries, [request.query]))[0]
+            cache_key = answer_cache.make_key("query", llm_service.model, search_results, conversation_history)
+            cached = answer_cache.get(cache_key, query_embedding)
         
-        # Get LLM response
-        response, needs_web_search, search_query = await llm_service.generate_response(
-            request.query, 
-            context, 
-            conversation_history
-        )
+        if cached:
+            response, needs_web_search, search_query = cached.response, cached.needs_web_search, cached.search_query
+            sources = cached.sources
+        else:
+            # Get LLM response
+            generate_started = time.perf_counter()
+            response, needs_web_search, search_query = await llm_service.generate_response(
+                request.query, 
+                context, 
+                conversation_history
+            )
+            timings["generate"] = time.perf_counter() - generate_started
+            if use_answer_cache:
+                answer_cache.put(cache_key, query_embedding, response, sources, needs_web_search, search_query)
         
         # Store the conversation
         await database_service.store_conversation(
             conversation_id, request.query, response, sources
         )
         
-        return ChatResponse(
+        timings["total"] = time.perf_counter() - started
+        return TimedChatResponse(
             response=response,
             sources=sources,
             conversation_id=conversation_id,
             needs_web_search=needs_web_search,
-            search_query=search_query
+            search_query=search_query,
+            stage_timings=timings,
+            reranked=rerank_status(search_results)
         )
         
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def query_documents_stream(
+    request: FilteredChatQuery,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[RetrievalMode] = None
+):
+    """Query documents and stream the AI response as Server-Sent Events
+    
+    Events: "sources" with the retrieved sources and conversation id, one
+    "token" per response piece, then "done" with needs_web_search and
+    search_query (or "error"), plus stage_timings and reranked as in
+    /query. The conversation is stored once the response is complete.
+    """
+    conversation_id = request.conversation_id or str(uuid.uuid4())
+    
+    async def events():
+        started = time.perf_counter()
+        timings = {}
+        try:
+            if not llm_service.is_available():
+                yield sse_event("sources", {"conversation_id": conversation_id, "sources": []})
+                yield sse_event("token", {"text": "❌ LLM service is not available. Please configure OPENAI_API_KEY environment variable."})
+                yield sse_event("done", {"conversation_id": conversation_id, "needs_web_search": False, "search_query": None})
+                return
+            
+            conversation_history = await database_service.get_recent_history(conversation_id)
+            context, sources, search_results = await retrieve_context(
+                request.query, request.top_k, nprobe, ef_search, mode, request.filters, timings
+            )
+            
+            cached = None
+            use_answer_cache = answer_cache.enabled_for("query_stream") and (mode or vector_store.search_mode) != "keyword"
+            if use_answer_cache:
+                query_embedding = (await run_in_threadpool(vector_store.encode_queries, [request.query]))[0]
+                cache_key = answer_cache.make_key("query_stream", llm_service.model, search_results, conversation_history)
+                cached = answer_cache.get(cache_key, query_embedding)
+                if cached:
+                    sources = cached.sources
+            
+            yield sse_event("sources", {
+                "conversation_id": conversation_id,
+                "sources": [source.dict() for source in sources]
+            })
+            
+            if cached:
+                response, needs_web_search, search_query = cached.response, cached.needs_web_search, cached.search_query
+                yield sse_event("token", {"text": response})
+            else:
+                detector = WebSearchRequestDetector()
+                generate_started = time.perf_counter()
+                async for piece in llm_service.stream_response(request.query, context, conversation_history):
+                    detector.feed(piece)
+                    yield sse_event("token", {"text": piece})
+                timings["generate"] = time.perf_counter() - generate_started
+                response = detector.text.strip()
+                needs_web_search, search_query = detector.result()
+                if use_answer_cache:
+                    answer_cache.put(cache_key, query_embedding, response, sources, needs_web_search, search_query)
+            
+            # Store the conversation
+            await database_service.store_conversation(
+                conversation_id, request.query, response, sources
+            )
+            
+            timings["total"] = time.perf_counter() - started
+            yield sse_event("done", {
+                "conversation_id": conversation_id,
+                "needs_web_search": needs_web_search,
+                "search_query": search_query,
+                "stage_timings": timings,
+                "reranked": rerank_status(search_results)
+            })
+            
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_documents_batch(
+    request: BatchQuery,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    mode: Optional[RetrievalMode] = None
+):
+    """Retrieve sources for many queries in a single encoder pass and index search"""
+    try:
+        batch_results = []
+        if vector_store.is_ready():
+            batch_results = await run_in_threadpool(
+                vector_store.search_batch, request.queries, request.top_k, nprobe, ef_search, mode,
+                request.filters.dict(exclude_none=True) if request.filters else None
+            )
+        
+        results = []
+        for query, search_results in zip(request.queries, batch_results):
+            results.append(BatchQueryResult(
+                query=query,
+                sources=[
+                    Source(
+                        text=result['text'],
+                        source=result['source'],
+                        page=result.get('page'),
+                        score=result['score']
+                    )
+                    for result in search_results
+                ]
+            ))
+        
+        return BatchQueryResponse(results=results)
+        
+    except Exception as e:
+        logger.error(f"Error processing batch query: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/web-search", response_model=ChatResponse)
 async def perform_web_search(request: WebSearchPermission):
     """Perform web search after user permission"""
@@ -163,7 +524,7 @@ async def perform_web_search(request: WebSearchPermission):
             )
         
         # Get the latest conversation to find the search query
-        conversation_history = await database_service.get_conversation_history(request.conversation_id)
+        conversation_history = await database_service.get_recent_history(request.conversation_id)
         if not conversation_history:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
@@ -184,23 +545,7 @@ async def perform_web_search(request: WebSearchPermission):
         web_results = await web_search_service.search(search_query, max_results=5)
         
         # Get document context again
-        context = ""
-        doc_sources = []
-        
-        if vector_store.index is not None:
-            search_results = vector_store.search(original_query, top_k=5)
-            
-            if search_results:
-                context_parts = []
-                for result in search_results:
-                    context_parts.append(result['text'])
-                    doc_sources.append(Source(
-                        text=result['text'],
-                        source=result['source'],
-                        page=result.get('page'),
-                        score=result['score']
-                    ))
-                context = "\n\n".join(context_parts)
+        context, doc_sources, _ = await retrieve_context(original_query, top_k=5)
         
         # Generate response with web search results
         response = await llm_service.generate_response_with_web_search(
@@ -254,28 +599,70 @@ async def get_conversation(conversation_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/conversations")
-async def list_conversations():
-    """List all conversations"""
+async def list_conversations(limit: int = 50, cursor: Optional[str] = None, search: Optional[str] = None):
+    """List conversations, most recently active first, a page at a time
+    
+    Pass the returned next_cursor as cursor for the following page; search
+    matches words of the first query of each conversation.
+    """
     try:
-        conversations = await database_service.list_conversations()
-        return {"conversations": conversations}
+        return await database_service.list_conversations(limit, cursor, search)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing conversations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/vector-store/stats")
+async def get_vector_store_stats(evaluate: bool = False, top_k: int = 10, sample_size: int = 100):
+    """Vector store statistics; with evaluate, index memory and recall@k of each quantization"""
+    try:
+        stats = vector_store.get_stats()
+        if evaluate:
+            stats["evaluation"] = await run_in_threadpool(
+                vector_store.evaluate_quantization, top_k, sample_size
+            )
+        return stats
+    except Exception as e:
+        logger.error(f"Error reading vector store stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "vector_store_ready": vector_store.index is not None,
+        "vector_store_ready": vector_store.is_ready(),
         "web_search_available": web_search_service.is_available(),
         "llm_service_available": llm_service.is_available(),
         "openai_api_configured": llm_service.is_available(),
         "tavily_api_configured": web_search_service.is_available(),
+        "query_batching": query_batcher.get_stats(),
+        "query_cache": vector_store.query_cache.get_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "reranker": reranker.get_stats(),
+        "database": database_service.get_stats(),
+        "ingestion": ingestion_executor.get_stats(),
         "timestamp": datetime.now().isoformat()
     }
 
+@app.on_event("startup")
+async def startup():
+    """Fail the ingestion jobs of processes that stopped before finishing them"""
+    await database_service.reap_interrupted_jobs()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop background workers"""
+    query_batcher.shutdown()
+    ingestion_executor.shutdown()
+    # Commit conversation writes still queued; a failure is raised once the
+    # flush retries and the final write on close are exhausted
+    try:
+        await database_service.drain()
+    finally:
+        database_service.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,245 @@
+import faiss
+import numpy as np
+from typing import List, Optional, Tuple
+import logging
+import json
+import math
+import os
+
+from .segment_store import Segment
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+# Encodings of the vectors held by in-memory indexes: float32, float16,
+# 8-bit scalar quantization or product quantization
+QUANTIZATIONS = ("none", "fp16", "int8", "pq")
+# Encodings whose codebooks have to be trained on stored vectors
+TRAINED_QUANTIZATIONS = ("pq",)
+# Centroids per PQ sub-quantizer (8-bit codes), the fewest rows PQ can train on
+PQ_CENTROIDS = 256
+# Dimensions per PQ sub-vector at the least: more, shorter sub-vectors
+# make codes and training slower for little recall
+PQ_MIN_SUBVECTOR_DIMENSIONS = 8
+
+# Training rows drawn per centroid (FAISS warns below 39), and the most
+# drawn in all: k-means time grows with the sample, not with the corpus
+TRAIN_ROWS_PER_CENTROID = 64
+MAX_TRAIN_ROWS = 131072
+
+# Rows added to a FAISS index per call when filling it from segments
+ADD_BLOCK_ROWS = 65536
+
+def choose_nlist(ntotal: int) -> int:
+    """Number of IVF lists for a corpus of the given size"""
+    return int(min(65536, max(16, 4 * math.sqrt(ntotal))))
+
+def choose_pq_subquantizers(dimension: int) -> int:
+    """Largest usual PQ sub-quantizer count that divides the dimension
+
+    Sub-vectors keep at least PQ_MIN_SUBVECTOR_DIMENSIONS dimensions, e.g.
+    48 sub-quantizers for 384 dimensions.
+    """
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dimension % m == 0 and m * PQ_MIN_SUBVECTOR_DIMENSIONS <= dimension:
+            return m
+    return 1
+
+def vector_encoding(quantization: str, dimension: int) -> str:
+    """index_factory name of the vector encoding for a quantization"""
+    if quantization == "none":
+        return "Flat"
+    if quantization == "fp16":
+        return "SQfp16"
+    if quantization == "int8":
+        return "SQ8"
+    if quantization == "pq":
+        return f"PQ{choose_pq_subquantizers(dimension)}"
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+def create_index(index_type: str, dimension: int, ntotal: int, quantization: str = "none") -> faiss.Index:
+    """Create an empty inner-product index of the given type
+
+    quantization sets how flat, ivf_flat and hnsw indexes store vectors;
+    ivf_pq always stores PQ codes.
+    """
+    encoding = vector_encoding(quantization, dimension)
+    if index_type == "flat":
+        # IndexPQ cannot take an ID selector; one inverted list scans the
+        # same codes exhaustively and can
+        factory = f"IVF1,{encoding}" if quantization == "pq" else encoding
+    elif index_type == "ivf_flat":
+        factory = f"IVF{choose_nlist(ntotal)},{encoding}"
+    elif index_type == "ivf_pq":
+        factory = f"IVF{choose_nlist(ntotal)},PQ{choose_pq_subquantizers(dimension)}"
+    elif index_type == "hnsw":
+        if quantization == "none":
+            factory = "HNSW32"
+        elif quantization == "pq":
+            factory = f"HNSW32_{encoding}"
+        else:
+            factory = f"HNSW32,{encoding}"
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    return faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT)
+
+def create_exact_index(dimension: int, quantization: str = "none") -> faiss.Index:
+    """Exhaustive inner-product index usable without any training data
+
+    int8 codes cover [-1, 1] in every dimension, which holds any unit
+    vector. PQ needs trained codebooks, so "pq" uses float16 until the
+    corpus is large enough to build a PQ index.
+    """
+    if quantization == "none":
+        return faiss.IndexFlatIP(dimension)
+    if quantization == "int8":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(np.vstack([-np.ones(dimension), np.ones(dimension)]).astype('float32'))
+        return index
+    if quantization in ("fp16", "pq"):
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+def has_exact_scores(index: faiss.Index) -> bool:
+    """Whether an index scores candidates with the original float32 vectors"""
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat, faiss.IndexHNSWFlat))
+
+def index_memory(index: faiss.Index) -> int:
+    """Approximate bytes an index holds in memory for its vectors and links"""
+    if isinstance(index, faiss.IndexHNSW):
+        links = index.hnsw.neighbors.size() * 4 + index.hnsw.offsets.size() * 8
+        return index_memory(faiss.downcast_index(index.storage)) + links
+    if isinstance(index, faiss.IndexIVF):
+        # Codes and 64-bit ids in the inverted lists, plus the coarse centroids
+        return index.ntotal * (index.code_size + 8) + index_memory(faiss.downcast_index(index.quantizer))
+    if isinstance(index, faiss.IndexPQ):
+        return index.ntotal * index.code_size + index.pq.centroids.size() * 4
+    if isinstance(index, (faiss.IndexFlatCodes, faiss.IndexFlat)):
+        return index.ntotal * index.code_size
+    return 0
+
+def iter_embeddings(segments: List[Segment], start_row: int = 0):
+    """Yield contiguous float32 blocks of all rows from start_row onwards"""
+    offset = 0
+    for segment in segments:
+        first = max(start_row - offset, 0)
+        for block_start in range(first, segment.rows, ADD_BLOCK_ROWS):
+            yield np.ascontiguousarray(segment.embeddings[block_start:block_start + ADD_BLOCK_ROWS])
+        offset += segment.rows
+
+def add_segments(index: faiss.Index, segments: List[Segment], start_row: int = 0):
+    """Add the rows of the given segments to an index"""
+    for block in iter_embeddings(segments, start_row):
+        index.add(block)
+
+def sample_embeddings(segments: List[Segment], size: int) -> np.ndarray:
+    """Draw a uniform random training sample across segments"""
+    ntotal = sum(segment.rows for segment in segments)
+    positions = np.sort(np.random.default_rng(0).choice(ntotal, size=min(size, ntotal), replace=False))
+    sample = []
+    offset = 0
+    for segment in segments:
+        local = positions[(positions >= offset) & (positions < offset + segment.rows)] - offset
+        if len(local):
+            sample.append(np.asarray(segment.embeddings[local]))
+        offset += segment.rows
+    return np.ascontiguousarray(np.vstack(sample), dtype='float32')
+
+def training_rows(index: faiss.Index) -> int:
+    """Size of the training sample for an untrained index
+
+    Enough rows per IVF list and PQ centroid, capped at MAX_TRAIN_ROWS.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    centroids = max(ivf.nlist if ivf else 0, PQ_CENTROIDS)
+    return min(centroids * TRAIN_ROWS_PER_CENTROID, MAX_TRAIN_ROWS)
+
+def build_index(index_type: str, dimension: int, segments: List[Segment], quantization: str = "none") -> faiss.Index:
+    """Train (if needed) and fill an index from the given segments"""
+    ntotal = sum(segment.rows for segment in segments)
+    index = create_index(index_type, dimension, ntotal, quantization)
+    if not index.is_trained:
+        index.train(sample_embeddings(segments, training_rows(index)))
+    add_segments(index, segments)
+    return index
+
+def recall_at_k(rankings: List[List[Tuple[int, float]]], exact: List[List[Tuple[int, float]]]) -> float:
+    """Mean share of the exact top results found in rankings, per query"""
+    shares = [
+        len({idx for idx, _ in ranking} & {idx for idx, _ in truth}) / len(truth)
+        for ranking, truth in zip(rankings, exact)
+        if truth
+    ]
+    return round(sum(shares) / len(shares), 4) if shares else 1.0
+
+def search_parameters(
+    index: faiss.Index,
+    top_k: int,
+    nprobe: int,
+    ef_search: int,
+    selector: faiss.IDSelector = None
+) -> Optional[faiss.SearchParameters]:
+    """Per-request search parameters for the given index, if it has any
+
+    A selector restricts the search to the ids it accepts.
+    """
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(nprobe=nprobe, sel=selector)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(efSearch=max(ef_search, top_k), sel=selector)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+def save_index(index: faiss.Index, index_type: str, path: str, quantization: str = "none", segments: List[str] = None):
+    """Write an index next to a small JSON header describing it
+
+    segments names the segments whose rows the index holds, in order.
+    """
+    faiss.write_index(index, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    header = {"index_type": index_type, "quantization": quantization, "rows": index.ntotal, "segments": segments}
+    with open(path + ".json.tmp", 'w') as f:
+        json.dump(header, f)
+    os.replace(path + ".json.tmp", path + ".json")
+
+def move_index(source: str, target: str):
+    """Move a saved index and its header into place"""
+    os.replace(source, target)
+    os.replace(source + ".json", target + ".json")
+
+def remove_index(path: str):
+    """Delete a saved index so it is not loaded again"""
+    for file in (path + ".json", path):
+        if os.path.exists(file):
+            os.remove(file)
+
+def load_index(
+    index_type: str,
+    path: str,
+    quantization: str = "none",
+    segments: List[str] = None
+) -> Tuple[Optional[faiss.Index], int]:
+    """Read a saved index if it matches the configured type and quantization
+
+    With segments given, the index must have been built over a prefix of
+    them: one saved over segments that were compacted since is ignored.
+    """
+    if not os.path.exists(path + ".json"):
+        return None, 0
+    try:
+        with open(path + ".json") as f:
+            header = json.load(f)
+        if header["index_type"] != index_type or header.get("quantization", "none") != quantization:
+            return None, 0
+        built_over = header.get("segments")
+        if segments is not None and built_over is not None and segments[:len(built_over)] != built_over:
+            return None, 0
+        index = faiss.read_index(path)
+        if index.ntotal != header["rows"]:
+            return None, 0
+        return index, header["rows"]
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        logger.info(f"No usable {index_type} index at {path}: {str(e)}")
+        return None, 0
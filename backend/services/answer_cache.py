@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+import numpy as np
+import threading
+import hashlib
+import json
+import time
+
+class CachedAnswer:
+    __slots__ = ("embedding", "response", "sources", "needs_web_search", "search_query", "stored_at")
+
+    def __init__(
+        self,
+        embedding: np.ndarray,
+        response: str,
+        sources: List[Any],
+        needs_web_search: bool,
+        search_query: Optional[str],
+        stored_at: float
+    ):
+        self.embedding = embedding
+        self.response = response
+        self.sources = sources
+        self.needs_web_search = needs_web_search
+        self.search_query = search_query
+        self.stored_at = stored_at
+
+class SemanticAnswerCache:
+    """Reuses LLM answers for near-duplicate questions over the same chunks.
+
+    Answers are grouped under a key made of the endpoint, the LLM model, the
+    retrieved (document_id, chunk_id) set and a fingerprint of the
+    conversation history, so a cached answer is only served when the model
+    would have seen the same prompt context. Within a key, a question hits
+    when the cosine similarity of its embedding to a cached question reaches
+    ``similarity_threshold``. Entries built on a document are dropped when
+    that document changes.
+    """
+
+    def __init__(
+        self,
+        endpoints: Iterable[str] = ("query",),
+        similarity_threshold: float = 0.95,
+        max_entries: int = 512,
+        ttl_seconds: float = 3600
+    ):
+        self.endpoints = set(endpoints)
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> [CachedAnswer], least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = {endpoint: 0 for endpoint in self.endpoints}
+        self.misses = {endpoint: 0 for endpoint in self.endpoints}
+        self.invalidations = 0
+
+    def enabled_for(self, endpoint: str) -> bool:
+        return endpoint in self.endpoints
+
+    def make_key(
+        self,
+        endpoint: str,
+        model: str,
+        search_results: List[Dict],
+        conversation_history: List[Dict[str, str]] = None
+    ) -> Tuple:
+        """Cache key for answering with these retrieved chunks and history"""
+        chunk_ids = frozenset(
+            (result.get("document_id"), result.get("chunk_id")) for result in search_results
+        )
+        history = json.dumps(
+            [[message["query"], message["response"]] for message in conversation_history or []]
+        )
+        return endpoint, model, chunk_ids, hashlib.sha256(history.encode("utf-8")).hexdigest()
+
+    def get(self, key: Tuple, query_embedding: np.ndarray) -> Optional[CachedAnswer]:
+        """Most similar cached answer under key, if it is similar enough"""
+        endpoint = key[0]
+        now = time.time()
+        with self._lock:
+            answers = self._entries.get(key, [])
+            live = [answer for answer in answers if not self._expired(answer, now)]
+            if len(live) != len(answers):
+                self._replace(key, live)
+
+            best = None
+            best_score = self.similarity_threshold
+            for answer in live:
+                score = float(np.dot(answer.embedding, query_embedding))
+                if score >= best_score:
+                    best, best_score = answer, score
+
+            if best is None:
+                self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+            return best
+
+    def put(
+        self,
+        key: Tuple,
+        query_embedding: np.ndarray,
+        response: str,
+        sources: List[Any],
+        needs_web_search: bool = False,
+        search_query: Optional[str] = None
+    ):
+        """Remember an answer generated for key"""
+        answer = CachedAnswer(
+            np.array(query_embedding, dtype='float32'), response, sources, needs_web_search, search_query, time.time()
+        )
+        with self._lock:
+            self._replace(key, self._entries.get(key, []) + [answer])
+            self._entries.move_to_end(key)
+            while self._size > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._replace(oldest, [])
+
+    def invalidate(self, document_ids: Optional[Iterable[str]] = None):
+        """Drop answers built on any of the documents, or every answer when None"""
+        with self._lock:
+            if document_ids is None:
+                keys = list(self._entries)
+            else:
+                document_ids = set(document_ids)
+                keys = [
+                    key for key in self._entries
+                    if any(document_id in document_ids for document_id, _ in key[2])
+                ]
+            for key in keys:
+                self.invalidations += len(self._entries[key])
+                self._replace(key, [])
+
+    def get_stats(self) -> Dict:
+        """Hit rate per endpoint and cache size"""
+        endpoints = {}
+        for endpoint in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(endpoint, 0)
+            lookups = hits + self.misses.get(endpoint, 0)
+            endpoints[endpoint] = {
+                "hits": hits,
+                "misses": lookups - hits,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+        return {
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "similarity_threshold": self.similarity_threshold,
+            "invalidations": self.invalidations,
+            "endpoints": endpoints
+        }
+
+    def _expired(self, answer: CachedAnswer, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - answer.stored_at > self.ttl_seconds
+
+    def _replace(self, key: Tuple, answers: List[CachedAnswer]):
+        self._size += len(answers) - len(self._entries.get(key, []))
+        if answers:
+            self._entries[key] = answers
+        else:
+            self._entries.pop(key, None)
@@ -0,0 +1,125 @@
+from array import array
+from typing import List, Dict, Tuple, Optional, Iterable, Callable
+import numpy as np
+import threading
+import heapq
+import math
+import re
+
+# Words, numbers and identifiers such as part numbers (AB-1234), error
+# codes (0x80070005) or versions (v2.1.3); trailing punctuation is dropped
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[\-_\.\/][a-z0-9]+)*")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms of a text, keeping identifiers in one piece"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """Incrementally built inverted index scored with Okapi BM25.
+
+    Documents are identified by integer ids, the vector store row positions,
+    and are added in increasing id order. Each term's postings are two
+    compact arrays: document ids (unsigned 32-bit) and term frequencies
+    (unsigned 16-bit, saturating).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._doc_ids = {}  # term -> array('I') of document ids
+        self._freqs = {}  # term -> array('H') of term frequencies
+        self._lengths = array('I')  # Terms per document, indexed by id
+        self._total_length = 0
+        self._deleted = set()  # Ids left out of scoring until the index is rebuilt
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, first_id: int, texts: List[str]):
+        """Index texts as documents first_id, first_id + 1, ..."""
+        with self._lock:
+            # Ids without text (gaps) count as empty documents
+            while len(self._lengths) < first_id:
+                self._lengths.append(0)
+            for doc_id, text in enumerate(texts, first_id):
+                terms = tokenize(text)
+                counts = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, count in counts.items():
+                    if term not in self._doc_ids:
+                        self._doc_ids[term] = array('I')
+                        self._freqs[term] = array('H')
+                    self._doc_ids[term].append(doc_id)
+                    self._freqs[term].append(min(count, 65535))
+                self._lengths.append(len(terms))
+                self._total_length += len(terms)
+
+    def delete(self, doc_ids: Iterable[int]):
+        """Stop matching the given documents"""
+        with self._lock:
+            for doc_id in doc_ids:
+                doc_id = int(doc_id)
+                if doc_id < len(self._lengths) and doc_id not in self._deleted:
+                    self._deleted.add(doc_id)
+                    self._total_length -= self._lengths[doc_id]
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        allowed: Optional[Callable[[np.ndarray], np.ndarray]] = None
+    ) -> List[Tuple[int, float]]:
+        """(document id, BM25 score) of the best matching documents
+
+        allowed maps an array of scored document ids to a boolean mask of
+        the ones that may be returned; it is called once per search, with
+        the documents containing a query term only.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            doc_count = len(self._lengths) - len(self._deleted)
+            if not terms or doc_count == 0:
+                return []
+            average_length = self._total_length / doc_count or 1.0
+            scores = {}
+            for term in terms:
+                doc_ids = self._doc_ids.get(term)
+                if doc_ids is None:
+                    continue
+                idf = math.log(1 + (doc_count - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+                for doc_id, freq in zip(doc_ids, self._freqs[term]):
+                    if doc_id in self._deleted:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        if allowed is not None and scores:
+            doc_ids = np.fromiter(scores, dtype='int64', count=len(scores))
+            scores = {doc_id: scores[doc_id] for doc_id in doc_ids[allowed(doc_ids)].tolist()}
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def clear(self):
+        with self._lock:
+            self._doc_ids = {}
+            self._freqs = {}
+            self._lengths = array('I')
+            self._total_length = 0
+            self._deleted = set()
+
+    def get_stats(self) -> Dict:
+        """Index size"""
+        return {
+            "documents": len(self._lengths),
+            "terms": len(self._doc_ids),
+            "postings": sum(len(doc_ids) for doc_ids in self._doc_ids.values()),
+            "deleted": len(self._deleted)
+        }
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked id lists; each list contributes 1 / (k + rank) per id"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,151 @@
+from typing import List, Dict, Tuple
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class ApproximateTokenizer:
+    """Fast local token estimate of about four characters per token"""
+
+    CHARS_PER_TOKEN = 4
+
+    def count(self, text: str) -> int:
+        return (len(text) + self.CHARS_PER_TOKEN - 1) // self.CHARS_PER_TOKEN
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        return text[:max(0, max_tokens) * self.CHARS_PER_TOKEN]
+
+class TiktokenTokenizer:
+    """Exact token counts for OpenAI models (requires the tiktoken package)"""
+
+    def __init__(self, model: str = "gpt-3.5-turbo"):
+        import tiktoken
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        return self.encoding.decode(self.encoding.encode(text)[:max(0, max_tokens)])
+
+TOKENIZERS = {
+    "approximate": ApproximateTokenizer,
+    "tiktoken": TiktokenTokenizer
+}
+
+class ContextBuilder:
+    """Assembles prompt context and history within fixed token budgets.
+
+    Retrieved chunks are added by relevance until ``context_tokens`` is
+    spent, with the text a chunk shares with an adjacent chunk of the same
+    document (the PDFProcessor overlap) removed. Conversation history is
+    kept newest first within ``history_tokens``; the oldest turn that does
+    not fit is truncated and anything older is dropped.
+    """
+
+    # Overlaps shorter than this are not worth trimming and may be coincidence
+    MIN_OVERLAP_CHARS = 20
+    # Upper bound on the shared text between adjacent chunks
+    MAX_OVERLAP_CHARS = 400
+    # A partial chunk or turn smaller than this is left out instead
+    MIN_PARTIAL_TOKENS = 32
+    # Role and separator tokens each chat message costs
+    MESSAGE_OVERHEAD_TOKENS = 4
+
+    def __init__(self, context_tokens: int = None, history_tokens: int = None, tokenizer=None):
+        self.context_tokens = context_tokens or int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+        self.history_tokens = history_tokens or int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+        if tokenizer is None:
+            tokenizer_name = os.getenv("CONTEXT_TOKENIZER", "approximate")
+            if tokenizer_name not in TOKENIZERS:
+                raise ValueError(f"Unknown tokenizer: {tokenizer_name}")
+            try:
+                tokenizer = TOKENIZERS[tokenizer_name]()
+            except ImportError:
+                logger.warning(f"{tokenizer_name} tokenizer is not installed, using the approximation")
+                tokenizer = ApproximateTokenizer()
+        self.tokenizer = tokenizer
+
+    def build_context(self, search_results: List[Dict]) -> Tuple[str, List[Dict]]:
+        """Context text and the results it includes, most relevant first
+
+        Results are ranked by "rerank_score" when the reranker scored them,
+        and by retrieval "score" otherwise.
+        """
+        selected = []
+        texts = []
+        remaining = self.context_tokens
+        for result in sorted(search_results, key=self._relevance, reverse=True):
+            text = self._without_overlap(result, selected)
+            if not text:
+                continue
+            tokens = self.tokenizer.count(text)
+            if tokens > remaining:
+                if remaining < self.MIN_PARTIAL_TOKENS:
+                    continue
+                text = self.tokenizer.truncate(text, remaining)
+                tokens = self.tokenizer.count(text)
+            selected.append(result)
+            texts.append(text)
+            remaining -= tokens
+        return "\n\n".join(texts), selected
+
+    @staticmethod
+    def _relevance(result: Dict) -> float:
+        if "rerank_score" in result:
+            return result["rerank_score"]
+        return result.get("score", 0)
+
+    def trim_history(self, conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Most recent history turns that fit the history budget, oldest first"""
+        kept = []
+        remaining = self.history_tokens
+        for message in reversed(conversation_history or []):
+            query_tokens = self.tokenizer.count(message["query"]) + self.MESSAGE_OVERHEAD_TOKENS
+            response_tokens = self.tokenizer.count(message["response"]) + self.MESSAGE_OVERHEAD_TOKENS
+            if query_tokens + response_tokens <= remaining:
+                kept.append(message)
+                remaining -= query_tokens + response_tokens
+                continue
+            # Keep the question and the start of the answer of the oldest turn that fits partly
+            response_budget = remaining - query_tokens - self.MESSAGE_OVERHEAD_TOKENS
+            if response_budget >= self.MIN_PARTIAL_TOKENS:
+                kept.append({
+                    **message,
+                    "response": self.tokenizer.truncate(message["response"], response_budget) + " ..."
+                })
+            break
+        kept.reverse()
+        return kept
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """Estimated prompt tokens of chat messages"""
+        return sum(self.tokenizer.count(message["content"]) + self.MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def _without_overlap(self, result: Dict, selected: List[Dict]) -> str:
+        """Result text minus what adjacent, already selected chunks contain"""
+        text = result["text"]
+        for other in selected:
+            if other.get("document_id") != result.get("document_id") or other.get("source") != result.get("source"):
+                continue
+            if text in other["text"]:
+                return ""
+            chunk_id, other_id = result.get("chunk_id"), other.get("chunk_id")
+            if chunk_id is None or other_id is None:
+                continue
+            if other_id == chunk_id - 1:
+                text = text[self._overlap(other["text"], text):]
+            elif other_id == chunk_id + 1:
+                overlap = self._overlap(text, other["text"])
+                text = text[:len(text) - overlap]
+        return text.strip()
+
+    def _overlap(self, first: str, second: str) -> int:
+        """Length of the longest suffix of first that is a prefix of second"""
+        for size in range(min(len(first), len(second), self.MAX_OVERLAP_CHARS), self.MIN_OVERLAP_CHARS - 1, -1):
+            if first.endswith(second[:size]):
+                return size
+        return 0
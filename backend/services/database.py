@@ -2,15 +2,50 @@ from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, J
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable
+from collections import OrderedDict
+from .database_pool import ConnectionPool, SQLiteBackend, create_backend
+import asyncio
+import base64
+import hashlib
 import json
-import sqlite3
 import logging
+import os
+import socket
+import uuid
 
 Base = declarative_base()
 
 logger = logging.getLogger(__name__)
 
+# Recorded on the ingestion jobs this process runs: host, pid and a token
+# telling this process apart from an earlier one that had the same pid
+JOB_HOST = socket.gethostname()
+JOB_OWNER = f"{JOB_HOST}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _job_owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that owns a job may still be running it
+    
+    Jobs of other hosts are assumed alive, as their processes cannot be
+    checked from here; jobs recorded before owners were stored are not.
+    """
+    if not owner:
+        return False
+    if owner == JOB_OWNER:
+        return True
+    host, pid, _ = owner.rsplit(":", 2)
+    if host != JOB_HOST:
+        return True
+    if int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
 class ConversationHistoryDB(Base):
     __tablename__ = "conversation_history"
     
@@ -21,38 +56,198 @@ class ConversationHistoryDB(Base):
     sources = Column(Text)  # JSON string of sources
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+class _PendingWrite:
+    """A queued conversation insert, or an update of the latest response"""
+    __slots__ = ("kind", "conversation_id", "query", "response", "sources", "timestamp")
+
+    def __init__(
+        self,
+        kind: str,
+        conversation_id: str,
+        response: str,
+        sources: List[Dict[str, Any]],
+        query: str = None,
+        timestamp: str = None
+    ):
+        self.kind = kind
+        self.conversation_id = conversation_id
+        self.query = query
+        self.response = response
+        self.sources = sources
+        self.timestamp = timestamp
+
 class DatabaseService:
-    def __init__(self, db_path: str = "ragbot.db"):
-        self.db_path = db_path
-        self.init_database()
+    # Ingestion job fields that update_job may set
+    JOB_COLUMNS = (
+        'status', 'stage', 'pages_total', 'pages_done', 'chunks_total', 'chunks_embedded',
+        'pages_per_second', 'chunks_per_second', 'stage_timings', 'error'
+    )
+    # A failed conversation flush is retried after a delay doubling from
+    # the first to the last, in seconds
+    FLUSH_RETRY_MIN = 0.1
+    FLUSH_RETRY_MAX = 30.0
+    # Flushes tried by drain before it gives up
+    DRAIN_ATTEMPTS = 3
+    
+    def __init__(self, db_path: str = None, database_url: str = None, pool_size: int = None):
+        # An explicit SQLite path wins over DATABASE_URL (sqlite:///... or postgresql://...)
+        if db_path:
+            self.backend = SQLiteBackend(db_path)
+        else:
+            self.backend = create_backend(database_url or os.getenv("DATABASE_URL", "sqlite:///ragbot.db"))
+        # The schema is created by the first query (or init_database), so
+        # building the service opens no connection and starts no thread
+        self.pool = ConnectionPool(
+            self.backend, pool_size or int(os.getenv("DATABASE_POOL_SIZE", "4")), setup=self._create_schema
+        )
+        # Conversation writes are queued and committed together after
+        # flush_ms, or once flush_rows are queued; 0 ms writes through
+        self.flush_delay = float(os.getenv("CONVERSATION_FLUSH_MS", "50")) / 1000.0
+        self.flush_rows = int(os.getenv("CONVERSATION_FLUSH_ROWS", "64"))
+        self._pending_writes: List[_PendingWrite] = []
+        # Queued writes per conversation, applied on top of what reads return
+        self._overlay: Dict[str, List[_PendingWrite]] = {}
+        self._flush_lock = None  # Created inside the event loop by the first flush
+        self._flush_handle = None
+        self._flush_failures = 0  # Consecutive failed flushes
+        self.flushes = 0
+        self.flushed_writes = 0
+        self.flush_errors = 0
+        # Last history_window turns of recently active conversations, the
+        # most history a prompt uses, kept current as turns are written
+        self.history_window = int(os.getenv("HISTORY_WINDOW", "10"))
+        self.history_cache_size = int(os.getenv("HISTORY_CACHE_SIZE", "1024"))
+        self._history_cache: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        # Conversations whose window is being loaded -> written to meanwhile
+        self._history_loading: Dict[str, bool] = {}
+        self.history_hits = 0
+        self.history_misses = 0
     
     def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        """Initialize the database with required tables, if no query did yet"""
+        self.pool.open()
+    
+    def _create_schema(self, cursor):
         # Documents table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS documents (
                 id TEXT PRIMARY KEY,
                 filename TEXT NOT NULL,
                 chunks_count INTEGER NOT NULL,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                content_hash TEXT  -- SHA-256 of the uploaded file
+            )
+        ''')
+        self._add_missing_columns(cursor, 'documents', {'content_hash': 'TEXT'})
+        
+        # Embeddings of chunk texts already seen, keyed by SHA-256 of the text
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                content_hash TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                embedding {self.backend.blob_type} NOT NULL,  -- float32 vector
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (content_hash, model_name)
             )
         ''')
         
         # Conversations table
-        cursor.execute('''
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS conversations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id {self.backend.autoincrement_key},
                 conversation_id TEXT NOT NULL,
                 query TEXT NOT NULL,
                 response TEXT NOT NULL,
-                sources TEXT,  -- JSON string of sources
+                sources TEXT,  -- JSON string of sources (turns stored before conversation_sources)
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
+        # Sources of conversation turns; document chunks refer to their text
+        # in source_texts, only other sources (web results) keep it inline
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_sources (
+                conversation_row_id INTEGER NOT NULL,  -- conversations.id
+                source_order INTEGER NOT NULL,
+                document_id TEXT,
+                chunk_id INTEGER,
+                source TEXT NOT NULL,
+                page INTEGER,
+                score REAL NOT NULL,
+                text TEXT,
+                content_hash TEXT,  -- source_texts.content_hash
+                PRIMARY KEY (conversation_row_id, source_order)
+            )
+        ''')
+        self._add_missing_columns(cursor, 'conversation_sources', {'content_hash': 'TEXT'})
+        
+        # Cited chunk texts, stored once each and keyed by SHA-256 of the
+        # text, so answers keep the text they were given even after the
+        # document is replaced or deleted
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS source_texts (
+                content_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            )
+        ''')
+        
+        # One row per conversation, kept current as turns are written, so
+        # listing reads a page of the covering index instead of grouping turns
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS conversation_summary (
+                id {self.backend.autoincrement_key},
+                conversation_id TEXT NOT NULL UNIQUE,
+                message_count INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP NOT NULL,
+                first_query TEXT NOT NULL  -- shortened to 100 characters for display
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversation_summary_recent
+            ON conversation_summary(updated_at, id, conversation_id, message_count, created_at, first_query)
+        ''')
+        
+        # Full-text search over whole first queries, keyed by conversation_summary.id
+        self.full_text_search = False
+        if self.backend.name == "sqlite":
+            try:
+                cursor.execute('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS conversation_search USING fts5(first_query)
+                ''')
+                self.full_text_search = True
+            except self.backend.Error as e:
+                logger.warning(f"Conversation search falls back to LIKE: {e}")
+        
+        cursor.execute('SELECT 1 FROM conversation_summary LIMIT 1')
+        if cursor.fetchone() is None:
+            self._backfill_conversation_summary(cursor)
+        
+        # Ingestion jobs table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ingestion_jobs (
+                id TEXT PRIMARY KEY,
+                document_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                status TEXT NOT NULL,  -- queued, running, completed, failed
+                stage TEXT,  -- extract, chunk, embed, index, record
+                pages_total INTEGER DEFAULT 0,
+                pages_done INTEGER DEFAULT 0,
+                chunks_total INTEGER DEFAULT 0,
+                chunks_embedded INTEGER DEFAULT 0,
+                pages_per_second REAL,
+                chunks_per_second REAL,
+                stage_timings TEXT,  -- JSON object of stage -> seconds
+                error TEXT,
+                owner TEXT,  -- host:pid:token of the process running the job
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        self._add_missing_columns(cursor, 'ingestion_jobs', {'pages_done': 'INTEGER DEFAULT 0', 'owner': 'TEXT'})
+        
         # Create indexes for better performance
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_conversation_id 
@@ -64,29 +259,464 @@ class DatabaseService:
             ON conversations(timestamp)
         ''')
         
-        conn.commit()
-        conn.close()
+        # Serves the latest turns of a conversation without sorting them all
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversation_timestamp
+            ON conversations(conversation_id, timestamp)
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_documents_content_hash 
+            ON documents(content_hash)
+        ''')
         logger.info("Database initialized successfully")
     
-    async def store_document(self, document_id: str, filename: str, chunks_count: int):
-        """Store document metadata"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _backfill_conversation_summary(self, cursor):
+        """Summarize the conversations stored before conversation_summary existed"""
+        cursor.execute('''
+            SELECT conversation_id, COUNT(*), MIN(timestamp), MAX(timestamp)
+            FROM conversations
+            GROUP BY conversation_id
+        ''')
+        for conversation_id, message_count, created_at, updated_at in cursor.fetchall():
+            cursor.execute('''
+                SELECT query FROM conversations
+                WHERE conversation_id = ?
+                ORDER BY timestamp ASC
+                LIMIT 1
+            ''', (conversation_id,))
+            first_query = cursor.fetchone()[0]
+            self._insert_conversation_summary(cursor, conversation_id, message_count, created_at, updated_at, first_query)
+    
+    def _insert_conversation_summary(
+        self, 
+        cursor, 
+        conversation_id: str, 
+        message_count: int, 
+        created_at: Any, 
+        updated_at: Any, 
+        first_query: str
+    ):
+        summary_id = self.backend.insert_id(cursor, '''
+            INSERT INTO conversation_summary (conversation_id, message_count, created_at, updated_at, first_query)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (
+            conversation_id, message_count, created_at, updated_at,
+            first_query[:100] + "..." if len(first_query) > 100 else first_query
+        ))
+        if self.full_text_search:
+            cursor.execute('''
+                INSERT INTO conversation_search (rowid, first_query) VALUES (?, ?)
+            ''', (summary_id, first_query))
+    
+    def _add_missing_columns(self, cursor, table: str, columns: Dict[str, str]):
+        """Add columns introduced after a table was first created"""
+        existing = self.backend.column_names(cursor, table)
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+    
+    async def _run(self, work: Callable, error_message: str) -> Any:
+        """Run work(cursor) in a transaction on a pooled connection, off the event loop"""
+        try:
+            return await self.pool.run(work)
+        except self.pool.Error as e:
+            logger.error(f"{error_message}: {e}")
+            raise
+    
+    def _row_dict(self, cursor, row: Tuple) -> Dict[str, Any]:
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+    
+    def _as_datetime(self, value: Any) -> datetime:
+        # SQLite returns timestamps as text, PostgreSQL as datetime
+        return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    
+    def close(self):
+        """Write any queued conversation writes and close the pooled connections
         
+        The connections are closed even if the writes fail; the error is
+        raised after logging the writes that are lost.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
         try:
+            if self._pending_writes:
+                try:
+                    self.pool.run_sync(self._write_conversations, self._pending_writes)
+                except self.pool.Error as e:
+                    logger.error(f"Lost {len(self._pending_writes)} queued conversation writes: {e}")
+                    raise
+                self._pending_writes = []
+                self._overlay.clear()
+        finally:
+            self.pool.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.pool.get_stats(),
+            "pending_conversation_writes": len(self._pending_writes),
+            "conversation_flushes": self.flushes,
+            "conversation_writes": self.flushed_writes,
+            "conversation_flush_errors": self.flush_errors,
+            "history_cache": {
+                "entries": len(self._history_cache),
+                "max_entries": self.history_cache_size,
+                "window": self.history_window,
+                "hits": self.history_hits,
+                "misses": self.history_misses
+            }
+        }
+    
+    def _get_flush_lock(self) -> asyncio.Lock:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        return self._flush_lock
+    
+    async def _queue_write(self, write: _PendingWrite):
+        self._remember_write(write)
+        self._pending_writes.append(write)
+        self._overlay.setdefault(write.conversation_id, []).append(write)
+        if not self.flush_delay or len(self._pending_writes) >= self.flush_rows:
+            await self.flush()
+        elif self._flush_handle is None:
+            self._schedule_flush(self.flush_delay)
+    
+    def _schedule_flush(self, delay: float):
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, lambda: loop.create_task(self._flush_queued()))
+    
+    async def _flush_queued(self):
+        try:
+            await self.flush()
+        except self.pool.Error:
+            # Already logged, and flush scheduled the retry
+            pass
+    
+    async def drain(self):
+        """Flush the queued conversation writes, retrying failed flushes
+        
+        Meant for shutdown: raises the last error if the writes still fail
+        after DRAIN_ATTEMPTS flushes.
+        """
+        for attempt in range(1, self.DRAIN_ATTEMPTS + 1):
+            try:
+                await self.flush()
+                return
+            except self.pool.Error:
+                if attempt == self.DRAIN_ATTEMPTS:
+                    raise
+                await asyncio.sleep(self.FLUSH_RETRY_MIN * 2 ** (attempt - 1))
+    
+    async def flush(self):
+        """Commit the queued conversation writes in one transaction"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        async with self._get_flush_lock():
+            batch, self._pending_writes = self._pending_writes, []
+            if not batch:
+                return
+            try:
+                await self._run(lambda cursor: self._write_conversations(cursor, batch), "Error writing conversations")
+            except self.pool.Error:
+                # Keep the writes queued, in order, and retry them later
+                self._pending_writes[:0] = batch
+                self._flush_failures += 1
+                self.flush_errors += 1
+                if self._flush_handle is None:
+                    delay = min(
+                        self.FLUSH_RETRY_MAX,
+                        max(self.flush_delay, self.FLUSH_RETRY_MIN) * 2 ** (self._flush_failures - 1)
+                    )
+                    logger.warning(f"Retrying {len(self._pending_writes)} queued conversation writes in {delay:.1f}s")
+                    self._schedule_flush(delay)
+                raise
+            self._flush_failures = 0
+            for write in batch:
+                writes = self._overlay[write.conversation_id]
+                writes.remove(write)
+                if not writes:
+                    del self._overlay[write.conversation_id]
+            self.flushes += 1
+            self.flushed_writes += len(batch)
+    
+    def _write_conversations(self, cursor, batch: List[_PendingWrite]):
+        # In queue order, so an update applies to the turn stored before it
+        for write in batch:
+            if write.kind == "insert":
+                row_id = self.backend.insert_id(cursor, '''
+                    INSERT INTO conversations (conversation_id, query, response, timestamp)
+                    VALUES (?, ?, ?, ?)
+                ''', (write.conversation_id, write.query, write.response, write.timestamp))
+                
+                cursor.execute('''
+                    UPDATE conversation_summary
+                    SET message_count = message_count + 1, updated_at = ?
+                    WHERE conversation_id = ?
+                ''', (write.timestamp, write.conversation_id))
+                if cursor.rowcount == 0:
+                    self._insert_conversation_summary(
+                        cursor, write.conversation_id, 1, write.timestamp, write.timestamp, write.query
+                    )
+            else:
+                # Update the most recent conversation entry
+                cursor.execute('''
+                    SELECT id FROM conversations 
+                    WHERE conversation_id = ? 
+                    ORDER BY timestamp DESC 
+                    LIMIT 1
+                ''', (write.conversation_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    continue
+                row_id = row[0]
+                cursor.execute('''
+                    UPDATE conversations SET response = ?, sources = NULL WHERE id = ?
+                ''', (write.response, row_id))
+                cursor.execute('''
+                    DELETE FROM conversation_sources WHERE conversation_row_id = ?
+                ''', (row_id,))
+                cursor.execute('''
+                    UPDATE conversation_summary SET updated_at = ? WHERE conversation_id = ?
+                ''', (write.timestamp, write.conversation_id))
+            
+            texts = {
+                source['content_hash']: source['text'] for source in write.sources if source['content_hash']
+            }
+            cursor.executemany('''
+                INSERT INTO source_texts (content_hash, text)
+                VALUES (?, ?)
+                ON CONFLICT DO NOTHING
+            ''', list(texts.items()))
+            cursor.executemany('''
+                INSERT INTO conversation_sources
+                    (conversation_row_id, source_order, document_id, chunk_id, source, page, score, text, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (
+                    row_id, i, source['document_id'], source['chunk_id'], source['source'], source['page'],
+                    source['score'], None if source['content_hash'] else source['text'], source['content_hash']
+                )
+                for i, source in enumerate(write.sources)
+            ])
+    
+    def _source_records(self, sources: List[Any]) -> List[Dict[str, Any]]:
+        """Stored form of sources; chunks of the document store get the content hash of their text"""
+        records = []
+        for source in sources:
+            document_id = getattr(source, 'document_id', None)
+            chunk_id = getattr(source, 'chunk_id', None)
+            is_chunk = document_id is not None and chunk_id is not None
+            records.append({
+                'text': source.text,
+                'source': source.source,
+                'page': getattr(source, 'page', None),
+                'score': source.score,
+                'document_id': document_id,
+                'chunk_id': chunk_id,
+                'content_hash': hashlib.sha256(source.text.encode("utf-8")).hexdigest() if is_chunk else None
+            })
+        return records
+    
+    def _read_sources(self, cursor, row_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """Sources of conversation rows in stored order, chunk texts read from source_texts"""
+        sources = {}
+        # Stay well below SQLite's limit on bound parameters
+        for i in range(0, len(row_ids), 500):
+            batch = row_ids[i:i + 500]
+            cursor.execute(f'''
+                SELECT s.conversation_row_id, s.document_id, s.chunk_id, s.source, s.page, s.score,
+                       COALESCE(s.text, t.text, '')
+                FROM conversation_sources s
+                LEFT JOIN source_texts t ON t.content_hash = s.content_hash
+                WHERE s.conversation_row_id IN ({', '.join('?' * len(batch))})
+                ORDER BY s.conversation_row_id, s.source_order
+            ''', batch)
+            for row_id, document_id, chunk_id, source, page, score, text in cursor.fetchall():
+                sources.setdefault(row_id, []).append({
+                    'text': text,
+                    'source': source,
+                    'page': page,
+                    'score': score,
+                    'document_id': document_id,
+                    'chunk_id': chunk_id
+                })
+        return sources
+    
+    async def store_document(self, document_id: str, filename: str, chunks_count: int, content_hash: str = None):
+        """Store document metadata, replacing that of an earlier version"""
+        def store(cursor):
+            cursor.execute('''
+                INSERT INTO documents (id, filename, chunks_count, content_hash)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    filename = excluded.filename,
+                    chunks_count = excluded.chunks_count,
+                    content_hash = excluded.content_hash,
+                    upload_date = CURRENT_TIMESTAMP
+            ''', (document_id, filename, chunks_count, content_hash))
+        
+        await self._run(store, "Error storing document")
+        logger.info(f"Document stored: {filename} ({chunks_count} chunks)")
+    
+    async def get_document(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """Get document metadata"""
+        def get(cursor):
+            cursor.execute('''
+                SELECT id, filename, chunks_count, upload_date, content_hash
+                FROM documents
+                WHERE id = ?
+            ''', (document_id,))
+            
+            row = cursor.fetchone()
+            return self._row_dict(cursor, row) if row else None
+        
+        return await self._run(get, "Error getting document")
+    
+    async def delete_document(self, document_id: str):
+        """Delete document metadata"""
+        def delete(cursor):
+            cursor.execute('''
+                DELETE FROM documents WHERE id = ?
+            ''', (document_id,))
+        
+        await self._run(delete, "Error deleting document")
+        logger.info(f"Document deleted: {document_id}")
+    
+    async def get_document_by_hash(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        """Find a previously uploaded document with the same file contents"""
+        def get(cursor):
             cursor.execute('''
-                INSERT INTO documents (id, filename, chunks_count)
+                SELECT id, filename, chunks_count, upload_date, content_hash
+                FROM documents
+                WHERE content_hash = ?
+                ORDER BY upload_date
+                LIMIT 1
+            ''', (content_hash,))
+            
+            row = cursor.fetchone()
+            return self._row_dict(cursor, row) if row else None
+        
+        return await self._run(get, "Error looking up document by hash")
+    
+    async def get_chunk_embeddings(self, content_hashes: List[str], model_name: str) -> Dict[str, bytes]:
+        """Get cached embeddings (float32 bytes) for the chunk hashes that have one"""
+        def get(cursor):
+            embeddings = {}
+            unique_hashes = list(dict.fromkeys(content_hashes))
+            # Stay well below SQLite's limit on bound parameters
+            for i in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[i:i + 500]
+                cursor.execute(f'''
+                    SELECT content_hash, embedding FROM chunk_embeddings
+                    WHERE model_name = ? AND content_hash IN ({', '.join('?' * len(batch))})
+                ''', (model_name, *batch))
+                embeddings.update((content_hash, bytes(embedding)) for content_hash, embedding in cursor.fetchall())
+            return embeddings
+        
+        return await self._run(get, "Error getting chunk embeddings")
+    
+    async def store_chunk_embeddings(self, embeddings: List[Tuple[str, bytes]], model_name: str):
+        """Cache chunk embeddings (content hash, float32 bytes) for later uploads"""
+        if not embeddings:
+            return
+        def store(cursor):
+            cursor.executemany('''
+                INSERT INTO chunk_embeddings (content_hash, model_name, embedding)
                 VALUES (?, ?, ?)
-            ''', (document_id, filename, chunks_count))
+                ON CONFLICT DO NOTHING
+            ''', [(content_hash, model_name, embedding) for content_hash, embedding in embeddings])
+        
+        await self._run(store, "Error storing chunk embeddings")
+    
+    async def create_job(self, job_id: str, document_id: str, filename: str):
+        """Store a new queued ingestion job, owned by this process"""
+        def create(cursor):
+            cursor.execute('''
+                INSERT INTO ingestion_jobs (id, document_id, filename, status, owner)
+                VALUES (?, ?, ?, 'queued', ?)
+            ''', (job_id, document_id, filename, JOB_OWNER))
+        
+        await self._run(create, "Error creating ingestion job")
+    
+    async def reap_interrupted_jobs(self) -> int:
+        """Mark queued or running jobs whose process is gone as failed
+        
+        Their uploads went with the process, so they can never finish.
+        Jobs of processes still running, such as other workers sharing the
+        database, are left alone. Returns the number of jobs marked failed.
+        """
+        def reap(cursor):
+            cursor.execute('''
+                SELECT id, owner FROM ingestion_jobs WHERE status IN ('queued', 'running')
+            ''')
             
-            conn.commit()
-            logger.info(f"Document stored: {filename} ({chunks_count} chunks)")
+            orphaned = [(job_id,) for job_id, owner in cursor.fetchall() if not _job_owner_alive(owner)]
+            if orphaned:
+                cursor.executemany('''
+                    UPDATE ingestion_jobs
+                    SET status = 'failed', error = 'Interrupted by server restart', finished_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status IN ('queued', 'running')
+                ''', orphaned)
+            return len(orphaned)
+        
+        reaped = await self._run(reap, "Error reaping interrupted ingestion jobs")
+        if reaped:
+            logger.info(f"Marked {reaped} interrupted ingestion jobs as failed")
+        return reaped
+    
+    async def update_job(self, job_id: str, **fields):
+        """Update progress fields of an ingestion job"""
+        unknown = set(fields) - set(self.JOB_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        
+        if 'stage_timings' in fields:
+            fields['stage_timings'] = json.dumps(fields['stage_timings'])
+        
+        assignments = [f"{column} = ?" for column in fields]
+        assignments.append("updated_at = CURRENT_TIMESTAMP")
+        if fields.get('status') in ('completed', 'failed'):
+            assignments.append("finished_at = CURRENT_TIMESTAMP")
+        
+        def update(cursor):
+            cursor.execute(
+                f"UPDATE ingestion_jobs SET {', '.join(assignments)} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+        
+        await self._run(update, "Error updating ingestion job")
+    
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get an ingestion job with its progress"""
+        def get(cursor):
+            cursor.execute('''
+                SELECT * FROM ingestion_jobs WHERE id = ?
+            ''', (job_id,))
             
-        except sqlite3.Error as e:
-            logger.error(f"Error storing document: {e}")
-            raise
-        finally:
-            conn.close()
+            row = cursor.fetchone()
+            return self._job_from_row(cursor, row) if row else None
+        
+        return await self._run(get, "Error getting ingestion job")
+    
+    async def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """List the most recent ingestion jobs"""
+        def list_recent(cursor):
+            cursor.execute(f'''
+                SELECT * FROM ingestion_jobs
+                ORDER BY created_at DESC, {self.backend.insertion_order} DESC
+                LIMIT ?
+            ''', (limit,))
+            
+            return [self._job_from_row(cursor, row) for row in cursor.fetchall()]
+        
+        return await self._run(list_recent, "Error listing ingestion jobs")
+    
+    def _job_from_row(self, cursor, row: Tuple) -> Dict[str, Any]:
+        job = self._row_dict(cursor, row)
+        job['stage_timings'] = json.loads(job['stage_timings']) if job['stage_timings'] else {}
+        return job
     
     async def store_conversation(
         self, 
@@ -96,34 +726,12 @@ class DatabaseService:
         sources: List[Any]
     ):
         """Store a conversation message"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            # Convert sources to JSON string
-            sources_json = json.dumps([
-                {
-                    'text': source.text,
-                    'source': source.source,
-                    'page': source.page,
-                    'score': source.score
-                }
-                for source in sources
-            ])
-            
-            cursor.execute('''
-                INSERT INTO conversations (conversation_id, query, response, sources)
-                VALUES (?, ?, ?, ?)
-            ''', (conversation_id, query, response, sources_json))
-            
-            conn.commit()
-            logger.info(f"Conversation stored for ID: {conversation_id}")
-            
-        except sqlite3.Error as e:
-            logger.error(f"Error storing conversation: {e}")
-            raise
-        finally:
-            conn.close()
+        # Timestamped now rather than when the queue is flushed
+        timestamp = datetime.utcnow().isoformat(sep=' ', timespec='microseconds')
+        await self._queue_write(
+            _PendingWrite("insert", conversation_id, response, self._source_records(sources), query, timestamp)
+        )
+        logger.info(f"Conversation stored for ID: {conversation_id}")
     
     async def update_conversation_response(
         self, 
@@ -132,84 +740,139 @@ class DatabaseService:
         new_sources: List[Any]
     ):
         """Update the latest conversation response (for web search results)"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # The conversation was active now, which orders list_conversations
+        timestamp = datetime.utcnow().isoformat(sep=' ', timespec='microseconds')
+        await self._queue_write(
+            _PendingWrite("update", conversation_id, new_response, self._source_records(new_sources), timestamp=timestamp)
+        )
+        logger.info(f"Conversation response updated for ID: {conversation_id}")
+    
+    async def get_conversation_history(
+        self, 
+        conversation_id: str, 
+        limit: int = None, 
+        include_sources: bool = True
+    ) -> List[Dict[str, Any]]:
+        """Get conversation history for a specific conversation
         
-        try:
-            # Convert sources to JSON string
-            sources_json = json.dumps([
-                {
-                    'text': source.text,
-                    'source': source.source,
-                    'page': getattr(source, 'page', None),
-                    'score': source.score
-                }
-                for source in new_sources
-            ])
-            
-            # Update the most recent conversation entry
-            cursor.execute('''
-                UPDATE conversations 
-                SET response = ?, sources = ?
-                WHERE conversation_id = ? 
-                AND id = (
-                    SELECT id FROM conversations 
-                    WHERE conversation_id = ? 
-                    ORDER BY timestamp DESC 
-                    LIMIT 1
-                )
-            ''', (new_response, sources_json, conversation_id, conversation_id))
+        With a limit, only the latest turns are read; without sources,
+        the stored sources are not read.
+        """
+        sources_column = "sources" if include_sources else "NULL"
+        def get(cursor):
+            if limit is None:
+                cursor.execute(f'''
+                    SELECT id, query, response, {sources_column}, timestamp
+                    FROM conversations
+                    WHERE conversation_id = ?
+                    ORDER BY timestamp ASC
+                ''', (conversation_id,))
+                
+                rows = cursor.fetchall()
+            else:
+                cursor.execute(f'''
+                    SELECT id, query, response, {sources_column}, timestamp
+                    FROM conversations
+                    WHERE conversation_id = ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                ''', (conversation_id, limit))
+                
+                rows = cursor.fetchall()[::-1]
             
-            conn.commit()
-            logger.info(f"Conversation response updated for ID: {conversation_id}")
+            if not include_sources:
+                return [(query, response, None, timestamp) for _, query, response, _, timestamp in rows]
+            row_sources = self._read_sources(cursor, [row[0] for row in rows])
+            return [
+                (query, response, self._row_sources(row_sources, row_id, sources_json), timestamp)
+                for row_id, query, response, sources_json, timestamp in rows
+            ]
+        
+        if conversation_id in self._overlay:
+            # Queued writes must be read either from the database or from
+            # the overlay, so no flush may commit them in between
+            async with self._get_flush_lock():
+                results = await self._run(get, "Error getting conversation history")
+                results = self._apply_overlay(conversation_id, results)
+        else:
+            results = await self._run(get, "Error getting conversation history")
+        if limit is not None:
+            results = results[-limit:] if limit > 0 else []
+        
+        history = []
+        for row in results:
+            query, response, sources, timestamp = row
+            turn = {
+                'query': query,
+                'response': response,
+                'timestamp': timestamp
+            }
+            if include_sources:
+                turn['sources'] = sources
             
-        except sqlite3.Error as e:
-            logger.error(f"Error updating conversation response: {e}")
-            raise
-        finally:
-            conn.close()
+            history.append(turn)
+        
+        return history
     
-    async def get_conversation_history(self, conversation_id: str) -> List[Dict[str, Any]]:
-        """Get conversation history for a specific conversation"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    async def get_recent_history(self, conversation_id: str) -> List[Dict[str, Any]]:
+        """The last history_window turns of a conversation, without sources, from the cache when possible"""
+        window = self._history_cache.get(conversation_id)
+        if window is not None:
+            self._history_cache.move_to_end(conversation_id)
+            self.history_hits += 1
+            return list(window)
         
+        self.history_misses += 1
+        # Concurrent loads of one conversation are not cached, nor is a load
+        # that a write may have missed
+        loading = conversation_id not in self._history_loading
+        if loading:
+            self._history_loading[conversation_id] = False
         try:
-            cursor.execute('''
-                SELECT query, response, sources, timestamp
-                FROM conversations
-                WHERE conversation_id = ?
-                ORDER BY timestamp ASC
-            ''', (conversation_id,))
-            
-            results = cursor.fetchall()
-            
-            history = []
-            for row in results:
-                query, response, sources_json, timestamp = row
-                sources = json.loads(sources_json) if sources_json else []
-                
-                history.append({
-                    'query': query,
-                    'response': response,
-                    'sources': sources,
-                    'timestamp': timestamp
-                })
-            
-            return history
-            
-        except sqlite3.Error as e:
-            logger.error(f"Error getting conversation history: {e}")
-            raise
+            window = await self.get_conversation_history(conversation_id, self.history_window, include_sources=False)
         finally:
-            conn.close()
+            written = self._history_loading.pop(conversation_id) if loading else True
+        if not written and self.history_cache_size > 0:
+            self._history_cache[conversation_id] = list(window)
+            if len(self._history_cache) > self.history_cache_size:
+                self._history_cache.popitem(last=False)
+        return window
+    
+    def _remember_write(self, write: _PendingWrite):
+        """Apply a conversation write to its cached history window"""
+        if write.conversation_id in self._history_loading:
+            self._history_loading[write.conversation_id] = True
+        window = self._history_cache.get(write.conversation_id)
+        if window is None:
+            return
+        # Turns are replaced, never changed, as callers may hold them
+        if write.kind == "insert":
+            window.append({'query': write.query, 'response': write.response, 'timestamp': write.timestamp})
+            del window[:-self.history_window]
+        elif window:
+            window[-1] = {**window[-1], 'response': write.response}
+    
+    def _apply_overlay(self, conversation_id: str, rows: List[Tuple]) -> List[Tuple]:
+        """Rows of get_conversation_history with the conversation's queued writes applied"""
+        rows = list(rows)
+        for write in self._overlay.get(conversation_id, []):
+            if write.kind == "insert":
+                rows.append((write.query, write.response, write.sources, write.timestamp))
+            elif rows:
+                query, _, _, timestamp = rows[-1]
+                rows[-1] = (query, write.response, write.sources, timestamp)
+        return rows
+    
+    def _row_sources(self, row_sources: Dict[int, List[Dict[str, Any]]], row_id: int, sources_json: str) -> List[Dict[str, Any]]:
+        # Turns stored before conversation_sources keep theirs as JSON
+        if row_id in row_sources:
+            return row_sources[row_id]
+        return json.loads(sources_json) if sources_json else []
     
     async def get_conversation_messages(self, conversation_id: str) -> List[Any]:
         """Get conversation messages in the format expected by the API"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
+        await self.flush()
+        def get(cursor):
             cursor.execute('''
                 SELECT id, query, response, sources, timestamp
                 FROM conversations
@@ -217,105 +880,146 @@ class DatabaseService:
                 ORDER BY timestamp ASC
             ''', (conversation_id,))
             
-            results = cursor.fetchall()
-            
-            from models.models import ConversationMessage, Source
-            
-            messages = []
-            for row in results:
-                msg_id, query, response, sources_json, timestamp = row
-                sources = []
-                
-                if sources_json:
-                    sources_data = json.loads(sources_json)
-                    sources = [
-                        Source(
-                            text=s['text'],
-                            source=s['source'],
-                            page=s.get('page'),
-                            score=s['score']
-                        )
-                        for s in sources_data
-                    ]
-                
-                messages.append(ConversationMessage(
-                    id=msg_id,
-                    conversation_id=conversation_id,
-                    query=query,
-                    response=response,
-                    sources=sources,
-                    timestamp=datetime.fromisoformat(timestamp)
-                ))
-            
-            return messages
+            rows = cursor.fetchall()
+            row_sources = self._read_sources(cursor, [row[0] for row in rows])
+            return [
+                (row_id, query, response, self._row_sources(row_sources, row_id, sources_json), timestamp)
+                for row_id, query, response, sources_json, timestamp in rows
+            ]
+        
+        results = await self._run(get, "Error getting conversation messages")
+        
+        from models.models import ConversationMessage, Source
+        
+        messages = []
+        for row in results:
+            msg_id, query, response, sources_data, timestamp = row
+            sources = [
+                Source(
+                    text=s['text'],
+                    source=s['source'],
+                    page=s.get('page'),
+                    score=s['score']
+                )
+                for s in sources_data
+            ]
             
-        except sqlite3.Error as e:
-            logger.error(f"Error getting conversation messages: {e}")
-            raise
-        finally:
-            conn.close()
+            messages.append(ConversationMessage(
+                id=msg_id,
+                conversation_id=conversation_id,
+                query=query,
+                response=response,
+                sources=sources,
+                timestamp=self._as_datetime(timestamp)
+            ))
+        
+        return messages
     
-    async def list_conversations(self) -> List[Dict[str, Any]]:
-        """List all unique conversations with metadata"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    async def list_conversations(self, limit: int = 50, after: str = None, search: str = None) -> Dict[str, Any]:
+        """List conversations with metadata, most recently active first
         
-        try:
-            cursor.execute('''
-                SELECT 
-                    conversation_id,
-                    COUNT(*) as message_count,
-                    MIN(timestamp) as created_at,
-                    MAX(timestamp) as updated_at,
-                    MIN(query) as first_query
-                FROM conversations
-                GROUP BY conversation_id
-                ORDER BY MAX(timestamp) DESC
-            ''')
-            
-            results = cursor.fetchall()
-            
-            conversations = []
-            for row in results:
-                conv_id, msg_count, created_at, updated_at, first_query = row
-                conversations.append({
-                    'conversation_id': conv_id,
-                    'message_count': msg_count,
-                    'created_at': created_at,
-                    'updated_at': updated_at,
-                    'first_query': first_query[:100] + "..." if len(first_query) > 100 else first_query
-                })
-            
-            return conversations
+        Returns a page of at most limit conversations and the cursor of the
+        next page (None on the last one); pass it as after to continue.
+        search keeps the conversations whose first query contains all its words.
+        """
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        conditions, params = [], []
+        if after:
+            updated_at, summary_id = self._decode_cursor(after)
+            conditions.append("(s.updated_at, s.id) < (?, ?)")
+            params += [updated_at, summary_id]
+        
+        search = (search or "").strip()
+        
+        await self.flush()
+        def list_page(cursor):
+            # Whether full-text search is available is known once the
+            # schema was created, which the first query does
+            join = ""
+            if search and self.full_text_search:
+                join = "JOIN conversation_search ON conversation_search.rowid = s.id"
+                conditions.append("conversation_search MATCH ?")
+                # Each word as a quoted phrase, so FTS5 query syntax is not interpreted
+                params.append(" ".join('"' + word.replace('"', '""') + '"' for word in search.split()))
+            elif search:
+                for word in search.split():
+                    conditions.append("s.first_query LIKE ? ESCAPE '\\'")
+                    params.append("%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+            cursor.execute(f'''
+                SELECT s.id, s.conversation_id, s.message_count, s.created_at, s.updated_at, s.first_query
+                FROM conversation_summary s {join}
+                {"WHERE " + " AND ".join(conditions) if conditions else ""}
+                ORDER BY s.updated_at DESC, s.id DESC
+                LIMIT ?
+            ''', (*params, limit + 1))
             
-        except sqlite3.Error as e:
-            logger.error(f"Error listing conversations: {e}")
-            raise
-        finally:
-            conn.close()
+            return cursor.fetchall()
+        
+        results = await self._run(list_page, "Error listing conversations")
+        
+        conversations = []
+        for row in results[:limit]:
+            summary_id, conv_id, msg_count, created_at, updated_at, first_query = row
+            conversations.append({
+                'conversation_id': conv_id,
+                'message_count': msg_count,
+                'created_at': created_at,
+                'updated_at': updated_at,
+                'first_query': first_query
+            })
+        
+        next_cursor = None
+        if len(results) > limit:
+            summary_id, _, _, _, updated_at, _ = results[limit - 1]
+            next_cursor = self._encode_cursor(updated_at, summary_id)
+        return {'conversations': conversations, 'next_cursor': next_cursor}
+    
+    def _encode_cursor(self, updated_at: Any, summary_id: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([str(updated_at), summary_id]).encode('utf-8')).decode('ascii')
+    
+    def _decode_cursor(self, value: str) -> Tuple[str, int]:
+        try:
+            updated_at, summary_id = json.loads(base64.urlsafe_b64decode(value.encode('ascii')))
+            return str(updated_at), int(summary_id)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid conversations cursor")
     
     async def delete_conversation(self, conversation_id: str):
         """Delete a conversation"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
+        await self.flush()
+        def delete(cursor):
+            if self.full_text_search:
+                cursor.execute('''
+                    DELETE FROM conversation_search WHERE rowid IN (
+                        SELECT id FROM conversation_summary WHERE conversation_id = ?
+                    )
+                ''', (conversation_id,))
+            cursor.execute('''
+                DELETE FROM conversation_summary WHERE conversation_id = ?
+            ''', (conversation_id,))
+            cursor.execute('''
+                DELETE FROM conversation_sources WHERE conversation_row_id IN (
+                    SELECT id FROM conversations WHERE conversation_id = ?
+                )
+            ''', (conversation_id,))
             cursor.execute('''
                 DELETE FROM conversations WHERE conversation_id = ?
             ''', (conversation_id,))
-            
-            conn.commit()
-            logger.info(f"Conversation deleted: {conversation_id}")
-            
-        except sqlite3.Error as e:
-            logger.error(f"Error deleting conversation: {e}")
-            raise
-        finally:
-            conn.close()
+        
+        await self._run(delete, "Error deleting conversation")
+        self._history_cache.pop(conversation_id, None)
+        if conversation_id in self._history_loading:
+            self._history_loading[conversation_id] = True
+        logger.info(f"Conversation deleted: {conversation_id}")
 
-# Global instance
-database_service = DatabaseService()
+# Global instance, created by the first get_db() call rather than on import
+database_service: Optional[DatabaseService] = None
 
 def get_db():
     """Dependency to get database service"""
-    return database_service 
\ No newline at end of file
+    global database_service
+    if database_service is None:
+        database_service = DatabaseService()
+    return database_service 
+
@@ -0,0 +1,250 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Set
+import functools
+import threading
+import asyncio
+import logging
+import sqlite3
+import queue
+
+logger = logging.getLogger(__name__)
+
+class SQLiteBackend:
+    """SQLite file opened in WAL mode.
+
+    WAL lets readers run alongside the single writer, and with it
+    ``synchronous = NORMAL`` only syncs at checkpoints while staying
+    consistent after a crash. Each connection keeps up to 256 prepared
+    statements, keyed by SQL text.
+    """
+
+    name = "sqlite"
+    Error = sqlite3.Error
+    # Dialect pieces the schema and queries differ on
+    autoincrement_key = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    blob_type = "BLOB"
+    insertion_order = "rowid"
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA busy_timeout = 5000",  # Wait for the writer lock instead of failing
+        "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA mmap_size = 268435456"
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        # Every connection to :memory: is a separate database
+        self.max_connections = 1 if path == ":memory:" else None
+
+    def connect(self) -> sqlite3.Connection:
+        # Pooled connections move between the database threads, one at a time
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def cursor(self, conn: sqlite3.Connection):
+        return conn.cursor()
+
+    def column_names(self, cursor, table: str) -> Set[str]:
+        cursor.execute(f'PRAGMA table_info({table})')
+        return {row[1] for row in cursor.fetchall()}
+
+    def insert_id(self, cursor, sql: str, params=()) -> int:
+        """Run an INSERT and return the id of the new row
+
+        lastrowid rather than RETURNING, which needs SQLite 3.35.
+        """
+        cursor.execute(sql, params)
+        return cursor.lastrowid
+
+    def is_broken(self, conn: sqlite3.Connection) -> bool:
+        return False
+
+class PostgresBackend:
+    """PostgreSQL through psycopg 3 (``pip install "psycopg[binary]"``).
+
+    The queries are written with ``?`` placeholders and SQL that both
+    databases accept; placeholders are translated per statement and every
+    statement is prepared on the server the first time a connection runs it.
+    """
+
+    name = "postgresql"
+    autoincrement_key = "BIGSERIAL PRIMARY KEY"
+    blob_type = "BYTEA"
+    insertion_order = "created_at"
+
+    def __init__(self, url: str):
+        import psycopg
+        self.psycopg = psycopg
+        self.url = url
+        self.Error = psycopg.Error
+        self.max_connections = None
+
+    def connect(self):
+        conn = self.psycopg.connect(self.url)
+        conn.prepare_threshold = 0
+        return conn
+
+    def cursor(self, conn):
+        return QmarkCursor(conn.cursor())
+
+    def column_names(self, cursor, table: str) -> Set[str]:
+        cursor.execute('''
+            SELECT column_name FROM information_schema.columns WHERE table_name = ?
+        ''', (table,))
+        return {row[0] for row in cursor.fetchall()}
+
+    def insert_id(self, cursor, sql: str, params=()) -> int:
+        """Run an INSERT into a table with an id key and return the new id"""
+        cursor.execute(f"{sql.rstrip()} RETURNING id", params)
+        return cursor.fetchone()[0]
+
+    def is_broken(self, conn) -> bool:
+        return conn.closed or conn.broken
+
+@functools.lru_cache(maxsize=512)
+def qmark_to_format(sql: str) -> str:
+    return sql.replace('%', '%%').replace('?', '%s')
+
+class QmarkCursor:
+    """Cursor wrapper accepting qmark (?) placeholders for format-style drivers"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql: str, params=()):
+        self._cursor.execute(qmark_to_format(sql), params)
+        return self
+
+    def executemany(self, sql: str, params_seq):
+        self._cursor.executemany(qmark_to_format(sql), params_seq)
+        return self
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+def create_backend(url: str):
+    """Backend for a DATABASE_URL such as sqlite:///./ragbot.db or postgresql://user@host/db"""
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("postgresql://", "postgres://")):
+        return PostgresBackend(url)
+    raise ValueError(f"Unsupported DATABASE_URL: {url}")
+
+class ConnectionPool:
+    """Bounded pool of open connections, used from dedicated database threads.
+
+    ``run`` executes a unit of work on one of ``size`` threads, so the event
+    loop never waits on the database, with a borrowed connection: opening
+    it, its pragmas and its prepared statements are paid once per
+    connection instead of once per query. The work receives a cursor and
+    is committed when it returns, or rolled back when it raises.
+
+    Nothing is opened until the first unit of work: that one first runs
+    setup(cursor), e.g. creating the schema, in a transaction of its own.
+    """
+
+    def __init__(self, backend, size: int = 4, setup: Callable = None):
+        self.backend = backend
+        self.Error = backend.Error
+        self.size = min(size, backend.max_connections or size)
+        # Most recently used first, so hot connections and caches are reused
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._setup = setup
+        self._ready = setup is None
+        self._setup_lock = threading.Lock()
+
+    async def run(self, work: Callable, *args) -> Any:
+        """Run work(cursor, *args) in a transaction, off the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(self.run_sync, work, *args))
+
+    def run_sync(self, work: Callable, *args) -> Any:
+        """Run work(cursor, *args) in a transaction on the calling thread"""
+        self.open()
+        return self._transaction(work, *args)
+
+    def open(self):
+        """Run setup now if no work has run yet, to fail early on a bad database"""
+        if self._ready:
+            return
+        with self._setup_lock:
+            if not self._ready:
+                self._transaction(self._setup)
+                self._ready = True
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="database")
+            return self._executor
+
+    def _transaction(self, work: Callable, *args) -> Any:
+        conn = self._acquire()
+        try:
+            cursor = self.backend.cursor(conn)
+            try:
+                result = work(cursor, *args)
+                conn.commit()
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            self._release(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self.backend.connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        return self._idle.get()
+
+    def _release(self, conn):
+        if self.backend.is_broken(conn):
+            # Replaced by a new connection on the next acquire
+            with self._lock:
+                self._opened -= 1
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    def close(self):
+        """Wait for running work and close every connection"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": self.backend.name,
+            "size": self.size,
+            "open": self._opened,
+            "idle": self._idle.qsize()
+        }
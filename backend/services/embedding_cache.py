@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+import threading
+import sqlite3
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class QueryEmbeddingCache:
+    """Two-tier cache of query embeddings keyed on normalized text and model.
+
+    The first tier is an in-process LRU of at most ``max_entries`` vectors.
+    With ``db_path`` set, a SQLite file backs it so that worker processes
+    share embeddings and they survive restarts. Entries older than
+    ``ttl_seconds`` are treated as missing in both tiers; a TTL of 0 keeps
+    them until they are evicted.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 1024, ttl_seconds: float = 3600, db_path: str = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (stored at, embedding)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            self._init_database()
+
+    def normalize(self, query: str) -> str:
+        """Collapse whitespace and case so trivially different spellings share an entry"""
+        return " ".join(query.split()).lower()
+
+    def get_many(self, queries: List[str]) -> List[Optional[np.ndarray]]:
+        """Cached embedding for each query, or None where there is none"""
+        keys = [self.normalize(query) for query in queries]
+        now = time.time()
+        results = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and not self._expired(entry[0], now):
+                    self._entries.move_to_end(key)
+                    results.append(entry[1])
+                else:
+                    if entry is not None:
+                        del self._entries[key]
+                    results.append(None)
+
+        missing = [key for key, result in zip(keys, results) if result is None]
+        if missing and self.db_path:
+            stored = self._load(missing, now)
+            if stored:
+                with self._lock:
+                    for key, (stored_at, embedding) in stored.items():
+                        self._remember(key, stored_at, embedding)
+                results = [
+                    stored[key][1] if result is None and key in stored else result
+                    for key, result in zip(keys, results)
+                ]
+                self.disk_hits += len([key for key in missing if key in stored])
+
+        found = len([result for result in results if result is not None])
+        self.hits += found
+        self.misses += len(results) - found
+        return results
+
+    def put_many(self, queries: List[str], embeddings: np.ndarray):
+        """Cache freshly computed query embeddings"""
+        now = time.time()
+        entries = {}
+        for query, embedding in zip(queries, embeddings):
+            entries[self.normalize(query)] = np.array(embedding, dtype='float32')
+        with self._lock:
+            for key, embedding in entries.items():
+                self._remember(key, now, embedding)
+        if self.db_path:
+            self._store(entries, now)
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counters and tier sizes"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "persistent": bool(self.db_path)
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                conn.execute('DELETE FROM query_embeddings WHERE model_name = ?', (self.model_name,))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - stored_at > self.ttl_seconds
+
+    def _remember(self, key: str, stored_at: float, embedding: np.ndarray):
+        self._entries[key] = (stored_at, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _init_database(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            # WAL lets several worker processes read while one writes
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    query TEXT NOT NULL,
+                    model_name TEXT NOT NULL,
+                    embedding BLOB NOT NULL,  -- float32 vector
+                    stored_at REAL NOT NULL,
+                    PRIMARY KEY (query, model_name)
+                )
+            ''')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _load(self, keys: List[str], now: float) -> Dict[str, tuple]:
+        conn = sqlite3.connect(self.db_path)
+        try:
+            placeholders = ', '.join('?' * len(keys))
+            rows = conn.execute(f'''
+                SELECT query, stored_at, embedding FROM query_embeddings
+                WHERE model_name = ? AND query IN ({placeholders})
+            ''', (self.model_name, *keys)).fetchall()
+            return {
+                query: (stored_at, np.frombuffer(embedding, dtype='float32'))
+                for query, stored_at, embedding in rows
+                if not self._expired(stored_at, now)
+            }
+        except sqlite3.Error as e:
+            # The disk tier is an optimization; fall back to encoding
+            logger.warning(f"Error reading query embedding cache: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def _store(self, entries: Dict[str, np.ndarray], now: float):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executemany('''
+                INSERT OR REPLACE INTO query_embeddings (query, model_name, embedding, stored_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(key, self.model_name, embedding.tobytes(), now) for key, embedding in entries.items()])
+            if self.ttl_seconds:
+                conn.execute('DELETE FROM query_embeddings WHERE stored_at < ?', (now - self.ttl_seconds,))
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing query embedding cache: {e}")
+        finally:
+            conn.close()
@@ -0,0 +1,317 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from typing import List, Dict, Tuple, Optional, BinaryIO
+import tempfile
+import hashlib
+import logging
+import time
+import uuid
+import os
+
+from .vector_store import chunk_hash
+
+logger = logging.getLogger(__name__)
+
+SPOOL_BLOCK_SIZE = 1024 * 1024
+
+class IngestionBusyError(Exception):
+    """Raised when too many uploads are already waiting to be processed"""
+
+class IngestionExecutor:
+    """Runs PDF ingestion jobs in the background, off the event loop.
+
+    Each upload is spooled to disk and becomes a job that is processed as a
+    stream: ranges of ``page_batch_size`` pages are extracted in parallel on
+    a pool of ``extract_workers`` processes (or threads) shared by all jobs,
+    reassembled in page order, chunked as pages arrive and embedded in
+    fixed-size batches on a dedicated thread next to the in-process model,
+    so peak memory depends on the batch sizes rather than the document
+    size. Progress through the stages extract, chunk, embed, index and
+    record is persisted in the ``ingestion_jobs`` table. At most
+    ``workers`` jobs run at once; beyond ``max_pending`` queued jobs new
+    uploads are rejected instead of piling up.
+    """
+
+    EXECUTOR_MODES = ("process", "thread")
+    STAGES = ("extract", "chunk", "embed", "index", "record")
+
+    def __init__(
+        self,
+        pdf_processor,
+        vector_store,
+        database_service,
+        mode: str = "process",
+        workers: int = 2,
+        max_pending: int = 8,
+        embed_batch_size: int = 64,
+        extract_workers: int = 2,
+        page_batch_size: int = 16,
+        spool_dir: str = None
+    ):
+        if mode not in self.EXECUTOR_MODES:
+            raise ValueError(f"Unknown ingestion executor mode: {mode}")
+        self.pdf_processor = pdf_processor
+        self.vector_store = vector_store
+        self.database_service = database_service
+        self.mode = mode
+        self.workers = workers
+        self.max_pending = max_pending
+        self.embed_batch_size = embed_batch_size
+        self.extract_workers = extract_workers
+        self.page_batch_size = page_batch_size
+        self.spool_dir = spool_dir or tempfile.gettempdir()
+        if mode == "process":
+            self._parse_executor = ProcessPoolExecutor(max_workers=extract_workers)
+        else:
+            self._parse_executor = ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="ingest-parse")
+        self._embed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-embed")
+        # Jobs running at once; created inside the event loop by the first job
+        self._slots = None
+        self._pending = 0
+        self._tasks = set()
+        self._jobs_by_hash = {}  # content hash -> job id of uploads being processed
+        self.chunks_embedded = 0
+        self.chunks_reused = 0
+
+    def is_busy(self) -> bool:
+        """Check whether a new upload would be rejected"""
+        return self._pending >= self.max_pending
+
+    async def submit(self, upload: BinaryIO, document_id: str, filename: str, replace: bool = False) -> Dict:
+        """Spool an uploaded PDF to disk, queue it for ingestion and return the job
+        
+        An upload whose contents match an existing document gets an already
+        completed job pointing at that document; one matching an upload still
+        being processed gets that upload's job. With replace, the upload is a
+        new version of document_id whose chunks replace the current ones
+        once it is indexed; only re-uploading the same contents is skipped.
+        """
+        if self.is_busy():
+            raise IngestionBusyError(f"{self._pending} uploads are already being processed")
+
+        self._pending += 1
+        path = None
+        try:
+            path, content_hash = await asyncio.get_running_loop().run_in_executor(None, self._spool, upload)
+            if content_hash in self._jobs_by_hash and not replace:
+                self._discard_spool(path)
+                self._pending -= 1
+                return await self.database_service.get_job(self._jobs_by_hash[content_hash])
+
+            job_id = str(uuid.uuid4())
+            if replace:
+                existing = await self.database_service.get_document(document_id)
+                if existing and existing["content_hash"] != content_hash:
+                    existing = None
+            else:
+                existing = await self.database_service.get_document_by_hash(content_hash)
+            if existing:
+                self._discard_spool(path)
+                self._pending -= 1
+                await self.database_service.create_job(job_id, existing["id"], filename)
+                await self.database_service.update_job(
+                    job_id,
+                    status="completed",
+                    chunks_total=existing["chunks_count"],
+                    chunks_embedded=existing["chunks_count"]
+                )
+                logger.info(f"{filename} is a duplicate of document {existing['id']}, skipping ingestion")
+                return await self.database_service.get_job(job_id)
+
+            await self.database_service.create_job(job_id, document_id, filename)
+        except Exception:
+            if path:
+                self._discard_spool(path)
+            self._pending -= 1
+            raise
+
+        if not replace:
+            self._jobs_by_hash[content_hash] = job_id
+        task = asyncio.get_running_loop().create_task(
+            self._run_job(job_id, path, document_id, filename, content_hash, replace)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return await self.database_service.get_job(job_id)
+
+    def _spool(self, upload: BinaryIO) -> Tuple[str, str]:
+        """Copy the upload to a temporary file, hashing it on the way"""
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.spool_dir, prefix="upload-", suffix=".pdf", delete=False) as f:
+            for block in iter(lambda: upload.read(SPOOL_BLOCK_SIZE), b""):
+                digest.update(block)
+                f.write(block)
+            return f.name, digest.hexdigest()
+
+    def _discard_spool(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def _run_job(
+        self,
+        job_id: str,
+        path: str,
+        document_id: str,
+        filename: str,
+        content_hash: str,
+        replace: bool = False
+    ):
+        timings = {stage: 0.0 for stage in self.STAGES}
+        try:
+            async with self._job_slots():
+                await self.database_service.update_job(job_id, status="running", stage="extract")
+                page_count = await self._parse(self.pdf_processor.count_pages, path)
+                await self.database_service.update_job(job_id, pages_total=page_count)
+
+                chunker = self.pdf_processor.create_chunker(filename, document_id)
+                writer = self.vector_store.create_document_writer(
+                    document_id, filename, self.embed_batch_size, replace
+                )
+                ranges = deque(self._page_ranges(page_count))
+                in_flight = deque()
+                try:
+                    streaming_started = time.perf_counter()
+                    while ranges or in_flight:
+                        # Keep every parse worker busy; results are consumed in page order
+                        while ranges and len(in_flight) < self.extract_workers:
+                            start_page, end_page = ranges.popleft()
+                            in_flight.append((end_page, asyncio.ensure_future(
+                                self._parse(self.pdf_processor.extract_pages, path, start_page, end_page)
+                            )))
+                        end_page, extraction = in_flight.popleft()
+
+                        started = time.perf_counter()
+                        pages = await extraction
+                        timings["extract"] += time.perf_counter() - started
+
+                        embedded = await self._chunk_and_embed(chunker, writer, pages, timings)
+                        await self.database_service.update_job(
+                            job_id,
+                            stage="embed",
+                            pages_done=end_page,
+                            chunks_embedded=embedded,
+                            pages_per_second=self._rate(end_page, time.perf_counter() - streaming_started),
+                            chunks_per_second=self._rate(embedded, timings["embed"]),
+                            stage_timings=timings
+                        )
+
+                    embedded = await self._chunk_and_embed(chunker, writer, None, timings)
+                    await self.database_service.update_job(
+                        job_id, stage="index", chunks_total=embedded, chunks_embedded=embedded, stage_timings=timings
+                    )
+
+                    started = time.perf_counter()
+                    chunks_count = await self._embed(writer.commit)
+                    timings["index"] = time.perf_counter() - started
+                except Exception:
+                    for _, extraction in in_flight:
+                        extraction.cancel()
+                    writer.abort()
+                    raise
+
+                if not chunks_count:
+                    raise ValueError("Could not extract text from PDF")
+                await self.database_service.update_job(job_id, stage="record", stage_timings=timings)
+
+                started = time.perf_counter()
+                await self.database_service.store_document(document_id, filename, chunks_count, content_hash)
+                timings["record"] = time.perf_counter() - started
+                await self.database_service.update_job(job_id, status="completed", stage_timings=timings)
+
+            self.chunks_embedded += chunks_count - writer.reused
+            self.chunks_reused += writer.reused
+            logger.info(
+                f"Successfully processed PDF: {filename} with {chunks_count} chunks "
+                f"({writer.reused} embeddings reused)"
+            )
+
+        except Exception as e:
+            logger.error(f"Error processing PDF {filename}: {str(e)}")
+            try:
+                await self.database_service.update_job(
+                    job_id, status="failed", error=str(e), stage_timings=timings
+                )
+            except Exception as update_error:
+                logger.error(f"Could not record failure of job {job_id}: {str(update_error)}")
+        finally:
+            self._pending -= 1
+            if self._jobs_by_hash.get(content_hash) == job_id:
+                del self._jobs_by_hash[content_hash]
+            self._discard_spool(path)
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        """Split a page count into (start, end) ranges of page_batch_size pages"""
+        return [
+            (start, min(start + self.page_batch_size, page_count))
+            for start in range(0, page_count, self.page_batch_size)
+        ]
+
+    async def _chunk_and_embed(self, chunker, writer, pages: Optional[List[Tuple[int, str]]], timings: Dict[str, float]) -> int:
+        """Chunk newly extracted pages (or flush the chunker when pages is None) and embed them
+
+        Embeddings of chunk texts seen in earlier uploads come from the
+        database; newly computed ones are stored there for later uploads.
+        """
+        chunks = await self._embed(self._chunk, chunker, pages, timings)
+        cached = await self.database_service.get_chunk_embeddings(
+            [chunk_hash(chunk["text"]) for chunk in chunks], self.vector_store.model_name
+        )
+        embedded = await self._embed(self._add_chunks, writer, chunks, cached, pages is None, timings)
+        await self.database_service.store_chunk_embeddings(
+            writer.take_new_embeddings(), self.vector_store.model_name
+        )
+        return embedded
+
+    def _chunk(self, chunker, pages: Optional[List[Tuple[int, str]]], timings: Dict[str, float]) -> List[Dict]:
+        started = time.perf_counter()
+        if pages is None:
+            chunks = chunker.finish()
+        else:
+            chunks = [chunk for page_num, page_text in pages for chunk in chunker.add_page(page_num, page_text)]
+        timings["chunk"] += time.perf_counter() - started
+        return chunks
+
+    def _add_chunks(self, writer, chunks: List[Dict], cached: Dict[str, bytes], final: bool, timings: Dict[str, float]) -> int:
+        started = time.perf_counter()
+        embedded = writer.add(chunks, cached)
+        if final:
+            # Embed the final partial batch as well
+            writer.flush()
+            embedded = writer.rows
+        timings["embed"] += time.perf_counter() - started
+        return embedded
+
+    def _job_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        return self._slots
+
+    async def _parse(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._parse_executor, fn, *args)
+
+    async def _embed(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._embed_executor, fn, *args)
+
+    def _rate(self, count: int, seconds: float) -> float:
+        return count / seconds if seconds > 0 else 0.0
+
+    def get_stats(self) -> Dict:
+        """Executor configuration and current load"""
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "extract_workers": self.extract_workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "chunks_embedded": self.chunks_embedded,
+            "chunks_reused": self.chunks_reused
+        }
+
+    def shutdown(self):
+        self._parse_executor.shutdown(wait=True)
+        self._embed_executor.shutdown(wait=True)
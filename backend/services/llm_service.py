@@ -1,13 +1,15 @@
 import os
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
 from openai import AsyncOpenAI
 from .web_search import web_search_service
+from .context_builder import ContextBuilder
 import logging
 
 logger = logging.getLogger(__name__)
 
 class LLMService:
     def __init__(self):
+        self.context_builder = ContextBuilder()
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             logger.warning("OPENAI_API_KEY not found. LLM functionality will be disabled.")
@@ -41,25 +43,7 @@ class LLMService:
         if not self.is_available():
             return "LLM service is not available. Please configure OPENAI_API_KEY.", False, None
         
-        if conversation_history is None:
-            conversation_history = []
-        
-        # Create messages for the conversation
-        messages = [
-            {
-                "role": "system",
-                "content": self._get_system_prompt()
-            }
-        ]
-        
-        # Add conversation history
-        for msg in conversation_history[-10:]:  # Keep last 10 messages
-            messages.append({"role": "user", "content": msg["query"]})
-            messages.append({"role": "assistant", "content": msg["response"]})
-        
-        # Create the current query with context
-        user_message = self._format_user_message(query, context)
-        messages.append({"role": "user", "content": user_message})
+        messages = self._build_messages(query, context, conversation_history)
         
         try:
             response = await self.client.chat.completions.create(
@@ -80,6 +64,46 @@ class LLMService:
             logger.error(f"Error generating LLM response: {str(e)}")
             raise Exception(f"Failed to generate response: {str(e)}")
     
+    async def stream_response(
+        self, 
+        query: str, 
+        context: str = "", 
+        conversation_history: List[Dict[str, str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream the response from LLM as text deltas
+        
+        Args:
+            query: User's question
+            context: Document context from vector search
+            conversation_history: Previous conversation messages
+        
+        Yields:
+            Pieces of the response as the model produces them
+        """
+        if not self.is_available():
+            yield "LLM service is not available. Please configure OPENAI_API_KEY."
+            return
+        
+        messages = self._build_messages(query, context, conversation_history)
+        
+        try:
+            stream = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+            
+        except Exception as e:
+            logger.error(f"Error streaming LLM response: {str(e)}")
+            raise Exception(f"Failed to generate response: {str(e)}")
+    
     async def generate_response_with_web_search(
         self, 
         query: str, 
@@ -113,8 +137,8 @@ class LLMService:
             }
         ]
         
-        # Add conversation history
-        for msg in conversation_history[-10:]:  # Keep last 10 messages
+        # Add the conversation history that fits the history token budget
+        for msg in self.context_builder.trim_history(conversation_history):
             messages.append({"role": "user", "content": msg["query"]})
             messages.append({"role": "assistant", "content": msg["response"]})
         
@@ -137,6 +161,35 @@ class LLMService:
             logger.error(f"Error generating LLM response with web search: {str(e)}")
             raise Exception(f"Failed to generate response: {str(e)}")
     
+    def _build_messages(
+        self, 
+        query: str, 
+        context: str, 
+        conversation_history: List[Dict[str, str]] = None
+    ) -> List[Dict[str, str]]:
+        """Messages for answering a query from document context"""
+        if conversation_history is None:
+            conversation_history = []
+        
+        # Create messages for the conversation
+        messages = [
+            {
+                "role": "system",
+                "content": self._get_system_prompt()
+            }
+        ]
+        
+        # Add the conversation history that fits the history token budget
+        for msg in self.context_builder.trim_history(conversation_history):
+            messages.append({"role": "user", "content": msg["query"]})
+            messages.append({"role": "assistant", "content": msg["response"]})
+        
+        # Create the current query with context
+        user_message = self._format_user_message(query, context)
+        messages.append({"role": "user", "content": user_message})
+        logger.debug(f"Prompt of about {self.context_builder.count_messages(messages)} tokens")
+        return messages
+    
     def _get_system_prompt(self) -> str:
         return """You are a helpful AI assistant that answers questions based on provided document context. 
 
@@ -209,5 +262,38 @@ No document context is available. Please indicate if web search is needed to ans
         
         return "\n\n".join(contexts)
 
+class WebSearchRequestDetector:
+    """Spots the WEB_SEARCH_NEEDED marker while a response is streamed
+    
+    Only the text around each new piece is scanned, so detection stays
+    linear in the response length.
+    """
+    
+    MARKER = "WEB_SEARCH_NEEDED:"
+    
+    def __init__(self):
+        self.text = ""
+        self.marker_at = -1
+    
+    def feed(self, piece: str) -> bool:
+        """Add a piece of the response; returns True once the marker has been seen"""
+        if self.marker_at < 0:
+            # The marker may straddle the previous piece
+            scan_from = max(0, len(self.text) - len(self.MARKER) + 1)
+            self.text += piece
+            found = self.text.find(self.MARKER, scan_from)
+            if found >= 0:
+                self.marker_at = found
+        else:
+            self.text += piece
+        return self.marker_at >= 0
+    
+    def result(self) -> Tuple[bool, Optional[str]]:
+        """(needs_web_search, search_query) for the text seen so far"""
+        if self.marker_at < 0:
+            return False, None
+        search_query = self.text[self.marker_at + len(self.MARKER):].strip().strip("[]\"'")
+        return True, search_query or None
+
 # Global instance
 llm_service = LLMService() 
\ No newline at end of file
@@ -1,5 +1,5 @@
 import PyPDF2
-from typing import List, Dict
+from typing import List, Dict, Tuple, Iterator, Optional, Union
 import re
 import io
 
@@ -9,100 +9,69 @@ class PDFProcessor:
         self.chunk_overlap = chunk_overlap
     
     def process_pdf(self, file_path: str) -> List[Dict[str, any]]:
-        """Extract text from PDF and split into chunks"""
+        """Extract text from PDF and split into chunks
+        
+        Holds every chunk of the document at once; uploads stream pages
+        through iter_pages and create_chunker instead.
+        """
         try:
-            text = self._extract_text_from_pdf(file_path)
-            chunks = self._split_text_into_chunks(text, file_path)
-            return chunks
+            return self._chunk_pages(self.iter_pages(file_path), file_path)
         except Exception as e:
             raise Exception(f"Error processing PDF: {str(e)}")
-
+    
     def process_pdf_content(self, file_content: bytes, document_id: str, filename: str) -> List[Dict[str, any]]:
-        """Extract text from PDF content (bytes) and split into chunks"""
+        """Extract text from PDF content (bytes) and split into chunks, see process_pdf"""
         try:
-            text = self._extract_text_from_pdf_content(file_content)
-            chunks = self._split_text_into_chunks(text, filename)
-            # Add document_id to chunks
-            for chunk in chunks:
-                chunk['document_id'] = document_id
-            return chunks
+            return self._chunk_pages(self.iter_pages(file_content), filename, document_id)
         except Exception as e:
             raise Exception(f"Error processing PDF content: {str(e)}")
     
-    def _extract_text_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        text = ""
-        try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        # Add page marker
-                        text += f"\n[Page {page_num + 1}]\n{page_text}"
-            return text
-        except Exception as e:
-            raise Exception(f"Error extracting text from PDF: {str(e)}")
-
-    def _extract_text_from_pdf_content(self, file_content: bytes) -> str:
-        """Extract text from PDF content (bytes)"""
-        text = ""
+    def count_pages(self, source: Union[bytes, str]) -> int:
+        """Number of pages in a PDF given as bytes or a file path"""
+        return len(self._open_reader(source).pages)
+    
+    def iter_pages(self, source: Union[bytes, str], start_page: int = 0, end_page: int = None) -> Iterator[Tuple[int, str]]:
+        """Yield (page number, text) for each non-empty page, one page at a time
+        
+        start_page / end_page select a zero-based, end-exclusive page range;
+        yielded page numbers are one-based.
+        """
         try:
-            # Create a file-like object from bytes
-            pdf_file = io.BytesIO(file_content)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            for page_num, page in enumerate(pdf_reader.pages):
-                page_text = page.extract_text()
+            pdf_reader = self._open_reader(source)
+            pages = pdf_reader.pages
+            for page_num in range(start_page, min(end_page or len(pages), len(pages))):
+                page_text = pages[page_num].extract_text()
                 if page_text:
-                    # Add page marker
-                    text += f"\n[Page {page_num + 1}]\n{page_text}"
-            return text
+                    yield page_num + 1, page_text
         except Exception as e:
-            raise Exception(f"Error extracting text from PDF content: {str(e)}")
+            raise Exception(f"Error extracting text from PDF: {str(e)}")
     
-    def _split_text_into_chunks(self, text: str, source_file: str) -> List[Dict[str, any]]:
-        """Split text into overlapping chunks"""
-        # Clean the text
-        text = self._clean_text(text)
-        
+    def extract_pages(self, source: Union[bytes, str], start_page: int = 0, end_page: int = None) -> List[Tuple[int, str]]:
+        """Extract (page number, text) for the non-empty pages of a page range"""
+        return list(self.iter_pages(source, start_page, end_page))
+    
+    def create_chunker(self, source_file: str, document_id: Optional[str] = None) -> "StreamingChunker":
+        """Create a chunker that is fed one page at a time"""
+        return StreamingChunker(self, source_file, document_id)
+    
+    def _chunk_pages(
+        self,
+        pages: Iterator[Tuple[int, str]],
+        source_file: str,
+        document_id: Optional[str] = None
+    ) -> List[Dict[str, any]]:
+        chunker = self.create_chunker(source_file, document_id)
         chunks = []
-        start = 0
-        chunk_id = 0
-        
-        while start < len(text):
-            # Calculate end position
-            end = start + self.chunk_size
-            
-            # If this is not the last chunk, try to end at a sentence boundary
-            if end < len(text):
-                # Look for sentence endings near the end position
-                sentence_end = self._find_sentence_boundary(text, end)
-                if sentence_end > start:
-                    end = sentence_end
-            
-            chunk_text = text[start:end].strip()
-            
-            if chunk_text:
-                # Extract page number from chunk
-                page_match = re.search(r'\[Page (\d+)\]', chunk_text)
-                page_num = int(page_match.group(1)) if page_match else None
-                
-                # Remove page markers from chunk text
-                clean_chunk = re.sub(r'\[Page \d+\]\s*', '', chunk_text)
-                
-                chunks.append({
-                    "text": clean_chunk,
-                    "source": source_file,
-                    "chunk_id": chunk_id,
-                    "page": page_num
-                })
-                chunk_id += 1
-            
-            # Move start position with overlap
-            start = end - self.chunk_overlap if end < len(text) else len(text)
-        
+        for page_num, page_text in pages:
+            chunks.extend(chunker.add_page(page_num, page_text))
+        chunks.extend(chunker.finish())
         return chunks
     
+    def _open_reader(self, source: Union[bytes, str]) -> PyPDF2.PdfReader:
+        if isinstance(source, bytes):
+            return PyPDF2.PdfReader(io.BytesIO(source))
+        return PyPDF2.PdfReader(source)
+    
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text"""
         # Remove excessive whitespace
@@ -123,4 +92,90 @@ class PDFProcessor:
                     return position + i + 1
         
         # If no sentence boundary found, return original position
-        return position 
\ No newline at end of file
+        return position
+
+class StreamingChunker:
+    """Splits page text into overlapping chunks incrementally.
+    
+    Only text that has not been fully emitted is buffered (roughly one
+    chunk plus the current page), and the overlap carries across page
+    boundaries. Each chunk is tagged with the page it starts on.
+    """
+    
+    # _find_sentence_boundary looks up to 100 characters past the target end
+    # and one more for the following whitespace
+    LOOKAHEAD = 101
+    
+    def __init__(self, processor: PDFProcessor, source_file: str, document_id: Optional[str] = None):
+        self.processor = processor
+        self.source_file = source_file
+        self.document_id = document_id
+        self.buffer = ""
+        self.offset = 0  # Position of buffer[0] in the whole cleaned text
+        self.page_starts = []  # (position, page number) of pages still in the buffer
+        self.chunk_id = 0
+    
+    def add_page(self, page_num: int, page_text: str) -> List[Dict[str, any]]:
+        """Feed one page and return the chunks it completed"""
+        cleaned = self.processor._clean_text(page_text)
+        if not cleaned:
+            return []
+        if self.buffer:
+            self.buffer += " "
+        self.page_starts.append((self.offset + len(self.buffer), page_num))
+        self.buffer += cleaned
+        return self._drain(final=False)
+    
+    def finish(self) -> List[Dict[str, any]]:
+        """Return the remaining chunks once every page has been fed"""
+        return self._drain(final=True)
+    
+    def _drain(self, final: bool) -> List[Dict[str, any]]:
+        chunk_size = self.processor.chunk_size
+        chunks = []
+        start = 0
+        
+        while start < len(self.buffer):
+            # Until the last page is in, only cut chunks whose boundary search
+            # sees the same text it would see in the whole document
+            if not final and len(self.buffer) < start + chunk_size + self.LOOKAHEAD:
+                break
+            
+            end = start + chunk_size
+            
+            # If this is not the last chunk, try to end at a sentence boundary
+            if end < len(self.buffer):
+                sentence_end = self.processor._find_sentence_boundary(self.buffer, end)
+                if sentence_end > start:
+                    end = sentence_end
+            
+            chunk_text = self.buffer[start:end].strip()
+            if chunk_text:
+                chunk = {
+                    "text": chunk_text,
+                    "source": self.source_file,
+                    "chunk_id": self.chunk_id,
+                    "page": self._page_at(self.offset + start)
+                }
+                if self.document_id is not None:
+                    chunk["document_id"] = self.document_id
+                chunks.append(chunk)
+                self.chunk_id += 1
+            
+            # Move start position with overlap
+            start = end - self.processor.chunk_overlap if end < len(self.buffer) else len(self.buffer)
+        
+        # Drop emitted text, keeping the overlap for the next chunk
+        self.buffer = self.buffer[start:]
+        self.offset += start
+        while len(self.page_starts) > 1 and self.page_starts[1][0] <= self.offset:
+            self.page_starts.pop(0)
+        return chunks
+    
+    def _page_at(self, position: int) -> Optional[int]:
+        page = None
+        for page_start, page_num in self.page_starts:
+            if page_start > position:
+                break
+            page = page_num
+        return page
@@ -0,0 +1,144 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+import numpy as np
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+class _PendingQuery:
+    __slots__ = ("query", "top_k", "nprobe", "ef_search", "mode", "filters", "future")
+
+    def __init__(
+        self,
+        query: str,
+        top_k: int,
+        nprobe: Optional[int],
+        ef_search: Optional[int],
+        mode: str,
+        filters: Optional[Dict],
+        future: asyncio.Future
+    ):
+        self.query = query
+        self.top_k = top_k
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.mode = mode
+        self.filters = filters
+        self.future = future
+
+class QueryBatcher:
+    """Micro-batches concurrent searches in front of a VectorStore.
+
+    Queries arriving within ``max_wait_ms`` of each other (or until
+    ``max_batch_size`` are queued) are encoded in one forward pass and
+    searched together on a worker thread, so the event loop never runs the
+    model and concurrent users share encoder calls.
+    """
+
+    def __init__(self, vector_store, max_wait_ms: float = 5.0, max_batch_size: int = 32, workers: int = 1):
+        self.vector_store = vector_store
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-batcher")
+        self._pending = []
+        self._flush_handle = None
+        self.batches = 0
+        self.queries = 0
+
+    async def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        mode: Optional[str] = None,
+        filters: Optional[Dict] = None
+    ) -> List[Dict]:
+        """Queue a query for the next batch and wait for its results"""
+        mode = mode or self.vector_store.search_mode
+        if mode not in self.vector_store.SEARCH_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(_PendingQuery(query, top_k, nprobe, ef_search, mode, filters or None, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def get_stats(self) -> Dict:
+        """Batching counters"""
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "average_batch_size": self.queries / self.batches if self.batches else 0.0
+        }
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[_PendingQuery]):
+        self.batches += 1
+        self.queries += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self._search_batch, batch)
+            for pending, result in zip(batch, results):
+                if not pending.future.done():
+                    pending.future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error in batched search: {str(e)}")
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+
+    def _search_batch(self, batch: List[_PendingQuery]) -> List[List[Dict]]:
+        """Encode the batch at once, then search per distinct search setting and filter
+
+        Keyword queries are left out of the encoder pass.
+        """
+        results = [[] for _ in batch]
+        # Rows other workers committed count before deciding the store is empty
+        self.vector_store._refresh()
+        if self.vector_store.ntotal == 0:
+            return results
+
+        embeddings = None
+        encoded = [i for i, pending in enumerate(batch) if pending.mode != "keyword"]
+        if encoded:
+            embeddings = np.empty((len(batch), self.vector_store.dimension), dtype='float32')
+            embeddings[encoded] = self.vector_store.encode_queries([batch[i].query for i in encoded])
+
+        groups = {}
+        for i, pending in enumerate(batch):
+            filters_key = json.dumps(pending.filters, sort_keys=True) if pending.filters else None
+            groups.setdefault((pending.mode, pending.nprobe, pending.ef_search, filters_key), []).append(i)
+
+        for (mode, nprobe, ef_search, _), positions in groups.items():
+            top_k = max(batch[i].top_k for i in positions)
+            queries = [batch[i].query for i in positions]
+            filters = batch[positions[0]].filters
+            if mode == "keyword":
+                group_results = self.vector_store.search_keywords(queries, top_k, filters)
+            elif mode == "hybrid":
+                group_results = self.vector_store.search_hybrid(
+                    queries, embeddings[positions], top_k, nprobe, ef_search, filters
+                )
+            else:
+                group_results = self.vector_store.search_vectors(embeddings[positions], top_k, nprobe, ef_search, filters)
+            for i, group_result in zip(positions, group_results):
+                results[i] = group_result[:batch[i].top_k]
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
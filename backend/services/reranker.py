@@ -0,0 +1,90 @@
+from sentence_transformers import CrossEncoder
+from typing import List, Dict, Optional
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    """Re-orders retrieved chunks by a cross-encoder's (query, chunk) score.
+
+    Retrieval over-fetches ``candidates_factor`` times the requested
+    results, the cross-encoder scores them in batches on the CPU and only
+    the best ``top_k`` are kept for the prompt. Scoring stops as soon as
+    the next batch is not expected to finish within ``budget_ms`` of the
+    call, and the results then keep their bi-encoder order.
+    """
+
+    def __init__(
+        self,
+        model_name: str = None,
+        candidates_factor: int = None,
+        batch_size: int = None,
+        budget_ms: float = None
+    ):
+        # An empty RERANK_MODEL turns re-ranking off
+        self.model_name = model_name if model_name is not None else os.getenv("RERANK_MODEL", "")
+        self.candidates_factor = candidates_factor or int(os.getenv("RERANK_CANDIDATES_FACTOR", "4"))
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "16"))
+        self.budget_ms = budget_ms if budget_ms is not None else float(os.getenv("RERANK_BUDGET_MS", "300"))
+        self.model = None
+        if self.model_name:
+            try:
+                self.model = CrossEncoder(self.model_name, device="cpu")
+            except Exception as e:
+                logger.error(f"Could not load cross-encoder {self.model_name}: {str(e)}")
+        # One scoring call at a time; parallel calls would only split the same cores
+        self._lock = threading.Lock()
+        self.reranked = 0
+        self.fallbacks = 0
+
+    def is_available(self) -> bool:
+        return self.model is not None
+
+    def candidates(self, top_k: int) -> int:
+        """Results to retrieve so that top_k remain after re-ranking"""
+        return top_k * self.candidates_factor if self.is_available() else top_k
+
+    def rerank(self, query: str, results: List[Dict], top_k: int) -> Optional[List[Dict]]:
+        """The top_k results by cross-encoder score, each with a "rerank_score"
+
+        Returns None when the latency budget runs out first.
+        """
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        scores = []
+        with self._lock:
+            batch_seconds = 0.0
+            for start in range(0, len(results), self.batch_size):
+                if time.perf_counter() + batch_seconds > deadline:
+                    self.fallbacks += 1
+                    logger.info(f"Re-ranking exceeded {self.budget_ms:.0f} ms after {len(scores)} of {len(results)} chunks")
+                    return None
+                started = time.perf_counter()
+                batch = results[start:start + self.batch_size]
+                scores.extend(self.model.predict(
+                    [(query, result["text"]) for result in batch],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False
+                ).tolist())
+                batch_seconds = time.perf_counter() - started
+
+        order = sorted(range(len(results)), key=lambda i: scores[i], reverse=True)[:top_k]
+        reranked = []
+        for i in order:
+            result = dict(results[i])
+            result["rerank_score"] = float(scores[i])
+            reranked.append(result)
+        self.reranked += 1
+        return reranked
+
+    def get_stats(self) -> Dict:
+        return {
+            "enabled": self.is_available(),
+            "model": self.model_name or None,
+            "candidates_factor": self.candidates_factor,
+            "budget_ms": self.budget_ms,
+            "reranked": self.reranked,
+            "fallbacks": self.fallbacks
+        }
@@ -0,0 +1,908 @@
+import numpy as np
+from typing import List, Dict, Tuple, Set, Optional, BinaryIO
+from contextlib import contextmanager
+import threading
+import logging
+import bisect
+import json
+import time
+import uuid
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): only one process may write a store
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Columns of the per-segment offset index (int64 each)
+TEXT_START, TEXT_END, CHUNK_ID, PAGE, DOC_REF = range(5)
+INDEX_COLUMNS = 5
+
+class Segment:
+    """Read-only, memory-mapped view of one committed segment.
+
+    A segment is stored as three flat files: ``.f32`` holds the float32
+    embeddings, ``.txt`` the concatenated UTF-8 chunk texts and ``.idx`` an
+    int64 table with the text offsets, chunk id, page and a reference into
+    the segment's document table (kept in the log record). Nothing is read
+    until a row is accessed, and the pages are shared between processes
+    through the OS page cache.
+    """
+
+    def __init__(self, path: str, name: str, rows: int, dimension: int, documents: List[List[str]], start: int = 0):
+        self.name = name
+        self.rows = rows
+        self.documents = documents
+        self.start = start  # Position of the first row in the whole store
+        self.embeddings = np.memmap(f"{path}.f32", dtype='float32', mode='r', shape=(rows, dimension))
+        self.index = np.memmap(f"{path}.idx", dtype='int64', mode='r', shape=(rows, INDEX_COLUMNS))
+        if os.path.getsize(f"{path}.txt"):
+            self.text = np.memmap(f"{path}.txt", dtype='uint8', mode='r')
+        else:
+            self.text = np.empty(0, dtype='uint8')
+        self._pages = None  # (sorted pages, row order), built by the first page filter
+
+    def page_rows(self, page_from: int, page_to: Optional[int] = None) -> np.ndarray:
+        """Sorted local rows whose page lies in [page_from, page_to]"""
+        pages, order = self._page_index()
+        lo, hi = self._page_bounds(pages, page_from, page_to)
+        return np.sort(order[lo:hi]).astype('int64')
+
+    def _page_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._pages is None:
+            pages = np.asarray(self.index[:, PAGE])
+            order = np.argsort(pages, kind='stable').astype('int32')
+            self._pages = (pages[order].astype('int32'), order)
+        return self._pages
+
+    @staticmethod
+    def _page_bounds(pages: np.ndarray, page_from: int, page_to: Optional[int]) -> Tuple[int, int]:
+        lo = int(np.searchsorted(pages, page_from, side='left'))
+        hi = len(pages) if page_to is None else int(np.searchsorted(pages, page_to, side='right'))
+        return lo, max(lo, hi)
+
+    def chunk(self, i: int) -> "ChunkRecord":
+        """Materialize the metadata of a single row"""
+        i = int(i)
+        row = self.index[i]
+        document_id, filename = self.documents[int(row[DOC_REF])]
+        page = int(row[PAGE])
+        return ChunkRecord(
+            self.text[int(row[TEXT_START]):int(row[TEXT_END])].tobytes().decode('utf-8'),
+            filename,
+            document_id,
+            int(row[CHUNK_ID]),
+            page if page >= 0 else None,
+            self.start + i
+        )
+
+    def chunks(self) -> List["ChunkRecord"]:
+        """Metadata of every row, reading the segment files once"""
+        text = self.text.tobytes()
+        index = np.asarray(self.index)
+        return [
+            ChunkRecord(
+                text[start:end].decode('utf-8'),
+                self.documents[doc_ref][1],
+                self.documents[doc_ref][0],
+                chunk_id,
+                page if page >= 0 else None,
+                self.start + i
+            )
+            for i, (start, end, chunk_id, page, doc_ref) in enumerate(index.tolist())
+        ]
+
+    def texts(self) -> List[str]:
+        text = self.text.tobytes()
+        return [text[start:end].decode('utf-8') for start, end in self.index[:, [TEXT_START, TEXT_END]].tolist()]
+
+class ChunkRecord:
+    """Metadata of one chunk.
+
+    Slots instead of a per-chunk dict keep the in-memory chunk list at a
+    fraction of the size; the source and document id strings are shared
+    by all chunks of a document.
+    """
+
+    __slots__ = ("text", "source", "document_id", "chunk_id", "page", "index_id")
+
+    def __init__(self, text: str, source: str, document_id: str, chunk_id: int, page: Optional[int], index_id: int):
+        self.text = text
+        self.source = source
+        self.document_id = document_id
+        self.chunk_id = chunk_id
+        self.page = page
+        self.index_id = index_id
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+class MappedChunks:
+    """List-like access to chunk metadata across memory-mapped segments"""
+
+    def __init__(self, segments: List[Segment] = None):
+        self.segments = []
+        self.starts = []
+        self.total = 0
+        for segment in segments or []:
+            self.add_segment(segment)
+
+    def add_segment(self, segment: Segment):
+        self.segments.append(segment)
+        self.starts.append(self.total)
+        self.total += segment.rows
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __getitem__(self, position: int) -> ChunkRecord:
+        if position < 0:
+            position += self.total
+        if not 0 <= position < self.total:
+            raise IndexError("chunk index out of range")
+        s = bisect.bisect_right(self.starts, position) - 1
+        return self.segments[s].chunk(position - self.starts[s])
+
+class MappedFlatIndex:
+    """Exact inner-product search directly over memory-mapped segments.
+
+    Mirrors the parts of the FAISS index API the vector store relies on
+    (``ntotal`` and ``search``), so opening it costs nothing regardless of
+    corpus size.
+    """
+
+    BLOCK_ROWS = 262144
+
+    def __init__(self, dimension: int, segments: List[Segment] = None):
+        self.d = dimension
+        self.segments = []
+        self.ntotal = 0
+        for segment in segments or []:
+            self.add_segment(segment)
+
+    def add_segment(self, segment: Segment):
+        self.segments.append(segment)
+        self.ntotal += segment.rows
+
+    def search(self, queries: np.ndarray, k: int, exclude: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top k scores and row ids per query, skipping the sorted row ids in exclude"""
+        nq = len(queries)
+        best_scores = np.full((nq, k), -np.inf, dtype='float32')
+        best_ids = np.full((nq, k), -1, dtype='int64')
+
+        offset = 0
+        for segment in self.segments:
+            for block_start in range(0, segment.rows, self.BLOCK_ROWS):
+                block = segment.embeddings[block_start:block_start + self.BLOCK_ROWS]
+                scores = queries @ block.T
+                if exclude is not None and len(exclude):
+                    first, last = np.searchsorted(exclude, [offset + block_start, offset + block_start + len(block)])
+                    scores[:, exclude[first:last] - offset - block_start] = -np.inf
+                ids = np.broadcast_to(
+                    np.arange(offset + block_start, offset + block_start + len(block), dtype='int64'),
+                    scores.shape
+                )
+                # Merge the block into the running top k
+                scores = np.hstack([best_scores, scores])
+                ids = np.hstack([best_ids, ids])
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(scores, top, axis=1)
+                best_ids = np.take_along_axis(ids, top, axis=1)
+            offset += segment.rows
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_ids[np.isneginf(best_scores)] = -1
+        return best_scores, best_ids
+
+class SegmentWriter:
+    """Builds one segment incrementally.
+
+    Batches are appended straight to the segment files, so memory use is
+    bounded by the batch size rather than the document size. Until
+    ``commit`` writes the log record the segment is an orphan, which the
+    next load discards once its files are no longer held open for writing.
+    """
+
+    def __init__(self, store: "SegmentStore", name: str, files: Dict[str, BinaryIO]):
+        self.store = store
+        self.name = name
+        self.rows = 0
+        self.committed = False
+        self.documents = []  # Document table: [document_id, filename]
+        self._doc_refs = {}
+        self._text_offset = 0
+        self._files = files
+
+    def write(self, embeddings: np.ndarray, chunks: List[Dict]):
+        """Append a batch of embeddings and their chunk metadata"""
+        if len(chunks) != len(embeddings):
+            raise ValueError("Embeddings and chunk metadata must have the same length")
+
+        index = np.empty((len(chunks), INDEX_COLUMNS), dtype='int64')
+        texts = []
+        for i, chunk in enumerate(chunks):
+            key = (chunk["document_id"], chunk["source"])
+            if key not in self._doc_refs:
+                self._doc_refs[key] = len(self.documents)
+                self.documents.append(list(key))
+            text = chunk["text"].encode('utf-8')
+            page = chunk.get("page")
+            index[i] = (
+                self._text_offset,
+                self._text_offset + len(text),
+                chunk.get("chunk_id", self.rows + i),
+                page if page is not None else -1,
+                self._doc_refs[key]
+            )
+            texts.append(text)
+            self._text_offset += len(text)
+
+        self._files[".f32"].write(np.ascontiguousarray(embeddings, dtype='float32').tobytes())
+        self._files[".idx"].write(index.tobytes())
+        self._files[".txt"].write(b"".join(texts))
+        self.rows += len(chunks)
+
+    def commit(self) -> Segment:
+        """Make the segment durable and visible, returning a view of it"""
+        if self.rows == 0:
+            raise ValueError("Cannot commit an empty segment")
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            segment = self.store._commit(self)
+        finally:
+            # Closing the .f32 file last releases the in-progress lock once
+            # the log record owns the segment
+            for extension in (".idx", ".txt", ".f32"):
+                self._files[extension].close()
+        self.committed = True
+        return segment
+
+    def abort(self):
+        """Discard the partially written segment"""
+        if self.committed:
+            return
+        for f in self._files.values():
+            f.close()
+        self.store._remove_segment_files(self.name)
+
+class SegmentStore:
+    """Append-only on-disk layout for the vector store.
+
+    Every upload writes its embeddings and chunk metadata to a new segment and
+    then appends one commit record (segment name, row count and document
+    table) to ``segments.log``. A segment is only visible once its record is
+    on disk, so a crash mid-upload leaves at most an orphan segment that is
+    discarded the next time the store is loaded. Deleting a document appends
+    a tombstone record naming the segments that hold its rows; compaction
+    drops those rows from disk.
+
+    Several processes may share a store. Segment names, log appends and log
+    rewrites are serialized by an exclusive lock on ``segments.lock``, and a
+    process first reads the records the others wrote since it last read the
+    log, so none of them is lost. A segment being written keeps its
+    ``.f32`` file locked, which tells it apart from an orphan, and one
+    compaction runs at a time across the processes (``compaction.lock``).
+    """
+
+    LOG_FILE = "segments.log"
+    LOCK_FILE = "segments.lock"
+    COMPACTION_LOCK_FILE = "compaction.lock"
+    SEGMENT_FILES = (".f32", ".idx", ".txt")
+    # Without file locks, orphan segments younger than this (in seconds) may
+    # still be written by another process and are kept
+    ORPHAN_GRACE_SECONDS = 3600
+    # Merge policy: adjacent segments merged at once, the largest row count
+    # ratio between segments merged together, and the size below which
+    # segments count as equally small
+    MERGE_FACTOR = 8
+    SIZE_RATIO = 4
+    MIN_TIER_ROWS = 1024
+
+    def __init__(self, path: str, dimension: int, max_segments: int = 16):
+        self.path = path
+        self.dimension = dimension
+        self.max_segments = max_segments
+        self.log_file = os.path.join(path, self.LOG_FILE)
+        self._records = []  # Committed segment records, in order
+        self._tombstones = {}  # segment name -> deleted document ids
+        self._next_segment = 1
+        # Log read so far: (first line, bytes read), and (inode, size) to
+        # tell cheaply whether another process changed it
+        self._log_position = None
+        self._log_stat = None
+        # Records other processes wrote that the caller has not applied
+        # yet (see sync), or True once the log was replaced
+        self._pending = []
+        self._pending_replaced = False
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_fd = None
+        self._compaction_lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def exists(self) -> bool:
+        """Check whether a segment log has been written"""
+        return os.path.exists(self.log_file)
+
+    def segment_count(self) -> int:
+        """Number of committed segments"""
+        return len(self._records)
+
+    def needs_compaction(self) -> bool:
+        """Check whether there are more segments than max_segments"""
+        return len(self._records) > self.max_segments
+
+    def create_writer(self) -> "SegmentWriter":
+        """Start a new segment that can be filled batch by batch"""
+        with self._locked():
+            return SegmentWriter(self, *self._allocate_segment())
+
+    def append(self, embeddings: np.ndarray, chunks: List[Dict]) -> Segment:
+        """Write a new segment, commit it to the log and return a view of it"""
+        writer = self.create_writer()
+        try:
+            writer.write(embeddings, chunks)
+            return writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+    def _commit(self, writer: "SegmentWriter") -> Segment:
+        with self._locked():
+            self._sync_log()
+            record = {"segment": writer.name, "rows": writer.rows, "documents": writer.documents}
+            self._append_record(record)
+            self._records.append(record)
+            return self._open_segment(record, sum(r["rows"] for r in self._records[:-1]))
+
+    def load_segments(self) -> List[Segment]:
+        """Replay the log and return memory-mapped views of all committed segments.
+
+        A torn or corrupt tail (left by a crash during an append) is truncated
+        away, and segment files without a commit record that no process is
+        still writing are removed.
+        """
+        with self._locked():
+            self._records, self._tombstones = [], {}
+            self._log_position = self._log_stat = None
+            self._sync_log()
+            self._pending, self._pending_replaced = [], False
+            self._remove_orphan_segments()
+            return self._open_segments(self._records)
+
+    def delete_document(self, document_id: str, segment_names: List[str]):
+        """Durably mark a document's rows in the given segments as deleted
+
+        The rows stay on disk, and keep their positions, until the next
+        compaction.
+        """
+        with self._locked():
+            self._sync_log()
+            self._append_record({"delete": document_id, "segments": segment_names})
+            for name in segment_names:
+                self._tombstones.setdefault(name, set()).add(document_id)
+
+    def sync(self) -> Tuple[bool, List[Dict]]:
+        """Changes other processes made to the store that the caller has not applied
+
+        Returns (replaced, records). replaced means the log was rewritten by
+        a compaction elsewhere, or cleared: segments() and tombstones() have
+        to be loaded again. Otherwise records are the commit and delete
+        records appended since the last call, in log order.
+        """
+        with self._locked():
+            self._sync_log()
+            changes = (self._pending_replaced, self._pending)
+            self._pending, self._pending_replaced = [], False
+            return changes
+
+    def locked(self):
+        """Hold the store lock, against the other processes sharing the store too
+
+        Reentrant; syncing and then writing under it leaves no room for
+        another process's records in between.
+        """
+        return self._locked()
+
+    def segments(self) -> List[Segment]:
+        """Views of the committed segments this process knows of"""
+        with self._lock:
+            return self._open_segments(self._records)
+
+    def segment_names(self) -> List[str]:
+        """Names of the committed segments, in order, as the log has them now"""
+        with self._locked():
+            self._sync_log()
+            return [record["segment"] for record in self._records]
+
+    def tombstones(self) -> Dict[str, Set[str]]:
+        """Deleted document ids per segment name"""
+        with self._lock:
+            return {name: set(document_ids) for name, document_ids in self._tombstones.items()}
+
+    def compact(self):
+        """Merge the segments chosen by the merge policy, dropping deleted rows"""
+        plan = self.prepare_compaction()
+        if plan is not None:
+            self.install_compaction(plan)
+
+    def prepare_compaction(self) -> Optional[Dict]:
+        """Write the merge of a run of adjacent segments without their deleted rows
+
+        The run is chosen by _select_run. Returns the plan to pass to
+        install_compaction (or abort_compaction), or None when there is
+        nothing to merge or another compaction of the store is running.
+        Nothing becomes visible until it is installed, and uploads can keep
+        appending meanwhile.
+        """
+        lock_fd = self._try_lock_compaction()
+        if lock_fd is False:
+            return None
+        plan = {"lock": lock_fd, "files": {}}
+        try:
+            with self._locked():
+                self._sync_log()
+                tombstones = {
+                    record["segment"]: set(self._tombstones.get(record["segment"], ()))
+                    for record in self._records
+                }
+                run = self._select_run(self._records, tombstones)
+                if run is not None:
+                    first, last = run
+                    snapshot = self._records[first:last]
+                    tombstones = {record["segment"]: tombstones[record["segment"]] for record in snapshot}
+                    if len(snapshot) == 1 and not tombstones[snapshot[0]["segment"]]:
+                        run = None
+                if run is None:
+                    self._release_compaction(plan)
+                    return None
+                name, plan["files"] = self._allocate_segment()
+                plan["name"] = name
+            plan.update(self._write_merge(name, snapshot, tombstones, plan["files"]), first=first)
+            return plan
+        except Exception:
+            self.abort_compaction(plan)
+            raise
+
+    def _write_merge(self, name: str, snapshot: List[Dict], tombstones: Dict[str, Set[str]], files: Dict) -> Dict:
+        """Write the live rows of the snapshot segments to the open files of segment name"""
+        segments = [self._open_segment(record) for record in snapshot]
+        documents = []
+        rows = 0
+        purged = 0
+        text_offset = 0
+        f32, idx, txt = files[".f32"], files[".idx"], files[".txt"]
+        for segment in segments:
+            index = np.array(segment.index)
+            kept = [
+                ref for ref, (document_id, _) in enumerate(segment.documents)
+                if document_id not in tombstones[segment.name]
+            ]
+            if len(kept) < len(segment.documents):
+                live = np.isin(index[:, DOC_REF], kept)
+                purged += len(index) - int(live.sum())
+                index = index[live]
+                text = b"".join(
+                    segment.text[start:end].tobytes() for start, end in index[:, [TEXT_START, TEXT_END]]
+                )
+                lengths = index[:, TEXT_END] - index[:, TEXT_START]
+                index[:, TEXT_START] = np.cumsum(lengths) - lengths
+                index[:, TEXT_END] = index[:, TEXT_START] + lengths
+                embeddings = segment.embeddings[live]
+            else:
+                text = segment.text.tobytes()
+                embeddings = segment.embeddings
+
+            refs = np.full(len(segment.documents), -1, dtype='int64')
+            refs[kept] = np.arange(len(documents), len(documents) + len(kept))
+            index[:, DOC_REF] = refs[index[:, DOC_REF]]
+            index[:, [TEXT_START, TEXT_END]] += text_offset
+            documents.extend(segment.documents[ref] for ref in kept)
+            text_offset += len(text)
+            rows += len(index)
+
+            f32.write(np.ascontiguousarray(embeddings).tobytes())
+            idx.write(index.tobytes())
+            txt.write(text)
+        for f in (f32, idx, txt):
+            f.flush()
+            os.fsync(f.fileno())
+
+        merged = {"segment": name, "rows": rows, "documents": documents}
+        if not rows:
+            # Everything was deleted
+            for f in files.values():
+                f.close()
+            self._remove_segment_files(name)
+            merged = None
+        return {"snapshot": snapshot, "tombstones": tombstones, "record": merged, "purged": purged}
+
+    def _select_run(self, records: List[Dict], tombstones: Dict[str, Set[str]]) -> Optional[Tuple[int, int]]:
+        """Positions [first, last) of the adjacent segments to merge next, or None
+
+        With more than max_segments, MERGE_FACTOR (at most max_segments)
+        adjacent segments of similar size are merged, the run with the fewest rows first: the
+        small segments recent uploads leave behind are folded together
+        while the large early segments stay as they are, so a row is
+        rewritten about once per size tier instead of on every merge.
+        Otherwise the run spans the segments holding deleted rows.
+        """
+        if len(records) > self.max_segments:
+            sizes = [max(record["rows"], self.MIN_TIER_ROWS) for record in records]
+            width = max(2, min(self.MERGE_FACTOR, self.max_segments))
+            windows = [
+                (sum(sizes[first:first + width]), first)
+                for first in range(len(records) - width + 1)
+            ]
+            similar = [
+                (total, first) for total, first in windows
+                if max(sizes[first:first + width]) <= self.SIZE_RATIO * min(sizes[first:first + width])
+            ]
+            _, first = min(similar or windows)
+            return first, first + width
+
+        deleted = [i for i, record in enumerate(records) if tombstones[record["segment"]]]
+        if deleted:
+            return deleted[0], deleted[-1] + 1
+        return None
+
+    def install_compaction(self, plan: Dict) -> Optional[List[Segment]]:
+        """Swap a prepared merge in for the segments it replaces
+
+        Returns views of all committed segments; row positions after the
+        merged segment shift down by the number of purged rows. Deletions
+        and segments recorded while the merge was written, by this or
+        another process, are carried over. Returns None, discarding the
+        merge, if the segments it replaces are gone meanwhile (the store
+        was cleared).
+        """
+        first = plan["first"]
+        snapshot = plan["snapshot"]
+        merged = plan["record"]
+        replaced = {record["segment"] for record in snapshot}
+        try:
+            with self._locked():
+                self._sync_log()
+                if self._records[first:first + len(snapshot)] != snapshot:
+                    logger.warning("Discarding a compaction whose segments were replaced meanwhile")
+                    self.abort_compaction(plan)
+                    return None
+                records = (
+                    self._records[:first] + ([merged] if merged else []) + self._records[first + len(snapshot):]
+                )
+                tombstones = {}
+                for name, document_ids in self._tombstones.items():
+                    if name in replaced:
+                        document_ids = document_ids - plan["tombstones"][name]
+                        if not merged:
+                            continue
+                        name = merged["segment"]
+                    if document_ids:
+                        tombstones.setdefault(name, set()).update(document_ids)
+
+                self._rewrite_log(records, tombstones)
+                self._records = records
+                self._tombstones = tombstones
+                # The returned view holds whatever other processes wrote
+                self._pending, self._pending_replaced = [], False
+                segments = self._open_segments(records)
+        finally:
+            self._release_compaction(plan)
+
+        for record in snapshot:
+            self._remove_segment_files(record["segment"])
+        logger.info(
+            f"Compacted {len(snapshot)} segments into {merged['segment'] if merged else 'nothing'}, "
+            f"dropping {plan['purged']} deleted rows"
+        )
+        return segments
+
+    def abort_compaction(self, plan: Dict):
+        """Discard a prepared merge that will not be installed"""
+        self._release_compaction(plan)
+        if plan.get("name"):
+            self._remove_segment_files(plan["name"])
+
+    def open_segment(self, record: Dict, start: int = 0) -> Segment:
+        """Memory-map the segment of a log record"""
+        return self._open_segment(record, start)
+
+    def log_changed(self) -> bool:
+        """Whether the log changed since this process last read or wrote it
+
+        Only stats the file; sync reads the changes.
+        """
+        if self._pending or self._pending_replaced:
+            return True
+        try:
+            stat = os.stat(self.log_file)
+        except FileNotFoundError:
+            return self._log_stat is not None
+        return (stat.st_ino, stat.st_size) != self._log_stat
+
+    def clear(self):
+        """Remove every segment and the log"""
+        with self._locked():
+            for filename in os.listdir(self.path):
+                if filename not in (self.LOCK_FILE, self.COMPACTION_LOCK_FILE):
+                    self._remove_file(os.path.join(self.path, filename))
+            self._records = []
+            self._tombstones = {}
+            self._next_segment = 1
+            self._log_position = None
+            self._log_stat = None
+            self._pending, self._pending_replaced = [], False
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store lock: the thread lock, and across processes an
+        exclusive lock on the lock file. Reentrant within a thread."""
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_fd is None:
+                    self._lock_fd = os.open(os.path.join(self.path, self.LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _try_lock_compaction(self):
+        """File descriptor holding the compaction lock (None without file
+        locks), or False when a compaction is already running"""
+        if not self._compaction_lock.acquire(blocking=False):
+            return False
+        if fcntl is None:
+            return None
+        fd = os.open(os.path.join(self.path, self.COMPACTION_LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            self._compaction_lock.release()
+            return False
+        return fd
+
+    def _release_compaction(self, plan: Dict):
+        for f in plan["files"].values():
+            f.close()
+        if plan["lock"] is not False:
+            if plan["lock"] is not None:
+                os.close(plan["lock"])
+            plan["lock"] = False
+            self._compaction_lock.release()
+
+    def _allocate_segment(self) -> Tuple[str, Dict[str, BinaryIO]]:
+        """Claim an unused segment name and open its files for writing
+
+        The store lock must be held. Names are unique across the processes
+        sharing the store, and the .f32 file stays locked while it is open,
+        marking the segment as in progress (see _remove_orphan_segments).
+        """
+        for filename in os.listdir(self.path):
+            number = filename[len("seg-"):].split(".")[0]
+            if filename.startswith("seg-") and number.isdigit():
+                self._next_segment = max(self._next_segment, int(number) + 1)
+        while True:
+            name = f"seg-{self._next_segment:06d}"
+            self._next_segment += 1
+            try:
+                f32 = open(self._file(name, ".f32"), 'xb')
+                break
+            except FileExistsError:
+                continue
+        if fcntl is not None:
+            fcntl.flock(f32.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        files = {".f32": f32}
+        for extension in (".idx", ".txt"):
+            files[extension] = open(self._file(name, extension), 'wb')
+        return name, files
+
+    def _file(self, name: str, extension: str) -> str:
+        return os.path.join(self.path, f"{name}{extension}")
+
+    def _open_segments(self, records: List[Dict]) -> List[Segment]:
+        segments = []
+        start = 0
+        for record in records:
+            segments.append(self._open_segment(record, start))
+            start += record["rows"]
+        return segments
+
+    def _tombstone_records(self, tombstones: Dict[str, Set[str]]) -> List[Dict]:
+        segments_by_document = {}
+        for name, document_ids in tombstones.items():
+            for document_id in document_ids:
+                segments_by_document.setdefault(document_id, []).append(name)
+        return [
+            {"delete": document_id, "segments": sorted(names)}
+            for document_id, names in segments_by_document.items()
+        ]
+
+    def _open_segment(self, record: Dict, start: int = 0) -> Segment:
+        return Segment(
+            os.path.join(self.path, record["segment"]),
+            record["segment"],
+            record["rows"],
+            self.dimension,
+            record["documents"],
+            start
+        )
+
+    def _encode_record(self, record: Dict) -> bytes:
+        return (json.dumps(record) + "\n").encode('utf-8')
+
+    def _append_record(self, record: Dict):
+        """Append a record at the end of the log; the store lock must be held, after _sync_log"""
+        data = self._encode_record(record)
+        with open(self.log_file, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            inode = os.fstat(f.fileno()).st_ino
+        head, offset = self._log_position or (data, 0)
+        self._log_position = (head, offset + len(data))
+        self._log_stat = (inode, offset + len(data))
+
+    def _rewrite_log(self, records: List[Dict], tombstones: Dict[str, Set[str]]):
+        """Atomically replace the log; the store lock must be held
+
+        The first line names this version of the log, so other processes
+        notice the rewrite even if the new file reuses the old inode.
+        """
+        head = self._encode_record({"log": uuid.uuid4().hex})
+        tmp_file = self.log_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(head)
+            for record in records:
+                f.write(self._encode_record(record))
+            for record in self._tombstone_records(tombstones):
+                f.write(self._encode_record(record))
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_file, self.log_file)
+        self._log_position = (head, size)
+        self._log_stat = (os.stat(self.log_file).st_ino, size)
+
+    def _segment_is_complete(self, record: Dict) -> bool:
+        expected_sizes = {
+            ".f32": record["rows"] * self.dimension * 4,
+            ".idx": record["rows"] * INDEX_COLUMNS * 8
+        }
+        for extension in self.SEGMENT_FILES:
+            path = self._file(record["segment"], extension)
+            if not os.path.exists(path):
+                return False
+            if extension in expected_sizes and os.path.getsize(path) != expected_sizes[extension]:
+                return False
+        return True
+
+    def _sync_log(self) -> Tuple[bool, List[Dict]]:
+        """Catch up with the records written since this process last read the log
+
+        The store lock must be held. Returns whether the log was replaced
+        (compacted or cleared by another process, or read for the first
+        time), in which case every record was replayed, and the commit and
+        delete records read, in log order.
+        """
+        if not os.path.exists(self.log_file):
+            replaced = self._log_position is not None
+            if replaced:
+                self._records, self._tombstones = [], {}
+                self._log_position = self._log_stat = None
+                self._pending, self._pending_replaced = [], True
+            return replaced, []
+        records = None
+        if self._log_position is not None:
+            records = self._read_log(*self._log_position)
+        replaced = records is None
+        if replaced:
+            self._records, self._tombstones = [], {}
+            records = self._read_log(b"", 0)
+        for record in records:
+            if "delete" in record:
+                for name in record["segments"]:
+                    self._tombstones.setdefault(name, set()).add(record["delete"])
+            else:
+                self._records.append(record)
+                number = int(record["segment"].split("-")[1])
+                self._next_segment = max(self._next_segment, number + 1)
+        if replaced:
+            self._pending, self._pending_replaced = [], True
+        else:
+            self._pending.extend(records)
+        return replaced, records
+
+    def _read_log(self, head: bytes, offset: int) -> Optional[List[Dict]]:
+        """Records from byte offset on, or None if the log no longer starts with head
+
+        A torn or corrupt tail (left by a crash during an append) is
+        truncated away.
+        """
+        records = []
+        with open(self.log_file, 'rb') as f:
+            first_line = f.readline()
+            if offset and first_line != head:
+                return None
+            f.seek(offset)
+            valid_bytes = offset
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if "delete" not in record and "log" not in record and not self._segment_is_complete(record):
+                    break
+                valid_bytes += len(line)
+                if "log" not in record:
+                    records.append(record)
+            stat = os.fstat(f.fileno())
+
+        if valid_bytes < stat.st_size:
+            logger.warning(f"Truncating corrupt tail of {self.log_file} at byte {valid_bytes}")
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(valid_bytes)
+        self._log_position = (first_line if valid_bytes else b"", valid_bytes)
+        self._log_stat = (stat.st_ino, valid_bytes)
+        return records
+
+    def _remove_orphan_segments(self):
+        """Remove segments without a commit record that no process is writing; the store lock must be held"""
+        committed = {record["segment"] for record in self._records}
+        orphans = {
+            os.path.splitext(filename)[0] for filename in os.listdir(self.path)
+            if filename.startswith("seg-") and os.path.splitext(filename)[0] not in committed
+        }
+        for name in orphans:
+            if not self._segment_in_progress(name):
+                self._remove_segment_files(name)
+        # Only ever written under the store lock
+        self._remove_file(self.log_file + ".tmp")
+
+    def _segment_in_progress(self, name: str) -> bool:
+        """Whether a writer, in this or another process, still holds the segment's files"""
+        path = self._file(name, ".f32")
+        if fcntl is None:
+            try:
+                return time.time() - os.path.getmtime(path) < self.ORPHAN_GRACE_SECONDS
+            except FileNotFoundError:
+                return False
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def _remove_segment_files(self, name: str):
+        for extension in self.SEGMENT_FILES:
+            self._remove_file(self._file(name, extension))
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # Still mapped on platforms that refuse to unlink open files;
+            # the next load treats it as an orphan and retries
+            logger.warning(f"Could not remove {path}: {str(e)}")
@@ -0,0 +1,342 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Tuple, Iterable, Callable, Optional
+import numpy as np
+import hashlib
+import logging
+import heapq
+import json
+import os
+
+from .vector_store import VectorStore, DocumentWriter
+from .embedding_cache import QueryEmbeddingCache
+from .bm25_index import reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+class ShardedVectorStore:
+    """VectorStore partitioned into independent shards by document.
+
+    Every document lives in one shard, chosen by a hash of its id. Each
+    shard is a complete VectorStore (segments, index, BM25 postings, saved
+    ANN index) under ``<store_path>/shard-NNN``, so shards load in parallel
+    at startup and grow, compact and rebuild their indexes on their own.
+    The model and the query embedding cache are shared. Searches run on
+    every shard at once on a thread pool (FAISS and numpy release the GIL)
+    and the per-shard top k lists are merged with a heap.
+
+    The shard count is fixed when the store is created; changing
+    VECTOR_SHARDS afterwards requires uploading the documents again.
+    """
+
+    SEARCH_MODES = VectorStore.SEARCH_MODES
+    HYBRID_CANDIDATES_FACTOR = VectorStore.HYBRID_CANDIDATES_FACTOR
+    LAYOUT_FILE = "shards.json"
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        store_path: str = None,
+        storage_mode: str = None,
+        index_type: str = None,
+        quantization: str = None,
+        shards: int = None
+    ):
+        self.shard_count = shards or int(os.getenv("VECTOR_SHARDS", "1"))
+        if self.shard_count < 1:
+            raise ValueError(f"Invalid shard count: {self.shard_count}")
+        self.store_path = store_path or os.getenv("VECTOR_STORE_PATH", "./vector_store")
+        self._check_layout()
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.query_cache = QueryEmbeddingCache(
+            model_name,
+            max_entries=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+            db_path=os.getenv("QUERY_CACHE_DB") or None
+        )
+
+        self.shards = [
+            VectorStore(
+                model_name,
+                os.path.join(self.store_path, f"shard-{i:03d}"),
+                storage_mode,
+                index_type,
+                quantization,
+                model=self.model,
+                query_cache=self.query_cache,
+                load=False
+            )
+            for i in range(self.shard_count)
+        ]
+        self.search_mode = self.shards[0].search_mode
+        self._executor = ThreadPoolExecutor(max_workers=self.shard_count, thread_name_prefix="vector-shard")
+
+        # Shards are independent, so they are opened concurrently
+        self._fan_out(lambda shard: shard.load(migrate_legacy=False))
+        logger.info(f"Opened {self.shard_count} shards with {self.ntotal} rows")
+
+    @property
+    def ntotal(self) -> int:
+        return sum(shard.ntotal for shard in self.shards)
+
+    def is_ready(self) -> bool:
+        return all(shard.is_ready() for shard in self.shards)
+
+    def shard_number(self, document_id: str) -> int:
+        """Shard that holds (or will hold) a document; stable across processes"""
+        digest = hashlib.sha1(document_id.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.shard_count
+
+    def shard_for(self, document_id: str) -> VectorStore:
+        return self.shards[self.shard_number(document_id)]
+
+    def add_documents(self, chunks: List[Dict], document_id: str, filename: str):
+        """Add documents to the vector store"""
+        self.shard_for(document_id).add_documents(chunks, document_id, filename)
+
+    def add_document_stream(self, chunks: Iterable[Dict], document_id: str, filename: str, batch_size: int = 64) -> int:
+        return self.shard_for(document_id).add_document_stream(chunks, document_id, filename, batch_size)
+
+    def create_document_writer(
+        self,
+        document_id: str,
+        filename: str,
+        batch_size: int = 64,
+        replace: bool = False
+    ) -> DocumentWriter:
+        return self.shard_for(document_id).create_document_writer(document_id, filename, batch_size, replace)
+
+    def encode_documents(self, texts: List[str]) -> np.ndarray:
+        return self.shards[0].encode_documents(texts)
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        return self.shards[0].encode_queries(queries)
+
+    def delete_document(self, document_id: str) -> int:
+        return self.shard_for(document_id).delete_document(document_id)
+
+    def has_document(self, document_id: str) -> bool:
+        return self.shard_for(document_id).has_document(document_id)
+
+    def add_change_listener(self, callback: Callable[[Optional[List[str]]], None]):
+        for shard in self.shards:
+            shard.add_change_listener(callback)
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        mode: str = None,
+        filters: Dict = None
+    ) -> List[Dict]:
+        """Search all shards, see VectorStore.search"""
+        return self.search_batch([query], top_k, nprobe, ef_search, mode, filters)[0]
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        mode: str = None,
+        filters: Dict = None
+    ) -> List[List[Dict]]:
+        """Search for several queries with one encoder pass and one fan-out"""
+        mode = mode or self.search_mode
+        if mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        try:
+            self._refresh()
+            if self.ntotal == 0 or not queries:
+                return [[] for _ in queries]
+
+            if mode == "keyword":
+                return self.search_keywords(queries, top_k, filters)
+            query_embeddings = self.encode_queries(queries)
+            if mode == "hybrid":
+                return self.search_hybrid(queries, query_embeddings, top_k, nprobe, ef_search, filters)
+            return self.search_vectors(query_embeddings, top_k, nprobe, ef_search, filters)
+
+        except Exception as e:
+            raise Exception(f"Error searching vector store: {str(e)}")
+
+    def search_vectors(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        filters: Dict = None
+    ) -> List[List[Dict]]:
+        """Search every shard with already encoded queries and merge the results"""
+        self._refresh()
+        with self._reading():
+            rankings = self._dense_rankings(query_embeddings, top_k, nprobe, ef_search, filters)
+            return [self._results(ranking) for ranking in rankings]
+
+    def search_keywords(self, queries: List[str], top_k: int = 5, filters: Dict = None) -> List[List[Dict]]:
+        """BM25 search on every shard
+
+        Term statistics are per shard, as in most sharded search engines;
+        with documents spread by hash they differ little between shards.
+        """
+        self._refresh()
+        with self._reading():
+            return [self._results(ranking) for ranking in self._keyword_rankings(queries, top_k, filters)]
+
+    def search_hybrid(
+        self,
+        queries: List[str],
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        filters: Dict = None
+    ) -> List[List[Dict]]:
+        """Fuse the merged dense and BM25 rankings with reciprocal rank fusion"""
+        candidates = top_k * self.HYBRID_CANDIDATES_FACTOR
+        self._refresh()
+        with self._reading():
+            dense_rankings = self._dense_rankings(query_embeddings, candidates, nprobe, ef_search, filters)
+            keyword_rankings = self._keyword_rankings(queries, candidates, filters)
+            batch_results = []
+            for dense_ranking, keyword_ranking in zip(dense_rankings, keyword_rankings):
+                fused = reciprocal_rank_fusion([
+                    [(shard, idx) for _, shard, idx in dense_ranking],
+                    [(shard, idx) for _, shard, idx in keyword_ranking]
+                ])
+                batch_results.append(self._results([
+                    (score, shard, idx) for (shard, idx), score in fused[:top_k]
+                ]))
+            return batch_results
+
+    def compact(self):
+        """Compact every shard"""
+        self._fan_out(lambda shard: shard.compact())
+
+    def get_stats(self) -> Dict:
+        """Totals over the shards, and each shard's own statistics"""
+        shard_stats = [shard.get_stats() for shard in self.shards]
+        return {
+            "total_documents": sum(stats["total_documents"] for stats in shard_stats),
+            "index_size": self.ntotal,
+            "dimension": self.dimension,
+            "deleted_chunks": sum(stats["deleted_chunks"] for stats in shard_stats),
+            "quantization": self.shards[0].quantization,
+            "index_memory_bytes": sum(stats["index_memory_bytes"] for stats in shard_stats),
+            "query_cache": self.query_cache.get_stats(),
+            "search_mode": self.search_mode,
+            "shard_count": self.shard_count,
+            "shards": [
+                {key: value for key, value in stats.items() if key not in ("query_cache", "search_mode")}
+                for stats in shard_stats
+            ]
+        }
+
+    def evaluate_quantization(self, top_k: int = 10, sample_size: int = 100, max_rows: int = 20000) -> Dict:
+        """VectorStore.evaluate_quantization of each shard"""
+        return {"shards": self._fan_out(lambda shard: shard.evaluate_quantization(top_k, sample_size, max_rows))}
+
+    def clear_index(self):
+        """Clear all documents from every shard"""
+        self._fan_out(lambda shard: shard.clear_index())
+
+    def _refresh(self):
+        """Pick up what other processes wrote to any shard, see VectorStore._refresh"""
+        for shard in self.shards:
+            shard._refresh()
+
+    @contextmanager
+    def _reading(self):
+        """Hold every shard's index lock for reading, from the first ranking to the last result"""
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard._index_lock.read())
+            yield
+
+    def _dense_rankings(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int,
+        nprobe: int,
+        ef_search: int,
+        filters: Dict
+    ) -> List[List[Tuple[float, int, int]]]:
+        """Merged (score, shard, row) rankings of the nearest rows per query"""
+        def search_shard(shard: VectorStore):
+            return shard._search_ids(query_embeddings, top_k, nprobe, ef_search, shard.filter_rows(filters))
+        return self._merge(self._fan_out_search(search_shard, filters), top_k, len(query_embeddings))
+
+    def _keyword_rankings(self, queries: List[str], top_k: int, filters: Dict) -> List[List[Tuple[float, int, int]]]:
+        def search_shard(shard: VectorStore):
+            allowed = shard._candidate_filter(shard.filter_rows(filters))
+            bm25 = shard._keyword_index()
+            return [bm25.search(query, top_k, allowed) for query in queries]
+        return self._merge(self._fan_out_search(search_shard, filters), top_k, len(queries))
+
+    def _merge(
+        self,
+        shard_rankings: List[Tuple[int, List[List[Tuple[int, float]]]]],
+        top_k: int,
+        query_count: int
+    ) -> List[List[Tuple[float, int, int]]]:
+        """Best top_k (score, shard, row) per query from each shard's sorted (row, score) lists"""
+        merged = []
+        for q in range(query_count):
+            streams = [
+                [(score, shard, idx) for idx, score in rankings[q]]
+                for shard, rankings in shard_rankings
+            ]
+            merged.append(list(heapq.merge(*streams, key=lambda item: -item[0]))[:top_k])
+        return merged
+
+    def _results(self, ranking: List[Tuple[float, int, int]]) -> List[Dict]:
+        results = []
+        for score, shard, idx in ranking:
+            results.extend(self.shards[shard]._results([(idx, score)]))
+        return results
+
+    def _fan_out(self, fn: Callable[[VectorStore], object]) -> List:
+        """Run fn on every shard in parallel
+
+        Maintenance waits for the shards' write locks, so it runs on threads
+        of its own: on the search pool it could queue the shard searches of
+        a request that holds the read locks behind it.
+        """
+        with ThreadPoolExecutor(max_workers=self.shard_count, thread_name_prefix="vector-shard-maintenance") as executor:
+            return list(executor.map(fn, self.shards))
+
+    def _fan_out_search(self, fn: Callable[[VectorStore], object], filters: Dict = None) -> List[Tuple[int, object]]:
+        """(shard number, result) of fn on every shard that may match filters, in parallel"""
+        numbers = self._shard_numbers(filters)
+        return list(zip(numbers, self._executor.map(fn, [self.shards[number] for number in numbers])))
+
+    def _shard_numbers(self, filters: Dict = None) -> List[int]:
+        """Shards that may hold rows matching filters"""
+        document_ids = (filters or {}).get("document_ids")
+        if not document_ids:
+            return list(range(self.shard_count))
+        return sorted({self.shard_number(document_id) for document_id in document_ids})
+
+    def _check_layout(self):
+        """Refuse to open a store created with another shard count"""
+        os.makedirs(self.store_path, exist_ok=True)
+        layout_file = os.path.join(self.store_path, self.LAYOUT_FILE)
+        if os.path.exists(layout_file):
+            with open(layout_file) as f:
+                shards = json.load(f)["shards"]
+            if shards != self.shard_count:
+                raise ValueError(
+                    f"{self.store_path} holds {shards} shards but VECTOR_SHARDS is {self.shard_count}"
+                )
+            return
+        if os.path.exists(os.path.join(self.store_path, "segments.log")):
+            raise ValueError(f"{self.store_path} holds an unsharded store")
+        with open(layout_file, 'w') as f:
+            json.dump({"shards": self.shard_count}, f)
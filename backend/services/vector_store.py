@@ -1,112 +1,1261 @@
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Set, Iterable, Callable, Optional
+from contextlib import contextmanager
+import threading
+import bisect
+import hashlib
+import logging
 import pickle
 import os
 
+from .segment_store import SegmentStore, SegmentWriter, Segment, MappedChunks, MappedFlatIndex, PAGE, DOC_REF
+from .embedding_cache import QueryEmbeddingCache
+from .bm25_index import BM25Index, reciprocal_rank_fusion
+from . import ann_index
+
+logger = logging.getLogger(__name__)
+
+class ReadWriteLock:
+    """Lock held by any number of readers at once, or by a single writer
+    
+    FAISS indexes must not be searched while vectors are being added, but
+    concurrent searches are safe. A waiting writer holds back new readers,
+    so a steady flow of searches cannot starve an upload. Neither side is
+    reentrant.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+    
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
 class VectorStore:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    STORAGE_MODES = ("memory", "mmap")
+    SEARCH_MODES = ("dense", "keyword", "hybrid")
+    # Candidates each retriever contributes to hybrid fusion, per result
+    HYBRID_CANDIDATES_FACTOR = 4
+    
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        store_path: str = None,
+        storage_mode: str = None,
+        index_type: str = None,
+        quantization: str = None,
+        model: SentenceTransformer = None,
+        query_cache: QueryEmbeddingCache = None,
+        load: bool = True
+    ):
+        """model and query_cache may be shared with other stores; with load
+        False the stored segments are only opened by a later call to load()
+        """
+        self.model_name = model_name
+        self.model = model or SentenceTransformer(model_name)
         self.dimension = self.model.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner Product for cosine similarity
-        self.documents = []  # Store document metadata
+        # Repeated queries skip the encoder; QUERY_CACHE_DB adds a tier shared across workers
+        self.query_cache = query_cache or QueryEmbeddingCache(
+            model_name,
+            max_entries=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+            ttl_seconds=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+            db_path=os.getenv("QUERY_CACHE_DB") or None
+        )
+        # "memory" keeps a FAISS index and all chunk metadata on the heap,
+        # "mmap" searches and reads chunks straight from the segment files
+        self.storage_mode = storage_mode or os.getenv("VECTOR_STORE_MODE", "memory")
+        if self.storage_mode not in self.STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode: {self.storage_mode}")
+        # Encoding of the vectors held in memory (fp16, int8 or pq codes
+        # instead of float32); lossy encodings only pick candidates, which
+        # are re-ranked with the float32 vectors of the segment files
+        self.quantization = quantization or os.getenv("VECTOR_QUANTIZATION", "none")
+        if self.quantization not in ann_index.QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {self.quantization}")
+        self.rerank_factor = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+        self.index, self.documents = self._empty_index()
+        self.segments = []  # Memory-mapped views of every committed segment
+        
+        # Approximate index used once the corpus passes ann_threshold chunks;
+        # until then (and for "flat") search stays exact
+        self.index_type = index_type or os.getenv("VECTOR_INDEX_TYPE", "flat")
+        if self.index_type not in ann_index.INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {self.index_type}")
+        self.ann_threshold = int(os.getenv("VECTOR_ANN_THRESHOLD", "50000"))
+        self.nprobe = int(os.getenv("VECTOR_NPROBE", "16"))
+        self.ef_search = int(os.getenv("VECTOR_EF_SEARCH", "64"))
+        self.ann_rows = 0  # Rows covered by the last ANN build
+        # Bumped whenever row ids change (purging compactions, reloads), so
+        # an index trained over the old ones is not swapped in
+        self._rows_version = 0
+        # Searches read the index while uploads, deletes and maintenance write it
+        self._index_lock = ReadWriteLock()
+        # Serializes compactions and ANN index swaps, which both replace the index
+        self._maintenance_lock = threading.Lock()
+        self._rebuild_thread = None
+        self._compaction_thread = None
+        self._change_listeners = []
+        
+        # Lexical index over the same row ids; "keyword" search skips the
+        # encoder and "hybrid" fuses both rankings. With dense retrieval it
+        # is only built by the first keyword or hybrid query (see
+        # _keyword_index), so loading a store does not tokenize every chunk.
+        self.search_mode = os.getenv("RETRIEVAL_MODE", "dense")
+        if self.search_mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown retrieval mode: {self.search_mode}")
+        self.bm25 = None if self.search_mode == "dense" else BM25Index()
+        self._bm25_lock = threading.Lock()
+        
+        # Row ranges per document for filtered search
+        self.document_rows = {}  # document_id -> [(start, end)]
+        self.filename_documents = {}  # filename -> {document_id}
+        # Filtered searches over at most this many rows skip the ANN index
+        self.filter_exact_rows = int(os.getenv("VECTOR_FILTER_EXACT_ROWS", "100000"))
+        
+        # Rows of deleted documents, hidden from search until compaction drops them
+        self.deleted_rows = np.empty(0, dtype='int64')
+        self._deleted_selector = None
+        self.compact_deleted_ratio = float(os.getenv("VECTOR_COMPACT_DELETED_RATIO", "0.2"))
+        
+        self.store_path = store_path or os.getenv("VECTOR_STORE_PATH", "./vector_store")
+        self.segment_store = SegmentStore(
+            self.store_path,
+            self.dimension,
+            max_segments=int(os.getenv("VECTOR_STORE_MAX_SEGMENTS", "16"))
+        )
+        # Single-file layout used before the segment store, migrated on load
         self.index_file = "vector_index.faiss"
         self.docs_file = "documents.pkl"
+        self.ann_file = os.path.join(self.store_path, "ann.faiss")
         
         # Load existing index if available
+        if load:
+            self.load()
+    
+    @property
+    def ntotal(self) -> int:
+        """Number of indexed rows, deleted ones included"""
+        return self.index.ntotal
+    
+    def is_ready(self) -> bool:
+        return self.index is not None
+    
+    def load(self, migrate_legacy: bool = True):
+        """Open the stored segments and the saved ANN index, if any
+        
+        With migrate_legacy, a single-file index from before the segment
+        store is imported first.
+        """
+        if migrate_legacy and not self.segment_store.exists():
+            try:
+                self._migrate_legacy_index()
+            except Exception as e:
+                print(f"Could not migrate legacy index: {str(e)}")
         self._load_index()
     
     def add_documents(self, chunks: List[Dict], document_id: str, filename: str):
         """Add documents to the vector store"""
+        self.add_document_stream(chunks, document_id, filename)
+    
+    def add_document_stream(
+        self,
+        chunks: Iterable[Dict],
+        document_id: str,
+        filename: str,
+        batch_size: int = 64
+    ) -> int:
+        """Embed and index a stream of chunks batch by batch
+        
+        Only one batch of chunks and embeddings is held in memory at a time;
+        the document becomes searchable once the whole stream is consumed.
+        Returns the number of chunks added.
+        """
+        writer = self.create_document_writer(document_id, filename, batch_size)
         try:
-            texts = [chunk["text"] for chunk in chunks]
-            embeddings = self.model.encode(texts, convert_to_tensor=False)
-            
-            # Normalize embeddings for cosine similarity
-            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
-            
-            # Add to FAISS index
-            self.index.add(embeddings.astype('float32'))
-            
-            # Store document metadata
-            for i, chunk in enumerate(chunks):
-                self.documents.append({
-                    "text": chunk["text"],
-                    "source": filename,
-                    "document_id": document_id,
-                    "chunk_id": chunk.get("chunk_id", i),
-                    "page": chunk.get("page"),
-                    "index_id": len(self.documents)
-                })
-            
-            # Save index and metadata
-            self._save_index()
-            
+            writer.add(chunks)
+            return writer.commit()
         except Exception as e:
+            writer.abort()
             raise Exception(f"Error adding documents to vector store: {str(e)}")
     
-    def search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Search for similar documents"""
+    def create_document_writer(
+        self,
+        document_id: str,
+        filename: str,
+        batch_size: int = 64,
+        replace: bool = False
+    ) -> "DocumentWriter":
+        """Start streaming a document's chunks into the store
+        
+        With replace, the document's current chunks are deleted when the new
+        ones are committed, so searches see either version but never both.
+        """
+        return DocumentWriter(self, document_id, filename, batch_size, replace)
+    
+    def encode_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed and normalize chunk texts for cosine similarity"""
+        embeddings = self.model.encode(texts, convert_to_tensor=False)
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.astype('float32')
+    
+    def _chunk_metadata(self, chunks: List[Dict], document_id: str, filename: str, first_chunk_id: int = 0) -> List[Dict]:
+        """Build the stored metadata for a batch of chunks"""
+        return [
+            {
+                "text": chunk["text"],
+                "source": filename,
+                "document_id": document_id,
+                "chunk_id": chunk.get("chunk_id", first_chunk_id + i),
+                "page": chunk.get("page")
+            }
+            for i, chunk in enumerate(chunks)
+        ]
+    
+    def _commit_segment(self, writer: SegmentWriter, replaces: str = None):
+        """Commit a written segment and make it searchable
+        
+        Committing and indexing happen under the lock so index row positions
+        always match the commit order of segments; what other processes
+        committed before is applied first, under the store lock. With
+        replaces set, the rows that document had before are deleted in the
+        same step.
+        """
+        with self._index_lock.write():
+            with self.segment_store.locked():
+                changed = self._sync_with_log()
+                segment = writer.commit()
+                if replaces:
+                    self._delete_rows(replaces)
+                self._add_segment(segment)
+        
+        self._notify_synced(changed)
+        self._notify_change([document_id for document_id, _ in segment.documents])
+        self._maybe_compact()
+        self._maybe_rebuild_index()
+    
+    def _add_segment(self, segment: Segment):
+        """Make a committed segment searchable; the index lock must be held for writing"""
+        self.segments.append(segment)
+        self._add_to_index(self.index, [segment])
+        self._add_metadata([segment], self.documents, self.bm25)
+        self._register_rows(segment, self.document_rows, self.filename_documents)
+    
+    def _refresh(self):
+        """Apply what other processes sharing the store committed, deleted or compacted
+        
+        Only stats the segment log unless it changed. Must not be called
+        with the index lock held.
+        """
+        if not self.segment_store.log_changed():
+            return
+        with self._index_lock.write():
+            with self.segment_store.locked():
+                changed = self._sync_with_log()
+        self._notify_synced(changed)
+        if changed is None:
+            self._maybe_rebuild_index()
+    
+    def _sync_with_log(self) -> Optional[List[str]]:
+        """Apply the store changes this process has not seen yet
+        
+        The index lock must be held for writing, and the store lock too
+        when something is written next. New segments are appended and
+        deletions hidden; after a compaction by another process the whole
+        view is loaded again. Returns the changed document ids, None when
+        the view was reloaded.
+        """
+        replaced, records = self.segment_store.sync()
+        if replaced:
+            self._load_view(self.segment_store.segments(), self.segment_store.tombstones())
+            return None
+        for record in records:
+            if "delete" in record:
+                names = set(record["segments"])
+                ranges = [
+                    row_range for row_range in self.document_rows.get(record["delete"], [])
+                    if self._segment_at(row_range[0]).name in names
+                ]
+                if ranges:
+                    self._hide_rows(record["delete"], ranges)
+            else:
+                start = sum(segment.rows for segment in self.segments)
+                self._add_segment(self.segment_store.open_segment(record, start))
+        return self._record_documents(records)
+    
+    @staticmethod
+    def _record_documents(records: List[Dict]) -> List[str]:
+        """Document ids added or deleted by segment log records"""
+        document_ids = []
+        for record in records:
+            if "delete" in record:
+                document_ids.append(record["delete"])
+            else:
+                document_ids.extend(document_id for document_id, _ in record["documents"])
+        return document_ids
+    
+    def _notify_synced(self, changed: Optional[List[str]]):
+        if changed is None or changed:
+            self._notify_change(changed)
+    
+    def delete_document(self, document_id: str) -> int:
+        """Remove a document from search and return the number of chunks removed
+        
+        The rows are hidden at once; compaction later drops them from disk
+        without re-embedding anything else.
+        """
+        with self._index_lock.write():
+            with self.segment_store.locked():
+                changed = self._sync_with_log()
+                removed = self._delete_rows(document_id)
+        self._notify_synced(changed)
+        if removed:
+            self._notify_change([document_id])
+            self._maybe_compact()
+        return removed
+    
+    def has_document(self, document_id: str) -> bool:
+        self._refresh()
+        return document_id in self.document_rows
+    
+    def _delete_rows(self, document_id: str) -> int:
+        """Tombstone every current row of a document; the index lock must be held"""
+        ranges = self.document_rows.get(document_id, [])
+        if not ranges:
+            return 0
+        segment_names = sorted({self._segment_at(start).name for start, _ in ranges})
+        self.segment_store.delete_document(document_id, segment_names)
+        return self._hide_rows(document_id, ranges)
+    
+    def _segment_at(self, row: int) -> Segment:
+        starts = [segment.start for segment in self.segments]
+        return self.segments[bisect.bisect_right(starts, row) - 1]
+    
+    def _hide_rows(self, document_id: str, ranges: List[Tuple[int, int]]) -> int:
+        """Drop row ranges of a document from search; the index lock must be held"""
+        remaining = [row_range for row_range in self.document_rows.pop(document_id, []) if row_range not in ranges]
+        if remaining:
+            self.document_rows[document_id] = remaining
+        else:
+            for filename, document_ids in list(self.filename_documents.items()):
+                document_ids.discard(document_id)
+                if not document_ids:
+                    del self.filename_documents[filename]
+        rows = np.concatenate([np.arange(start, end, dtype='int64') for start, end in ranges])
+        if self.bm25 is not None:
+            self.bm25.delete(rows)
+        self._set_deleted_rows(np.union1d(self.deleted_rows, rows))
+        return len(rows)
+    
+    def _set_deleted_rows(self, rows: np.ndarray):
+        if len(rows):
+            # The inner selector has to outlive the one wrapping it
+            batch = faiss.IDSelectorBatch(rows)
+            self._deleted_selector = (faiss.IDSelectorNot(batch), batch)
+        else:
+            self._deleted_selector = None
+        self.deleted_rows = rows
+    
+    def add_change_listener(self, callback: Callable[[Optional[List[str]]], None]):
+        """Register callback(document_ids) to run after documents are added or removed
+        
+        document_ids is None when the whole store changed.
+        """
+        self._change_listeners.append(callback)
+    
+    def _notify_change(self, document_ids: Optional[List[str]]):
+        for callback in self._change_listeners:
+            try:
+                callback(document_ids)
+            except Exception as e:
+                logger.error(f"Error in vector store change listener: {str(e)}")
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        mode: str = None,
+        filters: Dict = None
+    ) -> List[Dict]:
+        """Search for similar documents
+        
+        nprobe and ef_search override the configured IVF / HNSW search
+        breadth for this call; they are ignored by exact indexes. mode is
+        "dense", "keyword" or "hybrid" and defaults to RETRIEVAL_MODE.
+        filters restricts the search to matching chunks, see filter_rows.
+        """
+        return self.search_batch([query], top_k, nprobe, ef_search, mode, filters)[0]
+    
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        mode: str = None,
+        filters: Dict = None
+    ) -> List[List[Dict]]:
+        """Search for several queries with one encoder pass and one index search"""
+        mode = mode or self.search_mode
+        if mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
         try:
-            if self.index.ntotal == 0:
-                return []
-            
-            # Create query embedding
-            query_embedding = self.model.encode([query], convert_to_tensor=False)
-            query_embedding = query_embedding / np.linalg.norm(query_embedding, axis=1, keepdims=True)
-            
-            # Search in FAISS index
-            scores, indices = self.index.search(query_embedding.astype('float32'), top_k)
+            self._refresh()
+            if self.ntotal == 0 or not queries:
+                return [[] for _ in queries]
             
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.documents):
-                    doc = self.documents[idx].copy()
-                    doc["score"] = float(score)
-                    results.append(doc)
-            
-            return results
+            if mode == "keyword":
+                return self.search_keywords(queries, top_k, filters)
+            query_embeddings = self.encode_queries(queries)
+            if mode == "hybrid":
+                return self.search_hybrid(queries, query_embeddings, top_k, nprobe, ef_search, filters)
+            return self.search_vectors(query_embeddings, top_k, nprobe, ef_search, filters)
             
         except Exception as e:
             raise Exception(f"Error searching vector store: {str(e)}")
     
-    def _save_index(self):
-        """Save FAISS index and document metadata to disk"""
-        try:
-            faiss.write_index(self.index, self.index_file)
-            with open(self.docs_file, 'wb') as f:
-                pickle.dump(self.documents, f)
-        except Exception as e:
-            print(f"Warning: Could not save index: {str(e)}")
+    def search_keywords(self, queries: List[str], top_k: int = 5, filters: Dict = None) -> List[List[Dict]]:
+        """BM25 search; no embeddings are computed"""
+        self._refresh()
+        with self._index_lock.read():
+            bm25 = self._keyword_index()
+            allowed = self._candidate_filter(self.filter_rows(filters))
+            return [
+                self._results(bm25.search(query, top_k, allowed))
+                for query in queries
+            ]
+    
+    def search_hybrid(
+        self,
+        queries: List[str],
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        filters: Dict = None
+    ) -> List[List[Dict]]:
+        """Fuse dense and BM25 rankings with reciprocal rank fusion
+        
+        The score of each result is its fused score.
+        """
+        candidates = top_k * self.HYBRID_CANDIDATES_FACTOR
+        self._refresh()
+        with self._index_lock.read():
+            bm25 = self._keyword_index()
+            rows = self.filter_rows(filters)
+            allowed = self._candidate_filter(rows)
+            dense_rankings = self._search_ids(query_embeddings, candidates, nprobe, ef_search, rows)
+            batch_results = []
+            for query, dense_ranking in zip(queries, dense_rankings):
+                lexical_ranking = [idx for idx, _ in bm25.search(query, candidates, allowed)]
+                fused = reciprocal_rank_fusion([[idx for idx, _ in dense_ranking], lexical_ranking])
+                batch_results.append(self._results(fused[:top_k]))
+            return batch_results
+    
+    def _keyword_index(self) -> BM25Index:
+        """The BM25 index, built from the segment texts on first use
+        
+        The index lock must be held for reading: segments and deleted rows
+        cannot change meanwhile, and once built the index is kept up to
+        date by every later commit, delete and compaction.
+        """
+        if self.bm25 is None:
+            with self._bm25_lock:
+                if self.bm25 is None:
+                    self.bm25 = self._build_keyword_index(self.segments, self.deleted_rows)
+                    logger.info(f"Built BM25 index over {len(self.bm25)} rows")
+        return self.bm25
+    
+    def _build_keyword_index(self, segments: List[Segment], deleted_rows: np.ndarray) -> BM25Index:
+        bm25 = BM25Index()
+        for segment in segments:
+            bm25.add(segment.start, segment.texts())
+        bm25.delete(deleted_rows)
+        return bm25
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed and normalize queries for cosine similarity, reusing cached embeddings"""
+        query_embeddings = np.empty((len(queries), self.dimension), dtype='float32')
+        cached = self.query_cache.get_many(queries)
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        for i, embedding in enumerate(cached):
+            if embedding is not None:
+                query_embeddings[i] = embedding
+        
+        if missing:
+            encoded = self.model.encode([queries[i] for i in missing], convert_to_tensor=False)
+            encoded = (encoded / np.linalg.norm(encoded, axis=1, keepdims=True)).astype('float32')
+            query_embeddings[missing] = encoded
+            self.query_cache.put_many([queries[i] for i in missing], encoded)
+        return query_embeddings
+    
+    def search_vectors(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int = 5,
+        nprobe: int = None,
+        ef_search: int = None,
+        filters: Dict = None
+    ) -> List[List[Dict]]:
+        """Search the index with already encoded, normalized queries
+        
+        Row ids are looked up while the read lock is still held, so a
+        compaction swapping in renumbered rows cannot come in between.
+        """
+        self._refresh()
+        with self._index_lock.read():
+            rows = self.filter_rows(filters)
+            return [
+                self._results(ranking)
+                for ranking in self._search_ids(query_embeddings, top_k, nprobe, ef_search, rows)
+            ]
+    
+    def filter_rows(self, filters: Dict = None) -> Optional[np.ndarray]:
+        """Sorted row ids matching filters, or None when nothing is filtered
+        
+        filters may hold "document_ids" and "filenames" (lists, a chunk must
+        match both when both are given) and "page_from" / "page_to"
+        (inclusive page range). Document rows are looked up from their
+        contiguous row ranges and page-only filters from the sorted page
+        index of each segment, so the cost depends on the matching rows
+        rather than the corpus size; a page range within documents reads
+        the pages of those documents' rows only.
+        """
+        if not filters:
+            return None
+        document_ids = filters.get("document_ids")
+        filenames = filters.get("filenames")
+        page_range = self._page_range(filters)
+        if not document_ids and not filenames and page_range is None:
+            return None
+        
+        selected = set(document_ids) if document_ids else None
+        if filenames:
+            by_filename = set()
+            for filename in filenames:
+                by_filename |= self.filename_documents.get(filename, set())
+            selected = by_filename if selected is None else selected & by_filename
+        
+        if selected is None:
+            rows = np.concatenate(
+                [segment.page_rows(*page_range) + segment.start for segment in self.segments]
+                or [np.empty(0, dtype='int64')]
+            )
+            if len(self.deleted_rows):
+                rows = np.setdiff1d(rows, self.deleted_rows, assume_unique=True)
+            return rows
+        
+        ranges = sorted(
+            row_range for document_id in selected for row_range in self.document_rows.get(document_id, [])
+        )
+        if not ranges:
+            return np.empty(0, dtype='int64')
+        rows = np.concatenate([np.arange(start, end, dtype='int64') for start, end in ranges])
+        if page_range is not None:
+            pages = self._row_column(rows, PAGE)
+            rows = rows[self._in_page_range(pages, page_range)]
+        return rows
+    
+    @staticmethod
+    def _page_range(filters: Dict = None) -> Optional[Tuple[int, Optional[int]]]:
+        """(first page, last page or None) of the filters, or None without a page filter
+        
+        Chunks without a page are stored with page -1; an upper bound
+        excludes them.
+        """
+        page_from = (filters or {}).get("page_from")
+        page_to = (filters or {}).get("page_to")
+        if page_from is None and page_to is None:
+            return None
+        if page_to is None:
+            return page_from, None
+        return max(page_from if page_from is not None else 0, 0), page_to
+    
+    @staticmethod
+    def _in_page_range(pages: np.ndarray, page_range: Tuple[int, Optional[int]]) -> np.ndarray:
+        page_from, page_to = page_range
+        mask = pages >= page_from
+        if page_to is not None:
+            mask &= pages <= page_to
+        return mask
+    
+    @staticmethod
+    def _candidate_filter(rows: Optional[np.ndarray] = None) -> Optional[Callable[[np.ndarray], np.ndarray]]:
+        """Mask of the candidate row ids found in sorted rows, None when rows is None"""
+        if rows is None:
+            return None
+        
+        def allowed(candidates: np.ndarray) -> np.ndarray:
+            if not len(rows):
+                return np.zeros(len(candidates), dtype=bool)
+            positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+            return rows[positions] == candidates
+        return allowed
+    
+    def _search_ids(
+        self,
+        query_embeddings: np.ndarray,
+        top_k: int,
+        nprobe: int = None,
+        ef_search: int = None,
+        rows: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """(row id, score) of the nearest rows for each query, among rows if given
+        
+        Small row sets and exhaustive indexes are scanned directly from the
+        segment embeddings; approximate indexes search large row sets
+        (see filter_rows) through an ID selector, so filtered searches
+        return top_k results without fetching extra candidates. Indexes
+        holding quantized vectors return rerank_factor times more
+        candidates, re-scored exactly. The index lock must be held for
+        reading, until the row ids are resolved.
+        """
+        index = self.index
+        if index.ntotal == 0 or (rows is not None and len(rows) == 0):
+            return [[] for _ in range(len(query_embeddings))]
+        
+        selector = None
+        if rows is not None:
+            exhaustive = isinstance(index, MappedFlatIndex) or not isinstance(index, (faiss.IndexIVF, faiss.IndexHNSW))
+            if exhaustive or len(rows) <= self.filter_exact_rows:
+                return self._scan_rows(query_embeddings, top_k, rows)
+            selector = faiss.IDSelectorBatch(rows)
+        elif self._deleted_selector is not None:
+            selector = self._deleted_selector[0]
+        
+        rerank = (
+            self.rerank_factor > 1
+            and not isinstance(index, MappedFlatIndex)
+            and not ann_index.has_exact_scores(index)
+        )
+        k = top_k * self.rerank_factor if rerank else top_k
+        if isinstance(index, MappedFlatIndex):
+            scores, indices = index.search(query_embeddings, k, self.deleted_rows)
+        else:
+            params = ann_index.search_parameters(
+                index, k, nprobe or self.nprobe, ef_search or self.ef_search, selector
+            )
+            if params is not None:
+                scores, indices = index.search(query_embeddings, k, params=params)
+            else:
+                scores, indices = index.search(query_embeddings, k)
+        
+        rankings = [
+            [(int(idx), float(score)) for score, idx in zip(query_scores, query_indices) if idx >= 0]
+            for query_scores, query_indices in zip(scores, indices)
+        ]
+        if rerank:
+            return self._rerank(query_embeddings, rankings, top_k)
+        return rankings
+    
+    def _rerank(
+        self,
+        query_embeddings: np.ndarray,
+        rankings: List[List[Tuple[int, float]]],
+        top_k: int
+    ) -> List[List[Tuple[int, float]]]:
+        """Re-score candidates with their float32 embeddings and keep the top_k"""
+        candidates = np.unique(np.array([idx for ranking in rankings for idx, _ in ranking], dtype='int64'))
+        if not len(candidates):
+            return rankings
+        embeddings = self._row_embeddings(candidates)
+        reranked = []
+        for query, ranking in zip(query_embeddings, rankings):
+            rows = np.array([idx for idx, _ in ranking], dtype='int64')
+            scores = embeddings[np.searchsorted(candidates, rows)] @ query
+            order = np.argsort(-scores, kind='stable')[:top_k]
+            reranked.append([(int(rows[i]), float(scores[i])) for i in order])
+        return reranked
+    
+    def _scan_rows(self, query_embeddings: np.ndarray, top_k: int, rows: np.ndarray) -> List[List[Tuple[int, float]]]:
+        """Exact top_k over the given rows, read block by block from the segments"""
+        nq = len(query_embeddings)
+        best_scores = np.full((nq, 0), -np.inf, dtype='float32')
+        best_ids = np.full((nq, 0), -1, dtype='int64')
+        for block_start in range(0, len(rows), MappedFlatIndex.BLOCK_ROWS):
+            block_rows = rows[block_start:block_start + MappedFlatIndex.BLOCK_ROWS]
+            scores = np.hstack([best_scores, query_embeddings @ self._row_embeddings(block_rows).T])
+            ids = np.hstack([best_ids, np.broadcast_to(block_rows, (nq, len(block_rows)))])
+            k = min(top_k, scores.shape[1])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, top, axis=1)
+            best_ids = np.take_along_axis(ids, top, axis=1)
+        
+        order = np.argsort(-best_scores, axis=1)
+        return [
+            [(int(idx), float(score)) for score, idx in zip(query_scores[query_order], query_ids[query_order])]
+            for query_scores, query_ids, query_order in zip(best_scores, best_ids, order)
+        ]
+    
+    def _row_segments(self, rows: np.ndarray):
+        """Yield (segment, local row positions, slice of rows) for sorted row ids"""
+        starts = np.array([segment.start for segment in self.segments], dtype='int64')
+        owners = np.searchsorted(starts, rows, side='right') - 1
+        boundaries = np.flatnonzero(np.diff(owners)) + 1
+        for group_start, group_end in zip(np.r_[0, boundaries], np.r_[boundaries, len(rows)]):
+            segment = self.segments[owners[group_start]]
+            yield segment, rows[group_start:group_end] - segment.start, slice(group_start, group_end)
+    
+    def _row_column(self, rows: np.ndarray, column: int) -> np.ndarray:
+        values = np.empty(len(rows), dtype='int64')
+        for segment, local, positions in self._row_segments(rows):
+            values[positions] = segment.index[local, column]
+        return values
+    
+    def _row_embeddings(self, rows: np.ndarray) -> np.ndarray:
+        embeddings = np.empty((len(rows), self.dimension), dtype='float32')
+        for segment, local, positions in self._row_segments(rows):
+            embeddings[positions] = segment.embeddings[local]
+        return embeddings
+    
+    def _register_rows(
+        self,
+        segment: Segment,
+        document_rows: Dict,
+        filename_documents: Dict,
+        deleted: Set[str] = frozenset()
+    ) -> List[Tuple[int, int]]:
+        """Record the contiguous row range of each document in a segment
+        
+        Returns the ranges of the documents in deleted instead of recording them.
+        """
+        refs = np.asarray(segment.index[:, DOC_REF])
+        deleted_ranges = []
+        boundaries = np.flatnonzero(np.diff(refs)) + 1
+        for run_start, run_end in zip(np.r_[0, boundaries], np.r_[boundaries, len(refs)]):
+            document_id, filename = segment.documents[int(refs[run_start])]
+            row_range = (segment.start + int(run_start), segment.start + int(run_end))
+            if document_id in deleted:
+                deleted_ranges.append(row_range)
+                continue
+            document_rows.setdefault(document_id, []).append(row_range)
+            filename_documents.setdefault(filename, set()).add(document_id)
+        return deleted_ranges
+    
+    def _collect_rows(self, segments: List[Segment], tombstones: Dict[str, Set[str]]) -> Tuple[Dict, Dict, np.ndarray]:
+        """Document row ranges, filename map and deleted rows of the given segments"""
+        document_rows, filename_documents = {}, {}
+        deleted_ranges = []
+        for segment in segments:
+            deleted_ranges += self._register_rows(
+                segment, document_rows, filename_documents, tombstones.get(segment.name, frozenset())
+            )
+        deleted_rows = np.concatenate(
+            [np.empty(0, dtype='int64')] + [np.arange(start, end, dtype='int64') for start, end in deleted_ranges]
+        )
+        return document_rows, filename_documents, deleted_rows
+    
+    def _add_metadata(self, segments: List[Segment], documents, bm25: Optional[BM25Index]):
+        """Append the chunks of segments to a chunk list and BM25 index, if one is built"""
+        for segment in segments:
+            if self.storage_mode == "mmap":
+                documents.add_segment(segment)
+            else:
+                documents.extend(segment.chunks())
+            if bm25 is not None:
+                bm25.add(segment.start, segment.texts())
+    
+    def _add_to_index(self, index, segments: List[Segment]):
+        if isinstance(index, MappedFlatIndex):
+            for segment in segments:
+                index.add_segment(segment)
+        else:
+            ann_index.add_segments(index, segments)
+    
+    def _results(self, ranking: List[Tuple[int, float]]) -> List[Dict]:
+        """Chunk metadata with scores for (row id, score) pairs"""
+        results = []
+        for idx, score in ranking:
+            if 0 <= idx < len(self.documents):
+                doc = self.documents[idx].to_dict()
+                doc["score"] = float(score)
+                results.append(doc)
+        return results
     
     def _load_index(self):
-        """Load FAISS index and document metadata from disk"""
+        """Load FAISS index and document metadata from the segment store"""
         try:
-            if os.path.exists(self.index_file) and os.path.exists(self.docs_file):
-                self.index = faiss.read_index(self.index_file)
-                with open(self.docs_file, 'rb') as f:
-                    self.documents = pickle.load(f)
+            # Only maps the segment files; nothing is read until searched
+            self._load_view(self.segment_store.load_segments(), self.segment_store.tombstones())
+            if len(self.documents):
                 print(f"Loaded existing index with {len(self.documents)} documents")
+            self._maybe_compact()
+            self._maybe_rebuild_index()
         except Exception as e:
             print(f"Could not load existing index: {str(e)}")
             # Initialize empty index if loading fails
-            self.index = faiss.IndexFlatIP(self.dimension)
-            self.documents = []
+            self.index, self.documents = self._empty_index()
+            self.segments = []
+            if self.bm25 is not None:
+                self.bm25.clear()
+            self.document_rows, self.filename_documents = {}, {}
+            self._set_deleted_rows(np.empty(0, dtype='int64'))
+    
+    def _load_view(self, segments: List[Segment], tombstones: Dict[str, Set[str]]):
+        """Build the index, chunk list and row maps of the given segments
+        
+        A saved ANN index is used if it was built over a prefix of the
+        segments. Once the store is searched, the index lock must be held
+        for writing.
+        """
+        index, documents = self._empty_index()
+        # The BM25 index is not persisted; segments hold all the text it
+        # needs, and it is only built here for keyword or hybrid retrieval
+        bm25 = BM25Index() if self.search_mode != "dense" else None
+        self._add_metadata(segments, documents, bm25)
+        document_rows, filename_documents, deleted_rows = self._collect_rows(segments, tombstones)
+        if bm25 is not None:
+            bm25.delete(deleted_rows)
+        
+        saved, ann_rows = (None, 0)
+        if self._uses_trained_index():
+            saved, ann_rows = ann_index.load_index(
+                self.index_type, self.ann_file, self.quantization, [segment.name for segment in segments]
+            )
+        if saved is not None:
+            # Catch up with segments committed after the index was saved
+            ann_index.add_segments(saved, segments, start_row=ann_rows)
+            index = saved
+        elif self.storage_mode == "mmap":
+            index = MappedFlatIndex(self.dimension, segments)
+        else:
+            ann_index.add_segments(index, segments)
+        
+        self.index, self.documents, self.segments, self.bm25, self.ann_rows = (
+            index, documents, segments, bm25, ann_rows
+        )
+        self.document_rows, self.filename_documents = document_rows, filename_documents
+        self._set_deleted_rows(deleted_rows)
+        self._rows_version += 1
+    
+    def _maybe_rebuild_index(self):
+        """Start a background ANN build once the corpus is large enough.
+        
+        IVF indexes are rebuilt whenever the corpus has grown fourfold since
+        the last build, so the number of lists keeps up with its size.
+        """
+        if not self._uses_trained_index():
+            return
+        ntotal = sum(segment.rows for segment in self.segments)
+        if ntotal < self.ann_threshold:
+            return
+        if self.ann_rows and (self.index_type == "hnsw" or ntotal < 4 * self.ann_rows):
+            return
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        
+        self._rebuild_thread = threading.Thread(
+            target=self._rebuild_index, name="ann-index-build", daemon=True
+        )
+        self._rebuild_thread.start()
+    
+    def _uses_trained_index(self) -> bool:
+        """Whether a trained index replaces the exact one once the corpus is large enough"""
+        return self.index_type != "flat" or self.quantization in ann_index.TRAINED_QUANTIZATIONS
+    
+    def _rebuild_index(self):
+        """Build the ANN index off the request path and swap it in
+        
+        Training runs without the maintenance lock, so compactions are not
+        held up by it; the build is dropped if one purged rows meanwhile.
+        """
+        try:
+            with self._index_lock.read():
+                segments = list(self.segments)
+                rows_version = self._rows_version
+            names = [segment.name for segment in segments]
+            
+            index = ann_index.build_index(self.index_type, self.dimension, segments, self.quantization)
+            built_rows = index.ntotal
+            pending_ann_file = f"{self.ann_file}.{os.getpid()}"
+            ann_index.save_index(index, self.index_type, pending_ann_file, self.quantization, names)
+            
+            with self._maintenance_lock:
+                with self.segment_store.locked():
+                    if self.segment_store.segment_names()[:len(names)] == names:
+                        ann_index.move_index(pending_ann_file, self.ann_file)
+                    else:
+                        ann_index.remove_index(pending_ann_file)
+                
+                with self._index_lock.write():
+                    if self._rows_version != rows_version:
+                        logger.info(f"Dropped a {self.index_type} index built over rows compacted meanwhile")
+                        return
+                    # Uploads that landed while training still need to be added
+                    ann_index.add_segments(index, self.segments, start_row=built_rows)
+                    self.index = index
+                    self.ann_rows = built_rows
+            logger.info(f"Built {self.index_type} index over {built_rows} vectors")
+        except Exception as e:
+            logger.error(f"Failed to build {self.index_type} index: {str(e)}")
+    
+    def _needs_compaction(self) -> bool:
+        """Whether there are too many segments or deleted rows"""
+        total_rows = sum(segment.rows for segment in self.segments)
+        too_many_deleted = total_rows and len(self.deleted_rows) / total_rows >= self.compact_deleted_ratio
+        return bool(self.segment_store.needs_compaction() or too_many_deleted)
+    
+    def _maybe_compact(self):
+        """Start a background compaction once there are too many segments or deleted rows"""
+        if not self._needs_compaction():
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        
+        self._compaction_thread = threading.Thread(
+            target=self._compact_in_background, name="segment-compaction", daemon=True
+        )
+        self._compaction_thread.start()
+    
+    def _compact_in_background(self):
+        try:
+            # Each merge folds MERGE_FACTOR segments, which may not be enough
+            while self._needs_compaction():
+                if not self.compact():
+                    break
+        except Exception as e:
+            logger.error(f"Segment compaction failed: {str(e)}")
+    
+    def compact(self) -> bool:
+        """Merge a run of segments and drop the rows of deleted documents
+        
+        The segment store picks the run (see SegmentStore._select_run) and
+        writes the merged segment; returns False when there was nothing to
+        merge. Without deleted rows only the segment files change. When rows
+        are purged, the positions after them shift: the index, chunk list
+        and BM25 postings are rebuilt off the request path from the stored
+        embeddings and text, and only segments committed meanwhile are
+        added under the lock before the new view is swapped in.
+        """
+        with self._maintenance_lock:
+            plan = self.segment_store.prepare_compaction()
+            if plan is None:
+                return False
+            
+            if not plan["purged"]:
+                # Same rows in the same order: only the segment files changed
+                with self._index_lock.write():
+                    with self.segment_store.locked():
+                        changed = self._sync_with_log()
+                        segments = self.segment_store.install_compaction(plan)
+                    self._notify_synced(changed)
+                    if segments is None:
+                        return False
+                    self.segments = segments
+                    if isinstance(self.index, MappedFlatIndex):
+                        self.index = MappedFlatIndex(self.dimension, self.segments)
+                    if isinstance(self.documents, MappedChunks):
+                        self.documents = MappedChunks(self.segments)
+                return True
+            
+            try:
+                # Segments before the run keep their files and row positions
+                with self._index_lock.read():
+                    rebuilt = self.segments[:plan["first"]]
+                if plan["record"]:
+                    start = sum(segment.rows for segment in rebuilt)
+                    rebuilt = rebuilt + [self.segment_store.open_segment(plan["record"], start)]
+                index, documents = self._empty_index()
+                bm25 = BM25Index(self.bm25.k1, self.bm25.b) if self.bm25 is not None else None
+                self._add_metadata(rebuilt, documents, bm25)
+                ann_rows = 0
+                pending_ann_file = self.ann_file + ".compacted"
+                if self.ann_rows and sum(segment.rows for segment in rebuilt) >= self.ann_threshold:
+                    index = ann_index.build_index(self.index_type, self.dimension, rebuilt, self.quantization)
+                    ann_index.save_index(
+                        index, self.index_type, pending_ann_file, self.quantization,
+                        [segment.name for segment in rebuilt]
+                    )
+                    ann_rows = index.ntotal
+                else:
+                    self._add_to_index(index, rebuilt)
+            except Exception:
+                self.segment_store.abort_compaction(plan)
+                raise
+            
+            with self._index_lock.write():
+                # Segments and deletions other processes wrote meanwhile are
+                # part of the installed view
+                with self.segment_store.locked():
+                    _, records = self.segment_store.sync()
+                    segments = self.segment_store.install_compaction(plan)
+                    if segments is None:
+                        ann_index.remove_index(pending_ann_file)
+                        return False
+                    # A saved index with the old row positions must never be loaded again
+                    ann_index.remove_index(self.ann_file)
+                    if ann_rows:
+                        ann_index.move_index(pending_ann_file, self.ann_file)
+                    tombstones = self.segment_store.tombstones()
+                later = segments[len(rebuilt):]
+                self._add_to_index(index, later)
+                self._add_metadata(later, documents, bm25)
+                document_rows, filename_documents, deleted_rows = self._collect_rows(segments, tombstones)
+                if bm25 is not None:
+                    bm25.delete(deleted_rows)
+                elif self.bm25 is not None:
+                    # A keyword query built the BM25 index while merging
+                    bm25 = self._build_keyword_index(segments, deleted_rows)
+                
+                self.index, self.documents, self.segments, self.bm25, self.ann_rows = (
+                    index, documents, segments, bm25, ann_rows
+                )
+                self.document_rows, self.filename_documents = document_rows, filename_documents
+                self._set_deleted_rows(deleted_rows)
+                self._rows_version += 1
+        
+        self._notify_synced(self._record_documents(records))
+        self._maybe_rebuild_index()
+        return True
+    
+    def _empty_index(self):
+        """Create an empty index and metadata container for the storage mode"""
+        if self.storage_mode == "mmap":
+            return MappedFlatIndex(self.dimension), MappedChunks()
+        # Inner Product for cosine similarity
+        return ann_index.create_exact_index(self.dimension, self.quantization), []
+    
+    def _migrate_legacy_index(self):
+        """Import a single-file FAISS index and pickle into the segment store"""
+        if not (os.path.exists(self.index_file) and os.path.exists(self.docs_file)):
+            return
+        
+        legacy_index = faiss.read_index(self.index_file)
+        with open(self.docs_file, 'rb') as f:
+            documents = pickle.load(f)
+        
+        if legacy_index.ntotal:
+            embeddings = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+            self.segment_store.append(embeddings, documents)
+        
+        for file in [self.index_file, self.docs_file]:
+            os.remove(file)
+        print(f"Migrated legacy index with {len(documents)} documents to {self.store_path}")
     
     def get_stats(self) -> Dict:
         """Get vector store statistics"""
         return {
             "total_documents": len(self.documents),
             "index_size": self.index.ntotal,
-            "dimension": self.dimension
+            "dimension": self.dimension,
+            "segments": self.segment_store.segment_count(),
+            "storage_mode": self.storage_mode,
+            "index_type": self.index_type if self.ann_rows else "flat",
+            "ann_rows": self.ann_rows,
+            "quantization": self.quantization,
+            "index_memory_bytes": self._index_memory(),
+            "query_cache": self.query_cache.get_stats(),
+            "search_mode": self.search_mode,
+            "bm25": self.bm25.get_stats() if self.bm25 is not None else None,
+            "deleted_chunks": len(self.deleted_rows)
         }
     
+    def evaluate_quantization(self, top_k: int = 10, sample_size: int = 100, max_rows: int = 20000) -> Dict:
+        """Memory footprint and recall@k of every quantization and of the live index
+        
+        Stored embeddings of sample_size random rows serve as queries. Each
+        encoding is built over up to max_rows random rows and compared with
+        exact search over the same rows, without and with re-ranking; the
+        live index is compared with an exact scan of all rows.
+        """
+        with self._index_lock.read():
+            rows = np.setdiff1d(
+                np.arange(sum(segment.rows for segment in self.segments), dtype='int64'), self.deleted_rows
+            )
+            report = {
+                "top_k": top_k,
+                "rows": len(rows),
+                "rerank_factor": self.rerank_factor,
+                "current": None,
+                "modes": {}
+            }
+            if not len(rows):
+                return report
+            rng = np.random.default_rng(0)
+            queries = self._row_embeddings(np.sort(rng.choice(rows, size=min(sample_size, len(rows)), replace=False)))
+            
+            exact = self._scan_rows(queries, top_k, rows)
+            live = self._search_ids(queries, top_k)
+            report["current"] = {
+                "index_type": self.index_type if self.ann_rows else "flat",
+                "quantization": self.quantization,
+                "memory_bytes": self._index_memory(),
+                "recall_at_k": ann_index.recall_at_k(live, exact)
+            }
+            
+            sample_rows = np.sort(rng.choice(rows, size=min(max_rows, len(rows)), replace=False))
+            vectors = self._row_embeddings(sample_rows)
+        exact = [[(int(i), 0.0) for i in ids] for ids in np.argsort(-(queries @ vectors.T), axis=1)[:, :top_k]]
+        report["sample_rows"] = len(sample_rows)
+        for quantization in ann_index.QUANTIZATIONS:
+            index = ann_index.create_index("flat", self.dimension, len(vectors), quantization)
+            if not index.is_trained:
+                # Only PQ codebooks need a minimum of training rows
+                if quantization in ann_index.TRAINED_QUANTIZATIONS and len(vectors) < ann_index.PQ_CENTROIDS:
+                    report["modes"][quantization] = None
+                    continue
+                index.train(vectors)
+            index.add(vectors)
+            k = top_k * max(self.rerank_factor, 1)
+            _, indices = index.search(queries, k)
+            candidates = [[(int(i), 0.0) for i in ids if i >= 0] for ids in indices]
+            reranked = []
+            for query, ranking in zip(queries, candidates):
+                ids = np.array([i for i, _ in ranking], dtype='int64')
+                order = np.argsort(-(vectors[ids] @ query), kind='stable')[:top_k]
+                reranked.append([ranking[i] for i in order])
+            bytes_per_vector = ann_index.index_memory(index) / len(vectors)
+            report["modes"][quantization] = {
+                "bytes_per_vector": round(bytes_per_vector, 1),
+                "memory_bytes": int(bytes_per_vector * len(rows)),
+                "recall_at_k": ann_index.recall_at_k([ranking[:top_k] for ranking in candidates], exact),
+                "recall_at_k_reranked": ann_index.recall_at_k(reranked, exact)
+            }
+        return report
+    
+    def _index_memory(self) -> int:
+        """Bytes the index holds in memory; mmap mode reads vectors from the segment files"""
+        if isinstance(self.index, MappedFlatIndex):
+            return 0
+        return ann_index.index_memory(self.index)
+    
     def clear_index(self):
         """Clear all documents from the index"""
-        self.index = faiss.IndexFlatIP(self.dimension)
-        self.documents = []
+        with self._index_lock.write():
+            self.index, self.documents = self._empty_index()
+            self.segments = []
+            self.ann_rows = 0
+            if self.bm25 is not None:
+                self.bm25.clear()
+            self.document_rows, self.filename_documents = {}, {}
+            self._set_deleted_rows(np.empty(0, dtype='int64'))
+            self._rows_version += 1
+        self._notify_change(None)
         # Remove saved files
+        self.segment_store.clear()
         for file in [self.index_file, self.docs_file]:
             if os.path.exists(file):
-                os.remove(file) 
\ No newline at end of file
+                os.remove(file) 
+
+class DocumentWriter:
+    """Streams one document into a VectorStore in fixed-size embedding batches
+    
+    Chunks whose text hash is found in the embeddings passed to add() are
+    not encoded again; embeddings computed here are collected in
+    new_embeddings so the caller can cache them. A replacing writer deletes
+    the document's previous chunks when it commits.
+    """
+    
+    def __init__(
+        self,
+        vector_store: VectorStore,
+        document_id: str,
+        filename: str,
+        batch_size: int = 64,
+        replace: bool = False
+    ):
+        self.vector_store = vector_store
+        self.document_id = document_id
+        self.filename = filename
+        self.batch_size = batch_size
+        self.replace = replace
+        self.rows = 0
+        self.reused = 0
+        self.new_embeddings = []  # (content hash, float32 bytes) encoded by this writer
+        self._pending = []
+        self._known = {}  # content hash -> embedding
+        self._writer = vector_store.segment_store.create_writer()
+    
+    def add(self, chunks: Iterable[Dict], embeddings: Dict[str, bytes] = None) -> int:
+        """Queue chunks, embedding every full batch; returns chunks embedded so far
+        
+        embeddings maps chunk content hashes to already known float32 vectors.
+        """
+        for content_hash, embedding in (embeddings or {}).items():
+            self._known[content_hash] = np.frombuffer(embedding, dtype='float32')
+        for chunk in chunks:
+            self._pending.append(chunk)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+        return self.rows
+    
+    def commit(self) -> int:
+        """Embed what is left and make the document searchable"""
+        self.flush()
+        if self.rows == 0:
+            self.abort()
+            return 0
+        self.vector_store._commit_segment(self._writer, self.document_id if self.replace else None)
+        return self.rows
+    
+    def abort(self):
+        """Discard everything written for this document"""
+        self._writer.abort()
+    
+    def take_new_embeddings(self) -> List[Tuple[str, bytes]]:
+        """Return and forget the embeddings computed since the last call"""
+        new_embeddings, self.new_embeddings = self.new_embeddings, []
+        return new_embeddings
+    
+    def flush(self):
+        """Embed and write any queued chunks, even if the batch is not full"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        hashes = [chunk_hash(chunk["text"]) for chunk in batch]
+        
+        missing = list(dict.fromkeys(h for h in hashes if h not in self._known))
+        if missing:
+            texts = {h: chunk["text"] for h, chunk in zip(hashes, batch)}
+            encoded = self.vector_store.encode_documents([texts[h] for h in missing])
+            for content_hash, embedding in zip(missing, encoded):
+                self._known[content_hash] = embedding
+                self.new_embeddings.append((content_hash, embedding.tobytes()))
+        self.reused += len(batch) - len(missing)
+        
+        embeddings = np.vstack([self._known[h] for h in hashes]).astype('float32')
+        # Only chunks still to come need their known embeddings
+        for content_hash in hashes:
+            self._known.pop(content_hash, None)
+        self._writer.write(
+            embeddings,
+            self.vector_store._chunk_metadata(batch, self.document_id, self.filename, self.rows)
+        )
+        self.rows += len(batch)
+
+def chunk_hash(text: str) -> str:
+    """Content hash identifying a chunk text in the embedding cache"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
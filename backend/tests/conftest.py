@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from .helpers import HashEncoder
+
+# Settings read from the environment by the services; tests start from the defaults
+ENV_PREFIXES = (
+    "VECTOR_", "RETRIEVAL_", "QUERY_CACHE_", "ANSWER_CACHE_", "RERANK_", "DATABASE_",
+    "CONVERSATION_", "HISTORY_", "INGEST_", "PDF_", "CONTEXT_"
+)
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """Run each test in its own directory, with no service settings from the environment
+
+    Relative default paths (./vector_store, ragbot.db) land in tmp_path.
+    """
+    for name in list(os.environ):
+        if name.startswith(ENV_PREFIXES):
+            monkeypatch.delenv(name)
+    monkeypatch.chdir(tmp_path)
+
+@pytest.fixture
+def encoder():
+    return HashEncoder()
+
+@pytest.fixture
+def make_store(tmp_path, encoder):
+    """Factory for VectorStores using the hash encoder (or model), by default all on one path"""
+    from backend.services.vector_store import VectorStore
+
+    def make(store_path=None, model=None, **kwargs):
+        return VectorStore(store_path=str(store_path or tmp_path / "store"), model=model or encoder, **kwargs)
+    return make
+
+@pytest.fixture
+def db(tmp_path):
+    from backend.services.database import DatabaseService
+
+    service = DatabaseService(db_path=str(tmp_path / "ragbot.db"))
+    yield service
+    service.close()
@@ -0,0 +1,91 @@
+"""Test doubles and data builders shared by the test modules
+
+Kept out of conftest.py so that worker processes started by the
+multi-process tests can import them too.
+"""
+from typing import Dict, List
+import hashlib
+
+import numpy as np
+
+class HashEncoder:
+    """Deterministic stand-in for a SentenceTransformer
+
+    Each word adds one to a hashed dimension, so texts sharing words are
+    close and nothing has to be downloaded.
+    """
+
+    dimension = 32
+
+    def __init__(self, model_name: str = "hash-encoder", *args, **kwargs):
+        self.model_name = model_name
+        self.encoded = 0  # Texts encoded so far
+        self.batch_sizes = []  # Texts per encode call
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts: List[str], convert_to_tensor: bool = False, **kwargs) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dimension] += 1
+        # No all-zero vector for empty texts
+        vectors[:, 0] += 0.01
+        self.encoded += len(texts)
+        self.batch_sizes.append(len(texts))
+        return vectors
+
+class RandomEncoder(HashEncoder):
+    """Encoder giving every distinct text its own random direction
+
+    Unlike HashEncoder's, its vectors never tie, so rankings are unique.
+    """
+
+    def encode(self, texts: List[str], convert_to_tensor: bool = False, **kwargs) -> np.ndarray:
+        self.encoded += len(texts)
+        self.batch_sizes.append(len(texts))
+        return np.array([
+            np.random.default_rng(int(hashlib.md5(text.encode('utf-8')).hexdigest(), 16)).standard_normal(self.dimension)
+            for text in texts
+        ], dtype='float32').reshape(len(texts), self.dimension)
+
+def make_chunks(document: str, count: int, rows_per_page: int = 3) -> List[Dict]:
+    """Chunks as PDFProcessor emits them, rows_per_page to a page"""
+    return [
+        {"text": f"{document} chunk {i} about widgets", "page": 1 + i // rows_per_page, "chunk_id": i}
+        for i in range(count)
+    ]
+
+def segment_chunks(document: str, count: int, filename: str = "doc.pdf") -> List[Dict]:
+    """Rows for SegmentStore.append, all of one document"""
+    return [
+        {"text": f"{document} row {i}", "document_id": document, "source": filename, "page": i + 1, "chunk_id": i}
+        for i in range(count)
+    ]
+
+def make_pdf(pages: List[str]) -> bytes:
+    """A minimal PDF with one line of Helvetica text per page"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = f"BT /F1 10 Tf 20 700 Td ({escaped}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>"
+
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('ascii')
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('ascii')
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('ascii')
+    return pdf
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+ROWS = 400
+
+def varied_chunks(count: int):
+    return [{"text": f"w{i} w{i % 7}x w{i % 13}y", "page": 1, "chunk_id": i} for i in range(count)]
+
+def best_score(store, query: str) -> float:
+    embeddings = store._row_embeddings(np.arange(store.ntotal))
+    return float((embeddings @ store.encode_queries([query])[0]).max())
+
+@pytest.fixture(autouse=True)
+def small_ann_threshold(monkeypatch):
+    monkeypatch.setenv("VECTOR_ANN_THRESHOLD", str(ROWS))
+    # Probe every list, so IVF results can be compared with exact search
+    monkeypatch.setenv("VECTOR_NPROBE", "4096")
+
+def test_small_corpus_stays_exact(make_store):
+    store = make_store(index_type="hnsw")
+    store.add_documents(varied_chunks(ROWS - 1), "a", "a.pdf")
+
+    assert store._rebuild_thread is None
+    assert store.get_stats()["index_type"] == "flat"
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "ivf_pq", "hnsw"])
+def test_ann_index_is_built_past_the_threshold_and_reloaded(make_store, index_type):
+    store = make_store(index_type=index_type)
+    store.add_documents(varied_chunks(ROWS), "a", "a.pdf")
+    store._rebuild_thread.join(60)
+
+    assert store.get_stats()["index_type"] == index_type
+    assert store.ann_rows == ROWS
+    assert os.path.exists(store.ann_file)
+
+    reopened = make_store(index_type=index_type)
+    # The saved index is used as is, not trained again
+    assert reopened._rebuild_thread is None
+    assert reopened.ann_rows == ROWS
+    results = reopened.search("w5 w5x w5y", top_k=3)
+    assert results[0]["score"] == pytest.approx(best_score(reopened, "w5 w5x w5y"), abs=1e-4)
+
+def test_saved_index_of_another_type_is_ignored(make_store):
+    store = make_store(index_type="ivf_flat")
+    store.add_documents(varied_chunks(ROWS), "a", "a.pdf")
+    store._rebuild_thread.join(60)
+
+    reopened = make_store(index_type="hnsw")
+
+    assert reopened.ann_rows == 0
+    reopened._rebuild_thread.join(60)
+    assert reopened.get_stats()["index_type"] == "hnsw"
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from backend.services import answer_cache
+from backend.services.answer_cache import SemanticAnswerCache
+from .helpers import make_chunks
+
+RESULTS = [{"document_id": "a", "chunk_id": 0}, {"document_id": "b", "chunk_id": 3}]
+
+def unit(*values) -> np.ndarray:
+    vector = np.array(values, dtype='float32')
+    return vector / np.linalg.norm(vector)
+
+@pytest.fixture
+def cache():
+    return SemanticAnswerCache(endpoints=("query",), similarity_threshold=0.95)
+
+def test_similar_question_over_the_same_chunks_hits(cache):
+    key = cache.make_key("query", "llm", RESULTS)
+    cache.put(key, unit(1, 0, 0), "Widgets have three parts.", ["source"])
+
+    answer = cache.get(cache.make_key("query", "llm", list(reversed(RESULTS))), unit(1, 0.1, 0))
+
+    assert answer.response == "Widgets have three parts."
+    assert answer.sources == ["source"]
+    assert cache.get_stats()["endpoints"]["query"] == {"hits": 1, "misses": 0, "hit_rate": 1.0}
+
+def test_dissimilar_question_misses(cache):
+    key = cache.make_key("query", "llm", RESULTS)
+    cache.put(key, unit(1, 0, 0), "answer", [])
+
+    assert cache.get(key, unit(1, 1, 0)) is None
+    assert cache.get_stats()["endpoints"]["query"]["misses"] == 1
+
+def test_other_chunks_model_or_history_miss(cache):
+    key = cache.make_key("query", "llm", RESULTS)
+    cache.put(key, unit(1, 0, 0), "answer", [])
+
+    history = [{"query": "earlier question", "response": "earlier answer"}]
+    for other in (
+        cache.make_key("query", "llm", RESULTS[:1]),
+        cache.make_key("query", "other-llm", RESULTS),
+        cache.make_key("query", "llm", RESULTS, history),
+    ):
+        assert cache.get(other, unit(1, 0, 0)) is None
+
+def test_answers_on_a_changed_document_are_dropped(cache):
+    cache.put(cache.make_key("query", "llm", RESULTS), unit(1, 0, 0), "on a and b", [])
+    only_c = cache.make_key("query", "llm", [{"document_id": "c", "chunk_id": 0}])
+    cache.put(only_c, unit(1, 0, 0), "on c", [])
+
+    cache.invalidate(["b"])
+
+    assert cache.get(cache.make_key("query", "llm", RESULTS), unit(1, 0, 0)) is None
+    assert cache.get(only_c, unit(1, 0, 0)).response == "on c"
+    cache.invalidate(None)
+    assert cache.get_stats()["entries"] == 0
+
+def test_expired_and_least_recently_used_answers_go(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "time", lambda: now[0])
+    cache = SemanticAnswerCache(max_entries=2, ttl_seconds=60)
+    keys = [cache.make_key("query", "llm", [{"document_id": name, "chunk_id": 0}]) for name in "abc"]
+    for key in keys:
+        cache.put(key, unit(1, 0, 0), "answer", [])
+
+    assert cache.get(keys[0], unit(1, 0, 0)) is None
+    assert cache.get(keys[2], unit(1, 0, 0)) is not None
+    now[0] += 61
+    assert cache.get(keys[2], unit(1, 0, 0)) is None
+
+def test_store_changes_invalidate_answers(make_store, cache):
+    store = make_store()
+    store.add_change_listener(cache.invalidate)
+    store.add_documents(make_chunks("a", 3), "a", "a.pdf")
+    key = cache.make_key("query", "llm", store.search("a chunk 1", top_k=2))
+    cache.put(key, unit(1, 0, 0), "answer", [])
+
+    store.delete_document("a")
+
+    assert cache.get(key, unit(1, 0, 0)) is None
+    assert cache.get_stats()["invalidations"] == 1
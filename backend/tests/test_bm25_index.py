@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+import pytest
+
+from backend.services.bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "Replace filter AB-1234 every six months.",
+    "Error 0x80070005 means access is denied.",
+    "The filter housing holds one filter.",
+    "Firmware v2.1.3 fixes the pump timer.",
+    "Pump and filter are serviced together.",
+]
+
+def reference_scores(texts, query, k1=1.5, b=0.75):
+    """BM25 computed directly from the definition"""
+    documents = [tokenize(text) for text in texts]
+    average_length = sum(map(len, documents)) / len(documents)
+    scores = {}
+    for term in set(tokenize(query)):
+        containing = sum(term in document for document in documents)
+        if not containing:
+            continue
+        idf = math.log(1 + (len(documents) - containing + 0.5) / (containing + 0.5))
+        for doc_id, document in enumerate(documents):
+            freq = document.count(term)
+            if freq:
+                norm = k1 * (1 - b + b * len(document) / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (k1 + 1) / (freq + norm)
+    return scores
+
+def test_identifiers_are_single_terms():
+    assert tokenize("Part AB-1234, error 0x80070005 in v2.1.3.") == ["part", "ab-1234", "error", "0x80070005", "in", "v2.1.3"]
+
+@pytest.mark.parametrize("query", ["filter", "pump filter", "AB-1234", "v2.1.3 timer", "unknown words"])
+def test_scores_match_the_bm25_definition(query):
+    index = BM25Index()
+    index.add(0, TEXTS[:2])
+    index.add(2, TEXTS[2:])
+
+    results = index.search(query, top_k=10)
+
+    expected = reference_scores(TEXTS, query)
+    assert {doc_id: pytest.approx(score) for doc_id, score in results} == expected
+    assert [score for _, score in results] == sorted(expected.values(), reverse=True)
+
+def test_deleted_and_disallowed_documents_are_not_returned():
+    index = BM25Index()
+    index.add(0, TEXTS)
+    index.delete([2])
+
+    assert 2 not in dict(index.search("filter", top_k=10))
+    allowed = index.search("filter", top_k=10, allowed=lambda doc_ids: doc_ids != 4)
+    assert sorted(doc_id for doc_id, _ in allowed) == [0]
+    assert index.get_stats()["deleted"] == 1
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+
+    assert [doc_id for doc_id, _ in fused] == [1, 3, 2, 4]
+    assert dict(fused)[1] == pytest.approx(1 / 61 + 1 / 62)
+
+def test_keyword_search_finds_exact_identifiers(make_store):
+    store = make_store()
+    store.add_documents([{"text": text, "page": 1, "chunk_id": i} for i, text in enumerate(TEXTS)], "manual", "m.pdf")
+
+    assert store.search("0x80070005", top_k=1, mode="keyword")[0]["chunk_id"] == 1
+    hybrid = store.search("AB-1234", top_k=3, mode="hybrid")
+    assert hybrid[0]["chunk_id"] == 0
+
+def test_dense_store_builds_the_keyword_index_on_first_use(make_store):
+    store = make_store()
+    store.add_documents([{"text": text, "page": 1, "chunk_id": i} for i, text in enumerate(TEXTS)], "manual", "m.pdf")
+    store.search("filter", top_k=2)
+    assert store.bm25 is None
+
+    store.search("filter", top_k=2, mode="keyword")
+    assert len(store.bm25) == len(TEXTS)
+
+    # Kept current by later uploads and deletes
+    store.add_documents([{"text": "Gasket AB-9999 seals the lid.", "page": 1, "chunk_id": 0}], "extra", "e.pdf")
+    assert store.search("AB-9999", top_k=1, mode="keyword")[0]["document_id"] == "extra"
+    store.delete_document("extra")
+    assert store.search("AB-9999", top_k=1, mode="keyword") == []
+
+def test_keyword_store_reloads_its_index(make_store, monkeypatch):
+    monkeypatch.setenv("RETRIEVAL_MODE", "keyword")
+    make_store().add_documents([{"text": text, "page": 1, "chunk_id": i} for i, text in enumerate(TEXTS)], "manual", "m.pdf")
+
+    store = make_store()
+
+    assert store.search("firmware", top_k=1)[0]["chunk_id"] == 3
+    assert np.isclose(store.search("firmware", top_k=1)[0]["score"], max(reference_scores(TEXTS, "firmware").values()))
@@ -0,0 +1,82 @@
+import pytest
+
+from backend.services.context_builder import ApproximateTokenizer, ContextBuilder
+
+tokens = ApproximateTokenizer().count
+
+def result(text: str, score: float, chunk_id: int = None, document_id: str = "doc-1", **extra):
+    return {"text": text, "score": score, "chunk_id": chunk_id, "document_id": document_id, "source": "a.pdf", **extra}
+
+def turn(n: int, size: int = 40):
+    return {"query": f"question {n}", "response": f"answer {n} " + "x" * size}
+
+@pytest.fixture
+def builder():
+    return ContextBuilder(context_tokens=100, history_tokens=100, tokenizer=ApproximateTokenizer())
+
+def test_context_takes_the_most_relevant_chunks_within_the_budget(builder):
+    results = [result("low " * 40, 0.2, 1), result("high " * 40, 0.9, 5), result("mid " * 60, 0.5, 9)]
+
+    context, selected = builder.build_context(results)
+
+    assert [item["score"] for item in selected] == [0.9, 0.5]
+    assert tokens(context) <= builder.context_tokens + 1
+    assert context.startswith("high")
+
+def test_reranker_scores_order_the_context(builder):
+    results = [result("first " * 5, 0.9, 1, rerank_score=-2.0), result("second " * 5, 0.1, 5, rerank_score=3.0)]
+
+    _, selected = builder.build_context(results)
+
+    assert [item["chunk_id"] for item in selected] == [5, 1]
+
+def test_overlap_with_adjacent_chunks_is_counted_once():
+    builder = ContextBuilder(context_tokens=1000, tokenizer=ApproximateTokenizer())
+    shared = "the housing is sealed with two rubber gaskets."
+    first = result("Widgets are assembled from three parts and " + shared, 0.9, 3)
+    second = result(shared + " Finished widgets are tested under load.", 0.8, 4)
+    unrelated = result(shared + " Other document.", 0.7, 4, document_id="doc-2")
+
+    context, selected = builder.build_context([first, second, unrelated])
+
+    assert context.count(shared) == 2
+    assert "\n\nFinished widgets are tested under load." in context
+    assert len(selected) == 3
+
+def test_duplicate_chunk_text_is_left_out(builder):
+    context, selected = builder.build_context([result("same text", 0.9, 1), result("same text", 0.8, 7)])
+
+    assert context == "same text"
+    assert len(selected) == 1
+
+def test_history_keeps_the_newest_turns_that_fit(builder):
+    history = [turn(n) for n in range(10)]
+
+    kept = builder.trim_history(history)
+
+    assert kept[-1] == history[-1]
+    assert [message["query"] for message in kept] == [message["query"] for message in history[-len(kept):]]
+    used = sum(tokens(message["query"]) + tokens(message["response"]) + 2 * builder.MESSAGE_OVERHEAD_TOKENS for message in kept)
+    assert used <= builder.history_tokens + 1
+
+def test_oldest_turn_that_fits_partly_is_truncated():
+    builder = ContextBuilder(history_tokens=150, tokenizer=ApproximateTokenizer())
+    history = [turn(0, size=800), turn(1)]
+
+    kept = builder.trim_history(history)
+
+    assert [message["query"] for message in kept] == ["question 0", "question 1"]
+    assert kept[0]["response"].endswith(" ...")
+    assert len(kept[0]["response"]) < len(history[0]["response"])
+    assert history[0]["response"].startswith(kept[0]["response"][:-4])
+
+def test_message_tokens_include_the_overhead(builder):
+    messages = [{"role": "system", "content": "x" * 40}, {"role": "user", "content": "y" * 8}]
+
+    assert builder.count_messages(messages) == 10 + 2 + 2 * builder.MESSAGE_OVERHEAD_TOKENS
+
+def test_unknown_tokenizer_is_rejected(monkeypatch):
+    monkeypatch.setenv("CONTEXT_TOKENIZER", "words")
+
+    with pytest.raises(ValueError):
+        ContextBuilder()
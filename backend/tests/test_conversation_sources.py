@@ -0,0 +1,82 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+def chunk(text: str, chunk_id: int, score: float = 0.5):
+    return SimpleNamespace(text=text, source="a.pdf", page=2, score=score, document_id="d1", chunk_id=chunk_id)
+
+def web(text: str):
+    return SimpleNamespace(text=text, source="https://example.com", score=0.9)
+
+def count(db, table: str) -> int:
+    return db.pool.run_sync(lambda cursor: cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+
+def store(db, *turns):
+    async def main():
+        for conversation_id, sources in turns:
+            await db.store_conversation(conversation_id, "q", "r", sources)
+        await db.flush()
+    asyncio.run(main())
+
+def history(db, conversation_id: str):
+    return asyncio.run(db.get_conversation_history(conversation_id))
+
+def test_chunk_texts_are_stored_once(db):
+    cited = [chunk("pump timer settings " * 50, 0), chunk("gasket sizes", 1)]
+    store(db, *[(f"c{i % 3}", cited) for i in range(12)])
+
+    assert count(db, "source_texts") == 2
+    assert count(db, "conversation_sources") == 24
+    assert db.pool.run_sync(lambda cursor: cursor.execute(
+        "SELECT COUNT(*) FROM conversations WHERE sources IS NOT NULL"
+    ).fetchone()[0]) == 0
+    assert db.pool.run_sync(lambda cursor: cursor.execute(
+        "SELECT COUNT(*) FROM conversation_sources WHERE text IS NOT NULL"
+    ).fetchone()[0]) == 0
+
+def test_sources_read_back_in_order(db):
+    store(db, ("c1", [chunk("second best", 4, 0.7), web("web result"), chunk("best", 3, 0.4)]))
+
+    sources = history(db, "c1")[0]["sources"]
+
+    assert [source["text"] for source in sources] == ["second best", "web result", "best"]
+    assert sources[0] == {
+        "text": "second best", "source": "a.pdf", "page": 2, "score": 0.7, "document_id": "d1", "chunk_id": 4
+    }
+    # Web results keep their text inline
+    assert sources[1]["document_id"] is None
+    assert db.pool.run_sync(lambda cursor: cursor.execute(
+        "SELECT text FROM conversation_sources WHERE text IS NOT NULL"
+    ).fetchall()) == [("web result",)]
+
+def test_cited_texts_outlive_the_document(db):
+    store(db, ("c1", [chunk("old wording", 0)]))
+
+    asyncio.run(db.delete_document("d1"))
+    store(db, ("c2", [chunk("new wording", 0)]))
+
+    assert history(db, "c1")[0]["sources"][0]["text"] == "old wording"
+    assert history(db, "c2")[0]["sources"][0]["text"] == "new wording"
+
+def test_update_replaces_the_sources_of_the_latest_turn(db):
+    store(db, ("c1", [chunk("first", 0)]), ("c1", [chunk("second", 1)]))
+
+    async def update():
+        await db.update_conversation_response("c1", "from the web", [web("web result")])
+        await db.flush()
+    asyncio.run(update())
+
+    turns = history(db, "c1")
+    assert [source["text"] for source in turns[0]["sources"]] == ["first"]
+    assert [source["text"] for source in turns[1]["sources"]] == ["web result"]
+    assert count(db, "conversation_sources") == 2
+
+def test_turns_stored_as_json_are_still_read(db):
+    db.init_database()
+    legacy = [{"text": "legacy text", "source": "old.pdf", "page": 1, "score": 0.3}]
+    db.pool.run_sync(lambda cursor: cursor.execute(
+        "INSERT INTO conversations (conversation_id, query, response, sources) VALUES (?, ?, ?, ?)",
+        ("old", "q", "r", json.dumps(legacy))
+    ))
+
+    assert history(db, "old")[0]["sources"] == legacy
@@ -0,0 +1,148 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services.database import DatabaseService
+
+def source(text: str, document_id="d1", chunk_id=0):
+    return SimpleNamespace(text=text, source="a.pdf", page=1, score=0.5, document_id=document_id, chunk_id=chunk_id)
+
+def stored_queries(db, conversation_id: str):
+    return [row[0] for row in db.pool.run_sync(lambda cursor: cursor.execute(
+        "SELECT query FROM conversations WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+    ).fetchall())]
+
+@pytest.fixture
+def failing_writes(db, monkeypatch):
+    """Makes the next `failures[0]` conversation flushes fail"""
+    failures = [0]
+    write = db._write_conversations
+
+    def flaky(cursor, batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return write(cursor, batch)
+    monkeypatch.setattr(db, "_write_conversations", flaky)
+    return failures
+
+def test_writes_are_committed_together(db):
+    db.flush_delay = 60
+
+    async def main():
+        for i in range(5):
+            await db.store_conversation("c1", f"q{i}", f"r{i}", [source(f"text {i}")])
+        # Read-your-writes through the queued writes
+        history = await db.get_conversation_history("c1")
+        assert [turn["query"] for turn in history] == [f"q{i}" for i in range(5)]
+        assert history[2]["sources"][0]["text"] == "text 2"
+        assert stored_queries(db, "c1") == []
+        await db.flush()
+
+    asyncio.run(main())
+
+    assert stored_queries(db, "c1") == [f"q{i}" for i in range(5)]
+    assert db.get_stats()["conversation_flushes"] == 1
+    assert db.get_stats()["conversation_writes"] == 5
+
+def test_flush_after_the_delay_or_enough_rows(db):
+    db.flush_delay = 0.02
+    db.flush_rows = 3
+
+    async def main():
+        for i in range(3):
+            await db.store_conversation("rows", f"q{i}", "r", [])
+        # The third write filled the batch
+        assert stored_queries(db, "rows") == ["q0", "q1", "q2"]
+
+        await db.store_conversation("timer", "q", "r", [])
+        assert db.get_stats()["pending_conversation_writes"] == 1
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+
+    assert stored_queries(db, "timer") == ["q"]
+
+def test_update_applies_to_the_latest_turn(db):
+    db.flush_delay = 60
+
+    async def main():
+        await db.store_conversation("c1", "q0", "r0", [])
+        await db.flush()
+        await db.store_conversation("c1", "q1", "r1", [source("old")])
+        await db.update_conversation_response("c1", "web answer", [source("web", None, None)])
+        queued = await db.get_conversation_history("c1")
+        await db.flush()
+        return queued, await db.get_conversation_history("c1")
+
+    queued, stored = asyncio.run(main())
+
+    for history in (queued, stored):
+        assert [(turn["query"], turn["response"]) for turn in history] == [("q0", "r0"), ("q1", "web answer")]
+        assert [s["text"] for s in history[1]["sources"]] == ["web"]
+
+def test_failed_flush_keeps_the_writes_and_retries(db, failing_writes):
+    db.flush_delay = 0.01
+    failing_writes[0] = 1
+
+    async def main():
+        await db.store_conversation("c1", "q0", "r0", [])
+        await db.store_conversation("c1", "q1", "r1", [])
+        await asyncio.sleep(0.05)
+        # The timed flush failed: the writes are still queued and readable
+        assert db.get_stats()["conversation_flush_errors"] == 1
+        assert db.get_stats()["pending_conversation_writes"] == 2
+        assert db._flush_handle is not None
+        assert [turn["query"] for turn in await db.get_conversation_history("c1")] == ["q0", "q1"]
+        await asyncio.sleep(0.3)
+
+    asyncio.run(main())
+
+    assert stored_queries(db, "c1") == ["q0", "q1"]
+    assert db.get_stats()["pending_conversation_writes"] == 0
+
+def test_drain_retries_a_transient_failure(db, failing_writes):
+    db.flush_delay = 60
+    db.FLUSH_RETRY_MIN = 0.01
+    failing_writes[0] = 2
+
+    async def main():
+        await db.store_conversation("c1", "q0", "r0", [])
+        await db.drain()
+
+    asyncio.run(main())
+
+    assert stored_queries(db, "c1") == ["q0"]
+    assert db.get_stats()["conversation_flush_errors"] == 2
+
+def test_drain_gives_up_after_its_attempts(db, failing_writes):
+    db.flush_delay = 60
+    db.FLUSH_RETRY_MIN = 0.01
+    failing_writes[0] = 100
+
+    async def main():
+        await db.store_conversation("c1", "q0", "r0", [])
+        with pytest.raises(sqlite3.OperationalError):
+            await db.drain()
+
+    asyncio.run(main())
+
+    assert db.get_stats()["conversation_flush_errors"] == db.DRAIN_ATTEMPTS
+    assert db.get_stats()["pending_conversation_writes"] == 1
+    failing_writes[0] = 0
+
+def test_close_writes_the_queued_rows(db, tmp_path):
+    db.flush_delay = 60
+
+    async def main():
+        for i in range(3):
+            await db.store_conversation("c1", f"q{i}", "r", [])
+
+    asyncio.run(main())
+    db.close()
+
+    reopened = DatabaseService(db_path=str(tmp_path / "ragbot.db"))
+    assert stored_queries(reopened, "c1") == ["q0", "q1", "q2"]
+    reopened.close()
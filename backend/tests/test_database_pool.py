@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+from backend.services import database
+from backend.services.database_pool import ConnectionPool, SQLiteBackend, create_backend
+
+def test_service_opens_nothing_until_the_first_query(tmp_path):
+    service = database.DatabaseService(db_path=str(tmp_path / "lazy.db"))
+
+    assert not os.path.exists(tmp_path / "lazy.db")
+    assert service.get_stats()["open"] == 0
+    assert service.pool._executor is None
+
+    asyncio.run(service.store_document("d1", "a.pdf", 3))
+
+    assert os.path.exists(tmp_path / "lazy.db")
+    assert asyncio.run(service.get_document("d1"))["chunks_count"] == 3
+    service.close()
+
+def test_get_db_creates_the_service_on_first_use(monkeypatch):
+    monkeypatch.setattr(database, "database_service", None)
+
+    service = database.get_db()
+
+    assert database.get_db() is service
+    assert not os.path.exists("ragbot.db")
+
+def test_connections_use_wal_and_the_pragmas(db):
+    db.init_database()
+
+    assert db.pool.run_sync(lambda cursor: cursor.execute("PRAGMA journal_mode").fetchone()[0]) == "wal"
+    assert db.pool.run_sync(lambda cursor: cursor.execute("PRAGMA busy_timeout").fetchone()[0]) == 5000
+
+def test_work_runs_off_the_event_loop_on_reused_connections(db):
+    def thread_name(cursor):
+        cursor.execute("SELECT 1")
+        return threading.current_thread().name
+
+    async def main():
+        names = await asyncio.gather(*[db.pool.run(thread_name) for _ in range(20)])
+        return threading.current_thread().name, names
+
+    loop_thread, names = asyncio.run(main())
+
+    assert loop_thread not in names
+    assert all(name.startswith("database") for name in names)
+    assert 0 < db.get_stats()["open"] <= db.pool.size
+
+def test_failed_work_is_rolled_back(tmp_path):
+    pool = ConnectionPool(SQLiteBackend(str(tmp_path / "pool.db")), size=2, setup=lambda cursor: cursor.execute(
+        "CREATE TABLE items (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT)"
+    ))
+
+    def insert_and_fail(cursor):
+        cursor.execute("INSERT INTO items (name) VALUES ('lost')")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        pool.run_sync(insert_and_fail)
+    first = pool.run_sync(lambda cursor: pool.backend.insert_id(cursor, "INSERT INTO items (name) VALUES (?)", ("kept",)))
+    second = pool.run_sync(lambda cursor: pool.backend.insert_id(cursor, "INSERT INTO items (name) VALUES (?)", ("kept",)))
+
+    assert second == first + 1
+    assert pool.run_sync(lambda cursor: cursor.execute("SELECT name FROM items").fetchall()) == [("kept",), ("kept",)]
+    # One thread at a time borrows one connection
+    assert pool.get_stats()["open"] == 1
+    pool.close()
+    assert pool.get_stats()["open"] == 0
+
+def test_in_memory_database_has_one_connection():
+    pool = ConnectionPool(SQLiteBackend(":memory:"), size=4)
+
+    assert pool.size == 1
+
+def test_unsupported_database_url():
+    assert isinstance(create_backend("sqlite:///./ragbot.db"), SQLiteBackend)
+    with pytest.raises(ValueError):
+        create_backend("mysql://localhost/ragbot")
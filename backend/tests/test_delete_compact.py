@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from .helpers import make_chunks
+
+@pytest.fixture
+def store(make_store, monkeypatch):
+    # Compaction only when a test asks for it
+    monkeypatch.setenv("VECTOR_COMPACT_DELETED_RATIO", "1")
+    monkeypatch.setenv("VECTOR_STORE_MAX_SEGMENTS", "1000")
+    store = make_store()
+    for k in range(6):
+        store.add_documents(make_chunks(f"doc{k}", 10), f"d{k}", f"f{k % 2}.pdf")
+    return store
+
+def compact_fully(store):
+    while store.compact():
+        pass
+
+def document_ids(results):
+    return {result["document_id"] for result in results}
+
+def test_deleted_document_is_never_returned(store):
+    assert store.delete_document("d2") == 10
+    assert store.delete_document("d2") == 0
+
+    for mode in ("dense", "keyword", "hybrid"):
+        results = store.search("doc2 chunk 3 about widgets", top_k=60, mode=mode)
+        assert "d2" not in document_ids(results)
+        assert len(results) == 50
+    assert not store.has_document("d2")
+    assert store.get_stats()["deleted_chunks"] == 10
+
+def test_compaction_purges_deleted_rows(store):
+    store.delete_document("d1")
+    store.delete_document("d4")
+    files_before = len(store.segment_store.segment_names())
+
+    compact_fully(store)
+
+    assert store.ntotal == 40
+    assert store.get_stats()["deleted_chunks"] == 0
+    assert len(store.segment_store.segment_names()) < files_before
+    results = store.search("about widgets", top_k=100)
+    assert len(results) == 40
+    assert document_ids(results) == {"d0", "d2", "d3", "d5"}
+    # Row ids were renumbered and still resolve to the right chunks
+    for result in results:
+        assert result["text"].startswith(result["document_id"].replace("d", "doc") + " ")
+
+def test_compacted_store_reloads_the_same_rows(store, make_store):
+    store.delete_document("d0")
+    compact_fully(store)
+    expected = store.search("doc3 chunk 2 about widgets", top_k=5)
+
+    reopened = make_store()
+
+    assert reopened.ntotal == 50
+    assert reopened.search("doc3 chunk 2 about widgets", top_k=5) == expected
+    assert not reopened.has_document("d0")
+
+def test_tombstones_survive_a_reload(store, make_store):
+    store.delete_document("d5")
+
+    reopened = make_store()
+
+    assert not reopened.has_document("d5")
+    assert "d5" not in document_ids(reopened.search("doc5 chunk 1", top_k=60, mode="hybrid"))
+    compact_fully(reopened)
+    assert reopened.ntotal == 50
+
+def test_filename_filter_forgets_deleted_documents(store):
+    store.delete_document("d0")
+    store.delete_document("d2")
+
+    results = store.search("about widgets", top_k=100, filters={"filenames": ["f0.pdf"]})
+
+    assert document_ids(results) == {"d4"}
+
+def test_replaced_document_shows_one_version_at_a_time(store):
+    writer = store.create_document_writer("d3", "f1.pdf", replace=True)
+    writer.add(make_chunks("new3", 4))
+    # Not committed yet: the old version is still searched
+    assert len(store.search("about widgets", top_k=100, filters={"document_ids": ["d3"]})) == 10
+
+    writer.commit()
+
+    results = store.search("about widgets", top_k=100, filters={"document_ids": ["d3"]})
+    assert sorted(result["text"] for result in results) == sorted(chunk["text"] for chunk in make_chunks("new3", 4))
+    assert store.get_stats()["deleted_chunks"] == 10
+
+def test_searches_during_deletes_and_compactions_stay_consistent(store):
+    stop = threading.Event()
+    bad = []
+
+    def search():
+        while not stop.is_set():
+            for mode in ("dense", "keyword", "hybrid"):
+                for result in store.search("doc4 chunk 3 widgets", top_k=5, mode=mode):
+                    if not result["text"].startswith(result["document_id"].replace("d", "doc") + " "):
+                        bad.append(result)
+
+    threads = [threading.Thread(target=search) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        for k in range(0, 6, 2):
+            store.delete_document(f"d{k}")
+            store.compact()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join(30)
+
+    assert bad == []
+    assert document_ids(store.search("about widgets", top_k=100)) == {"d1", "d3", "d5"}
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from backend.services import embedding_cache
+from backend.services.embedding_cache import QueryEmbeddingCache
+
+def vector(value: float) -> np.ndarray:
+    return np.full(4, value, dtype='float32')
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time() for the cache module"""
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    return now
+
+def test_queries_differing_in_case_and_spacing_share_an_entry():
+    cache = QueryEmbeddingCache("model")
+    cache.put_many(["How do  widgets work?"], np.stack([vector(1)]))
+
+    found, missing = cache.get_many(["how do widgets WORK?", "something else"])
+
+    np.testing.assert_array_equal(found, vector(1))
+    assert missing is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_least_recently_used_entries_are_evicted():
+    cache = QueryEmbeddingCache("model", max_entries=2)
+    cache.put_many(["a", "b"], np.stack([vector(1), vector(2)]))
+    cache.get_many(["a"])
+    cache.put_many(["c"], np.stack([vector(3)]))
+
+    a, b, c = cache.get_many(["a", "b", "c"])
+
+    assert b is None
+    assert a is not None and c is not None
+    assert cache.get_stats()["entries"] == 2
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QueryEmbeddingCache("model", ttl_seconds=60)
+    cache.put_many(["a"], np.stack([vector(1)]))
+
+    clock[0] += 59
+    assert cache.get_many(["a"])[0] is not None
+    clock[0] += 2
+    assert cache.get_many(["a"]) == [None]
+
+def test_ttl_of_zero_never_expires(clock):
+    cache = QueryEmbeddingCache("model", ttl_seconds=0)
+    cache.put_many(["a"], np.stack([vector(1)]))
+
+    clock[0] += 10 ** 9
+
+    assert cache.get_many(["a"])[0] is not None
+
+def test_sqlite_tier_is_shared_between_caches(tmp_path, clock):
+    path = str(tmp_path / "queries.db")
+    QueryEmbeddingCache("model", db_path=path).put_many(["a", "b"], np.stack([vector(1), vector(2)]))
+
+    other = QueryEmbeddingCache("model", db_path=path)
+    a, b = other.get_many(["a", "B"])
+
+    np.testing.assert_array_equal(b, vector(2))
+    assert other.get_stats()["disk_hits"] == 2
+    # Now in the memory tier as well
+    other.get_many(["a"])
+    assert other.get_stats()["disk_hits"] == 2
+    # Entries are per model
+    assert QueryEmbeddingCache("other-model", db_path=path).get_many(["a"]) == [None]
+
+def test_expired_sqlite_entries_are_not_loaded(tmp_path, clock):
+    path = str(tmp_path / "queries.db")
+    QueryEmbeddingCache("model", ttl_seconds=60, db_path=path).put_many(["a"], np.stack([vector(1)]))
+
+    clock[0] += 61
+
+    assert QueryEmbeddingCache("model", ttl_seconds=60, db_path=path).get_many(["a"]) == [None]
+
+def test_store_encodes_each_query_once(make_store, encoder):
+    store = make_store()
+
+    store.encode_queries(["widgets", "gears"])
+    store.encode_queries(["Widgets ", "gears", "springs"])
+
+    assert encoder.encoded == 3
+    assert store.query_cache.get_stats()["hits"] == 2
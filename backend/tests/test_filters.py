@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+QUERY = "doc2 chunk 9 about widgets"
+
+FILTERS = [
+    {"document_ids": ["d2"]},
+    {"document_ids": ["d0", "d1"], "filenames": ["f0.pdf"]},
+    {"filenames": ["f3.pdf", "missing.pdf"]},
+    {"page_from": 2, "page_to": 4},
+    {"page_from": 5},
+    {"page_to": 3},
+    {"document_ids": ["d3"], "page_from": 3, "page_to": 6},
+    {"page_from": 50},
+]
+
+def chunks(document: str, count: int = 40):
+    # Every seventh chunk has no page, as for text outside any page
+    return [
+        {"text": f"{document} chunk {i} about widgets", "page": None if i % 7 == 0 else 1 + i // 3, "chunk_id": i}
+        for i in range(count)
+    ]
+
+def matches(chunk, filters) -> bool:
+    if filters.get("document_ids") and chunk.document_id not in filters["document_ids"]:
+        return False
+    if filters.get("filenames") and chunk.source not in filters["filenames"]:
+        return False
+    page = chunk.page if chunk.page is not None else -1
+    if filters.get("page_to") is not None and not (0 <= page <= filters["page_to"]):
+        return False
+    if filters.get("page_from") is not None and page < filters["page_from"]:
+        return False
+    return True
+
+@pytest.fixture(params=[("memory", "flat"), ("mmap", "flat"), ("memory", "hnsw"), ("memory", "ivf_flat")])
+def store(request, make_store, monkeypatch):
+    storage_mode, index_type = request.param
+    monkeypatch.setenv("VECTOR_ANN_THRESHOLD", "100")
+    monkeypatch.setenv("VECTOR_NPROBE", "4096")
+    monkeypatch.setenv("VECTOR_EF_SEARCH", "512")
+    # Deleted rows stay in place, to be filtered out
+    monkeypatch.setenv("VECTOR_COMPACT_DELETED_RATIO", "1")
+    store = make_store(storage_mode=storage_mode, index_type=index_type)
+    for k in range(4):
+        store.add_documents(chunks(f"doc{k}"), f"d{k}", f"f{k}.pdf")
+    if store._rebuild_thread is not None:
+        store._rebuild_thread.join(60)
+    store.delete_document("d1")
+    return store
+
+@pytest.mark.parametrize("exact_rows", ["100000", "0"])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_filtered_search_matches_brute_force(store, filters, exact_rows):
+    # 0 sends every filtered search through the ANN index with an ID selector
+    store.filter_exact_rows = int(exact_rows)
+    wanted = np.array(
+        [row for row, chunk in enumerate(store.documents) if chunk.document_id != "d1" and matches(chunk, filters)],
+        dtype='int64'
+    )
+
+    assert store.filter_rows(filters).tolist() == wanted.tolist()
+
+    results = store.search(QUERY, top_k=10, filters=filters)
+    if not len(wanted):
+        assert results == []
+        return
+    query = store.encode_queries([QUERY])[0]
+    best = np.sort(store._row_embeddings(wanted) @ query)[::-1][:10]
+    np.testing.assert_allclose([result["score"] for result in results], best, atol=1e-4)
+    assert set(result["index_id"] for result in results) <= set(wanted.tolist())
+
+@pytest.mark.parametrize("mode", ["keyword", "hybrid"])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_lexical_searches_apply_the_same_filters(store, filters, mode):
+    allowed = set(store.filter_rows(filters).tolist())
+
+    results = store.search(QUERY, top_k=10, mode=mode, filters=filters)
+
+    assert {result["index_id"] for result in results} <= allowed
+    assert len(results) == min(10, len(allowed))
+
+def test_no_filters_select_everything(store):
+    assert store.filter_rows(None) is None
+    assert store.filter_rows({"document_ids": [], "filenames": []}) is None
+    assert store.filter_rows({"document_ids": ["unknown"]}).tolist() == []
@@ -0,0 +1,85 @@
+import asyncio
+
+def turns(history):
+    return [(turn["query"], turn["response"]) for turn in history]
+
+def test_window_is_loaded_once_and_kept_current(db):
+    db.history_window = 3
+
+    async def main():
+        for i in range(5):
+            await db.store_conversation("c1", f"q{i}", f"r{i}", [])
+        first = await db.get_recent_history("c1")
+        await db.store_conversation("c1", "q5", "r5", [])
+        await db.update_conversation_response("c1", "web", [])
+        return first, await db.get_recent_history("c1")
+
+    first, second = asyncio.run(main())
+
+    assert turns(first) == [("q2", "r2"), ("q3", "r3"), ("q4", "r4")]
+    assert "sources" not in first[0]
+    assert turns(second) == [("q3", "r3"), ("q4", "r4"), ("q5", "web")]
+    stats = db.get_stats()["history_cache"]
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+def test_cached_window_matches_the_database(db):
+    db.history_window = 4
+
+    async def main():
+        await db.get_recent_history("c1")
+        for i in range(6):
+            await db.store_conversation("c1", f"q{i}", f"r{i}", [])
+            await db.update_conversation_response("c1", f"u{i}", [])
+        cached = await db.get_recent_history("c1")
+        await db.flush()
+        return cached, await db.get_conversation_history("c1", limit=4, include_sources=False)
+
+    cached, stored = asyncio.run(main())
+
+    assert turns(cached) == turns(stored) == [(f"q{i}", f"u{i}") for i in range(2, 6)]
+
+def test_least_recently_used_windows_are_evicted(db):
+    db.history_cache_size = 2
+
+    async def main():
+        for conversation_id in ("a", "b", "c"):
+            await db.store_conversation(conversation_id, "q", "r", [])
+        await db.get_recent_history("a")
+        await db.get_recent_history("b")
+        await db.get_recent_history("a")
+        await db.get_recent_history("c")
+        await db.get_recent_history("a")
+        await db.get_recent_history("b")
+
+    asyncio.run(main())
+
+    stats = db.get_stats()["history_cache"]
+    assert stats["entries"] == 2
+    # b was evicted by c, as a had been used since
+    assert (stats["hits"], stats["misses"]) == (2, 4)
+
+def test_deleted_conversation_is_forgotten(db):
+    async def main():
+        await db.store_conversation("c1", "q", "r", [])
+        assert len(await db.get_recent_history("c1")) == 1
+        await db.delete_conversation("c1")
+        return await db.get_recent_history("c1")
+
+    assert asyncio.run(main()) == []
+
+def test_limit_reads_the_latest_turns_in_order(db):
+    async def main():
+        for i in range(5):
+            await db.store_conversation("c1", f"q{i}", f"r{i}", [])
+        await db.flush()
+        return (
+            await db.get_conversation_history("c1", limit=2),
+            await db.get_conversation_history("c1", limit=0),
+            await db.get_conversation_history("c1")
+        )
+
+    latest, none, everything = asyncio.run(main())
+
+    assert turns(latest) == [("q3", "r3"), ("q4", "r4")]
+    assert none == []
+    assert len(everything) == 5
@@ -0,0 +1,212 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import socket
+import subprocess
+import sys
+
+import pytest
+
+from backend.services.ingestion import IngestionBusyError, IngestionExecutor
+from backend.services.pdf_processor import PDFProcessor
+from .helpers import make_chunks, make_pdf
+
+PAGES = [f"Page {n} explains how widget number {n} is assembled and tested." for n in range(1, 7)]
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+@pytest.fixture
+def executor(tmp_path, store, db):
+    executor = IngestionExecutor(
+        PDFProcessor(chunk_size=120, chunk_overlap=20),
+        store,
+        db,
+        mode="thread",
+        workers=1,
+        max_pending=2,
+        embed_batch_size=4,
+        page_batch_size=2,
+        spool_dir=str(tmp_path)
+    )
+    yield executor
+    executor.shutdown()
+
+async def wait_for_job(db, job_id: str, timeout: float = 30):
+    """The job once it completed or failed"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = await db.get_job(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        assert asyncio.get_running_loop().time() < deadline, job
+        await asyncio.sleep(0.02)
+
+async def ingest(executor, db, content: bytes, document_id: str, filename: str = "manual.pdf", replace: bool = False):
+    job = await executor.submit(io.BytesIO(content), document_id, filename, replace=replace)
+    return await wait_for_job(db, job["id"])
+
+def test_upload_is_indexed_in_the_background(executor, store, db):
+    job = asyncio.run(ingest(executor, db, make_pdf(PAGES), "doc-1"))
+
+    assert job["status"] == "completed"
+    assert job["pages_total"] == 6
+    assert store.has_document("doc-1")
+    results = store.search("widget number 4 assembled", top_k=100)
+    assert any("widget number 4 is assembled" in result["text"] for result in results)
+    assert {result["page"] for result in results} <= set(range(1, 7))
+    assert asyncio.run(db.get_document("doc-1"))["chunks_count"] == job["chunks_total"] > 0
+    assert executor.get_stats()["pending"] == 0
+
+def test_uploads_beyond_max_pending_are_rejected(executor, db):
+    async def run():
+        first = await executor.submit(io.BytesIO(make_pdf(PAGES)), "doc-1", "a.pdf")
+        second = await executor.submit(io.BytesIO(make_pdf(PAGES[:2])), "doc-2", "b.pdf")
+        assert executor.is_busy()
+        with pytest.raises(IngestionBusyError):
+            await executor.submit(io.BytesIO(make_pdf(PAGES[:3])), "doc-3", "c.pdf")
+        return [await wait_for_job(db, job["id"]) for job in (first, second)]
+
+    assert [job["status"] for job in asyncio.run(run())] == ["completed", "completed"]
+    assert not executor.is_busy()
+
+def test_event_loop_keeps_running_during_ingestion(executor, db):
+    async def run():
+        job = await executor.submit(io.BytesIO(make_pdf(PAGES * 4)), "doc-1", "long.pdf")
+        ticks = 0
+        while (await db.get_job(job["id"]))["status"] not in ("completed", "failed"):
+            ticks += 1
+            await asyncio.sleep(0.001)
+        return ticks
+
+    assert asyncio.run(run()) > 0
+
+def test_searches_are_consistent_while_documents_are_added(store):
+    store.add_documents(make_chunks("base", 6), "base", "base.pdf")
+
+    def upload(n):
+        store.add_documents(make_chunks(f"d{n}", 6), f"d{n}", "f.pdf")
+
+    def search(_):
+        results = store.search("chunk about widgets", top_k=50)
+        # Every result resolves to a whole chunk of a committed document
+        assert all(result["text"].startswith(result["document_id"]) for result in results)
+        return len(results)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        uploads = [pool.submit(upload, n) for n in range(10)]
+        counts = list(pool.map(search, range(50)))
+        for future in uploads:
+            future.result()
+
+    assert min(counts) >= 6
+    assert len(store.search("chunk about widgets", top_k=100)) == 66
+
+def test_job_records_progress_through_every_stage(executor, db):
+    job = asyncio.run(ingest(executor, db, make_pdf(PAGES), "doc-1"))
+
+    assert job["stage"] == "record"
+    assert job["pages_done"] == job["pages_total"] == 6
+    assert job["chunks_embedded"] == job["chunks_total"]
+    assert set(job["stage_timings"]) == set(IngestionExecutor.STAGES)
+    assert job["finished_at"] is not None
+    assert asyncio.run(db.list_jobs())[0]["id"] == job["id"]
+
+def test_upload_without_text_fails_its_job(executor, store, db):
+    job = asyncio.run(ingest(executor, db, make_pdf([""]), "empty"))
+
+    assert job["status"] == "failed"
+    assert "Could not extract text" in job["error"]
+    assert not store.has_document("empty")
+    assert asyncio.run(db.get_document("empty")) is None
+
+def set_job_owner(db, job_id: str, owner: str):
+    def update(cursor):
+        cursor.execute("UPDATE ingestion_jobs SET owner = ? WHERE id = ?", (owner, job_id))
+    db.pool.run_sync(update)
+
+def test_only_jobs_of_exited_processes_are_reaped(db):
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    dead_owner = f"{socket.gethostname()}:{int(exited.stdout)}:0badc0de"
+
+    async def run():
+        for job_id in ("ours", "dead", "legacy", "other-host", "done"):
+            await db.create_job(job_id, "doc", "f.pdf")
+        await db.update_job("ours", status="running", stage="embed")
+        set_job_owner(db, "dead", dead_owner)
+        set_job_owner(db, "legacy", None)
+        set_job_owner(db, "other-host", "elsewhere:1:12345678")
+        await db.update_job("done", status="completed")
+        set_job_owner(db, "done", dead_owner)
+
+        reaped = await db.reap_interrupted_jobs()
+        return reaped, {job_id: (await db.get_job(job_id))["status"] for job_id in ("ours", "dead", "legacy", "other-host", "done")}
+
+    reaped, statuses = asyncio.run(run())
+
+    assert reaped == 2
+    assert statuses == {"ours": "running", "dead": "failed", "legacy": "failed", "other-host": "queued", "done": "completed"}
+
+def test_duplicate_upload_points_at_the_existing_document(executor, store, db, encoder):
+    content = make_pdf(PAGES)
+    first = asyncio.run(ingest(executor, db, content, "doc-1", "a.pdf"))
+    encoded = encoder.encoded
+
+    second = asyncio.run(ingest(executor, db, content, "doc-2", "copy.pdf"))
+
+    assert second["status"] == "completed"
+    assert second["document_id"] == "doc-1"
+    assert second["chunks_total"] == first["chunks_total"]
+    assert encoder.encoded == encoded
+    assert not store.has_document("doc-2")
+    assert asyncio.run(db.get_document("doc-2")) is None
+
+def test_concurrent_duplicate_uploads_share_one_job(executor, db):
+    async def run():
+        content = make_pdf(PAGES)
+        first = await executor.submit(io.BytesIO(content), "doc-1", "a.pdf")
+        second = await executor.submit(io.BytesIO(content), "doc-2", "a.pdf")
+        await wait_for_job(db, first["id"])
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert second["id"] == first["id"]
+
+def test_chunks_seen_before_reuse_their_embeddings(executor, store, db, encoder):
+    asyncio.run(ingest(executor, db, make_pdf(PAGES), "doc-1"))
+    encoded = encoder.encoded
+
+    # Same text, different file: nothing needs to be encoded again
+    job = asyncio.run(ingest(executor, db, make_pdf(PAGES) + b"\n% revision 2\n", "doc-2"))
+
+    assert job["status"] == "completed"
+    assert encoder.encoded == encoded
+    assert executor.get_stats()["chunks_reused"] == job["chunks_total"]
+    assert len(store.search("widget", top_k=100, filters={"document_ids": ["doc-2"]})) == job["chunks_total"]
+
+def test_replacing_a_document_swaps_its_chunks(executor, store, db):
+    asyncio.run(ingest(executor, db, make_pdf(PAGES), "doc-1"))
+    revised = [page.replace("tested", "certified") for page in PAGES[:3]]
+
+    job = asyncio.run(ingest(executor, db, make_pdf(revised), "doc-1", "manual-v2.pdf", replace=True))
+
+    assert job["status"] == "completed"
+    texts = [result["text"] for result in store.search("widget", top_k=100)]
+    assert texts and all("tested" not in text for text in texts)
+    assert any("certified" in text for text in texts)
+    assert {result["source"] for result in store.search("widget", top_k=100)} == {"manual-v2.pdf"}
+    assert asyncio.run(db.get_document("doc-1"))["chunks_count"] == job["chunks_total"]
+
+def test_replacing_with_the_same_contents_is_skipped(executor, store, db, encoder):
+    content = make_pdf(PAGES)
+    first = asyncio.run(ingest(executor, db, content, "doc-1"))
+    encoded = encoder.encoded
+
+    job = asyncio.run(ingest(executor, db, content, "doc-1", replace=True))
+
+    assert job["status"] == "completed"
+    assert job["id"] != first["id"]
+    assert encoder.encoded == encoded
+    assert store.get_stats()["deleted_chunks"] == 0
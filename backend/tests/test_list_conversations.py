@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from backend.services.database import DatabaseService
+
+def store(db, *turns):
+    async def main():
+        for conversation_id, query in turns:
+            await db.store_conversation(conversation_id, query, "r", [])
+    asyncio.run(main())
+
+def page(db, **kwargs):
+    return asyncio.run(db.list_conversations(**kwargs))
+
+def ids(result):
+    return [conversation["conversation_id"] for conversation in result["conversations"]]
+
+def test_most_recently_active_first_with_counts(db):
+    store(db, ("a", "first question " * 20), ("b", "other"), ("a", "follow-up"))
+
+    result = page(db)
+
+    assert ids(result) == ["a", "b"]
+    first = result["conversations"][0]
+    assert first["message_count"] == 2
+    assert first["first_query"] == ("first question " * 20)[:100] + "..."
+    assert result["next_cursor"] is None
+
+def test_pages_stay_stable_while_conversations_change(db):
+    store(db, *[(f"c{i:02}", f"question {i}") for i in range(25)])
+
+    seen = []
+    result = page(db, limit=4)
+    seen += ids(result)
+    k = 0
+    while result["next_cursor"]:
+        # New conversations and activity on listed ones land before the cursor
+        store(db, (f"new{k}", "new question"), (seen[0], "more"))
+        k += 1
+        result = page(db, limit=4, after=result["next_cursor"])
+        seen += ids(result)
+
+    assert len(seen) == len(set(seen))
+    assert seen == [f"c{i:02}" for i in range(24, -1, -1)]
+
+def test_update_moves_a_conversation_to_the_front(db):
+    store(db, ("a", "q"), ("b", "q"))
+
+    async def update():
+        await db.update_conversation_response("a", "web answer", [])
+    asyncio.run(update())
+
+    assert ids(page(db)) == ["a", "b"]
+    assert page(db)["conversations"][0]["message_count"] == 1
+
+def test_search_matches_all_words_of_the_first_query(db):
+    store(db, ("a", "How do I reset the pump timer?"), ("b", "Pump gasket sizes"), ("c", "timer drift"), ("b", "timer"))
+
+    assert ids(page(db, search="pump timer")) == ["a"]
+    assert ids(page(db, search="PUMP")) == ["b", "a"]
+    # Search syntax is matched literally
+    assert ids(page(db, search='timer" OR "gasket')) == []
+    assert ids(page(db, search="   ")) == ["b", "c", "a"]
+
+    asyncio.run(db.delete_conversation("a"))
+    assert ids(page(db, search="pump")) == ["b"]
+
+def test_searched_pages_continue_from_the_cursor(db):
+    store(db, *[(f"c{i}", f"pump question {i}") for i in range(5)], ("other", "gaskets"))
+
+    first = page(db, limit=2, search="pump")
+    rest = page(db, limit=10, search="pump", after=first["next_cursor"])
+
+    assert ids(first) + ids(rest) == ["c4", "c3", "c2", "c1", "c0"]
+
+def test_invalid_arguments(db):
+    with pytest.raises(ValueError):
+        page(db, limit=0)
+    with pytest.raises(ValueError):
+        page(db, after="not a cursor")
+
+def test_existing_conversations_are_summarized(db, tmp_path):
+    db.init_database()
+    db.pool.run_sync(lambda cursor: cursor.executemany(
+        "INSERT INTO conversations (conversation_id, query, response, timestamp) VALUES (?, ?, ?, ?)",
+        [("old", "early question", "r", "2024-01-01 10:00:00"), ("old", "later", "r", "2024-01-02 10:00:00")]
+    ))
+
+    reopened = DatabaseService(db_path=str(tmp_path / "ragbot.db"))
+    result = page(reopened)
+    reopened.close()
+
+    assert result["conversations"] == [{
+        "conversation_id": "old", "message_count": 2, "created_at": "2024-01-01 10:00:00",
+        "updated_at": "2024-01-02 10:00:00", "first_query": "early question"
+    }]
@@ -0,0 +1,75 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services.llm_service import LLMService, WebSearchRequestDetector
+
+RESPONSE = "I could not find this in the documents. WEB_SEARCH_NEEDED: [latest widget standards]"
+
+def pieces(text: str, size: int):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class FakeCompletions:
+    """Streams a canned response in small deltas, like the OpenAI client"""
+
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+
+        async def stream():
+            for delta in self.deltas:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+            # Role-only and empty deltas carry no text
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None))])
+            yield SimpleNamespace(choices=[])
+        return stream()
+
+def streaming_service(deltas) -> LLMService:
+    service = LLMService()
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(deltas)))
+    service.model = "test-model"
+    return service
+
+@pytest.mark.parametrize("size", [1, 3, 7, 18, 200])
+def test_marker_is_found_however_the_response_is_split(size):
+    detector = WebSearchRequestDetector()
+    seen = [detector.feed(piece) for piece in pieces(RESPONSE, size)]
+
+    marker_end = RESPONSE.index(WebSearchRequestDetector.MARKER) + len(WebSearchRequestDetector.MARKER)
+    # Reported from the piece completing the marker on
+    assert seen.index(True) == (marker_end - 1) // size
+    assert all(seen[seen.index(True):])
+    assert detector.result() == (True, "latest widget standards")
+    assert detector.result() == LLMService()._parse_web_search_request(RESPONSE)
+
+def test_response_without_marker_needs_no_search():
+    detector = WebSearchRequestDetector()
+    for piece in pieces("Widgets have three parts. WEB_SEARCH", 4):
+        assert not detector.feed(piece)
+
+    assert detector.result() == (False, None)
+
+def test_response_is_streamed_as_it_is_generated():
+    deltas = pieces("Widgets have three parts.", 5)
+    service = streaming_service(deltas)
+
+    async def collect():
+        return [piece async for piece in service.stream_response("what is a widget?", "Widgets have three parts.")]
+
+    assert asyncio.run(collect()) == deltas
+    request = service.client.chat.completions.requests[0]
+    assert request["stream"] is True
+    assert "Widgets have three parts." in request["messages"][-1]["content"]
+
+def test_unavailable_service_streams_a_notice():
+    service = LLMService()
+    service.client = None
+
+    async def collect():
+        return [piece async for piece in service.stream_response("what is a widget?")]
+
+    assert asyncio.run(collect()) == ["LLM service is not available. Please configure OPENAI_API_KEY."]
@@ -0,0 +1,138 @@
+import asyncio
+import io
+
+import pytest
+
+from backend.services.ingestion import IngestionExecutor
+from backend.services.pdf_processor import PDFProcessor
+from .helpers import make_pdf
+
+SENTENCES = [
+    "Widgets are assembled from three parts.",
+    "Each part is inspected before assembly!",
+    "Does the housing fit the frame?",
+    "Gaskets seal the housing; screws hold it shut.",
+    "Finished widgets are tested under load.",
+]
+
+def page_texts(count: int):
+    return [" ".join(SENTENCES[(n + i) % len(SENTENCES)] for i in range(n % 4 + 2)) for n in range(count)]
+
+def chunk_stream(processor, pages):
+    chunker = processor.create_chunker("manual.pdf", "doc-1")
+    chunks = []
+    for page_num, text in enumerate(pages, 1):
+        chunks.extend(chunker.add_page(page_num, text))
+    return chunks + chunker.finish()
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(80, 10), (150, 40), (1000, 200)])
+def test_streamed_pages_chunk_like_the_whole_text(chunk_size, chunk_overlap):
+    processor = PDFProcessor(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    pages = page_texts(12)
+
+    streamed = chunk_stream(processor, pages)
+    whole = chunk_stream(processor, [" ".join(pages)])
+
+    assert [chunk["text"] for chunk in streamed] == [chunk["text"] for chunk in whole]
+    assert [chunk["chunk_id"] for chunk in streamed] == list(range(len(streamed)))
+    assert all(chunk["document_id"] == "doc-1" and chunk["source"] == "manual.pdf" for chunk in streamed)
+
+def test_chunks_are_tagged_with_the_page_they_start_on():
+    processor = PDFProcessor(chunk_size=60, chunk_overlap=0)
+    pages = page_texts(6)
+    text = " ".join(pages)
+    page_starts = [len(" ".join(pages[:n])) + (1 if n else 0) for n in range(len(pages))]
+
+    def page_at(position):
+        return max(n for n, start in enumerate(page_starts, 1) if start <= position)
+
+    position = 0
+    for chunk in chunk_stream(processor, pages):
+        position = text.index(chunk["text"], position)
+        # A chunk cut at the space between two pages starts on the earlier one
+        assert chunk["page"] in (page_at(position), page_at(max(position - 1, 0)))
+
+def test_chunker_buffers_about_one_chunk():
+    processor = PDFProcessor(chunk_size=100, chunk_overlap=20)
+    chunker = processor.create_chunker("manual.pdf")
+
+    for page_num, text in enumerate(page_texts(50), 1):
+        chunker.add_page(page_num, text)
+        assert len(chunker.buffer) < 100 + chunker.LOOKAHEAD + len(text) + 1
+        assert len(chunker.page_starts) <= 4
+
+def test_empty_pages_add_no_chunks():
+    processor = PDFProcessor(chunk_size=100, chunk_overlap=20)
+    chunker = processor.create_chunker("manual.pdf")
+
+    assert chunker.add_page(1, "  \n ") == []
+    assert chunker.finish() == []
+
+def test_document_is_embedded_in_fixed_size_batches(make_store, encoder):
+    store = make_store()
+    chunks = chunk_stream(PDFProcessor(chunk_size=60, chunk_overlap=0), page_texts(10))
+
+    added = store.add_document_stream(iter(chunks), "doc-1", "manual.pdf", batch_size=4)
+
+    assert added == len(chunks)
+    assert max(encoder.batch_sizes) <= 4
+    assert store.search(chunks[5]["text"], top_k=1)[0]["chunk_id"] == 5
+
+def test_page_ranges_extract_the_same_pages_as_the_whole_document(tmp_path):
+    processor = PDFProcessor()
+    content = make_pdf(page_texts(7))
+    path = tmp_path / "manual.pdf"
+    path.write_bytes(content)
+
+    pages = list(processor.iter_pages(content))
+
+    assert processor.count_pages(str(path)) == 7
+    assert [page_num for page_num, _ in pages] == list(range(1, 8))
+    ranges = [processor.extract_pages(str(path), start, start + 3) for start in range(0, 7, 3)]
+    assert [page for pages_in_range in ranges for page in pages_in_range] == pages
+    assert processor.extract_pages(content, 5, 100) == pages[5:]
+
+def test_whole_document_wrappers_chunk_the_page_stream(tmp_path):
+    processor = PDFProcessor(chunk_size=80, chunk_overlap=10)
+    pages = page_texts(5)
+    content = make_pdf(pages)
+    path = tmp_path / "manual.pdf"
+    path.write_bytes(content)
+    extracted = [text for _, text in processor.iter_pages(content)]
+
+    chunks = processor.process_pdf_content(content, "doc-1", "manual.pdf")
+
+    assert [chunk["text"] for chunk in chunks] == [chunk["text"] for chunk in chunk_stream(processor, extracted)]
+    assert all(chunk["document_id"] == "doc-1" for chunk in chunks)
+    from_path = processor.process_pdf(str(path))
+    assert [chunk["text"] for chunk in from_path] == [chunk["text"] for chunk in chunks]
+    assert all(chunk["source"] == str(path) and "document_id" not in chunk for chunk in from_path)
+
+def test_unreadable_pdf_raises():
+    with pytest.raises(Exception, match="Error processing PDF content"):
+        PDFProcessor().process_pdf_content(b"not a pdf", "doc-1", "broken.pdf")
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_parallel_extraction_keeps_page_order(tmp_path, make_store, db, mode):
+    processor = PDFProcessor(chunk_size=80, chunk_overlap=10)
+    content = make_pdf(page_texts(9))
+    store = make_store()
+    executor = IngestionExecutor(
+        processor, store, db, mode=mode, extract_workers=3, page_batch_size=1, spool_dir=str(tmp_path)
+    )
+
+    async def run():
+        job = await executor.submit(io.BytesIO(content), "doc-1", "manual.pdf")
+        while (await db.get_job(job["id"]))["status"] not in ("completed", "failed"):
+            await asyncio.sleep(0.02)
+        return await db.get_job(job["id"])
+
+    try:
+        job = asyncio.run(run())
+    finally:
+        executor.shutdown()
+
+    assert job["status"] == "completed"
+    expected = processor.process_pdf_content(content, "doc-1", "manual.pdf")
+    stored = sorted(store.search("widgets", top_k=100), key=lambda chunk: chunk["chunk_id"])
+    assert [(chunk["text"], chunk["page"]) for chunk in stored] == [(chunk["text"], chunk["page"]) for chunk in expected]
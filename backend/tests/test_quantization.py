@@ -0,0 +1,122 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from backend.services import ann_index
+from .helpers import RandomEncoder, make_chunks
+
+def varied_chunks(document: str, count: int):
+    return [{"text": f"{document} w{i} w{i % 7}x w{i % 13}y", "page": 1, "chunk_id": i} for i in range(count)]
+
+@pytest.fixture
+def make_random_store(make_store):
+    """Stores whose embeddings never tie, so recall is exactly measurable"""
+    encoder = RandomEncoder()
+
+    def make(**kwargs):
+        return make_store(model=encoder, **kwargs)
+    return make
+
+def exact_scores(store, query: str, top_k: int):
+    embeddings = store._row_embeddings(np.arange(store.ntotal))
+    return np.sort(embeddings @ store.encode_queries([query])[0])[::-1][:top_k]
+
+def test_pq_sub_vectors_keep_enough_dimensions():
+    assert ann_index.choose_pq_subquantizers(384) == 48
+    assert ann_index.choose_pq_subquantizers(768) == 64
+    assert ann_index.choose_pq_subquantizers(32) == 4
+    assert ann_index.choose_pq_subquantizers(16) == 2
+
+def test_training_sample_is_capped():
+    assert ann_index.training_rows(ann_index.create_index("ivf_pq", 384, 10 ** 8)) == ann_index.MAX_TRAIN_ROWS
+    hnsw_pq = ann_index.create_index("hnsw", 384, 10 ** 4, "pq")
+    assert ann_index.training_rows(hnsw_pq) == ann_index.PQ_CENTROIDS * ann_index.TRAIN_ROWS_PER_CENTROID
+
+@pytest.mark.parametrize("quantization", ["fp16", "int8", "pq"])
+def test_quantized_search_is_rescored_exactly(make_random_store, monkeypatch, quantization):
+    monkeypatch.setenv("VECTOR_ANN_THRESHOLD", "300")
+    store = make_random_store(quantization=quantization)
+    store.add_documents(varied_chunks("a", 300), "a", "a.pdf")
+    if store._rebuild_thread is not None:
+        store._rebuild_thread.join(60)
+
+    results = store.search("a w5 w5x w5y", top_k=5)
+
+    assert results[0]["text"] == "a w5 w5x w5y"
+    np.testing.assert_allclose(results[0]["score"], exact_scores(store, "a w5 w5x w5y", 1)[0], atol=1e-5)
+    float32 = store.ntotal * store.dimension * 4
+    assert 0 < store.get_stats()["index_memory_bytes"] < float32
+
+def test_pq_uses_float16_until_the_corpus_can_train_it(make_random_store, monkeypatch):
+    monkeypatch.setenv("VECTOR_ANN_THRESHOLD", "300")
+    store = make_random_store(quantization="pq")
+    store.add_documents(varied_chunks("a", 100), "a", "a.pdf")
+
+    assert store._rebuild_thread is None
+    assert store.get_stats()["ann_rows"] == 0
+    assert store.search("a w5 w5x w5y", top_k=1)[0]["text"] == "a w5 w5x w5y"
+
+def test_quantization_report_covers_every_encoding(make_random_store):
+    store = make_random_store()
+    store.add_documents(varied_chunks("a", 200), "a", "a.pdf")
+
+    report = store.evaluate_quantization(top_k=5, sample_size=20)
+
+    assert set(report["modes"]) == set(ann_index.QUANTIZATIONS)
+    # Too few rows to train PQ codebooks on
+    assert report["modes"]["pq"] is None
+    assert report["current"]["recall_at_k"] == 1.0
+    assert report["modes"]["none"]["recall_at_k"] == 1.0
+    assert report["modes"]["int8"]["bytes_per_vector"] < report["modes"]["none"]["bytes_per_vector"]
+
+@pytest.fixture
+def gated_builds(monkeypatch):
+    """Hold background ANN builds until the returned event is set"""
+    gate = threading.Event()
+    build_index = ann_index.build_index
+
+    def gated(*args, **kwargs):
+        if threading.current_thread().name == "ann-index-build":
+            gate.wait(30)
+        return build_index(*args, **kwargs)
+    monkeypatch.setattr(ann_index, "build_index", gated)
+    yield gate
+    gate.set()
+
+def test_compaction_is_not_held_up_by_training(make_store, monkeypatch, gated_builds):
+    monkeypatch.setenv("VECTOR_ANN_THRESHOLD", "40")
+    monkeypatch.setenv("VECTOR_COMPACT_DELETED_RATIO", "1")
+    store = make_store(index_type="ivf_flat")
+    for k in range(5):
+        store.add_documents(make_chunks(f"doc{k}", 20), f"d{k}", "f.pdf")
+    assert store._rebuild_thread.is_alive()
+
+    started = time.monotonic()
+    store.compact()
+    assert time.monotonic() - started < 5
+
+    gated_builds.set()
+    store._rebuild_thread.join(30)
+    assert store.get_stats()["index_type"] == "ivf_flat"
+    assert len(store.search("doc3 chunk", top_k=200, mode="keyword")) == 100
+
+def test_build_over_purged_rows_is_dropped(make_store, monkeypatch, gated_builds):
+    monkeypatch.setenv("VECTOR_ANN_THRESHOLD", "40")
+    monkeypatch.setenv("VECTOR_COMPACT_DELETED_RATIO", "1")
+    store = make_store(index_type="hnsw")
+    for k in range(5):
+        store.add_documents(make_chunks(f"doc{k}", 20), f"d{k}", "f.pdf")
+    building = store._rebuild_thread
+
+    store.delete_document("d1")
+    while store.compact():
+        pass
+    compacted = store.index
+    gated_builds.set()
+    building.join(30)
+
+    # The index built over the old row ids was not swapped in
+    assert store.index is compacted
+    assert {result["document_id"] for result in store.search("widgets", top_k=200)} == {"d0", "d2", "d3", "d4"}
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from backend.services.query_batcher import QueryBatcher
+from .helpers import make_chunks
+
+@pytest.fixture
+def store(make_store):
+    store = make_store()
+    store.add_documents(make_chunks("a", 6), "a", "a.pdf")
+    store.add_documents(make_chunks("b", 6), "b", "b.pdf")
+    return store
+
+def scores(results):
+    """Result scores per query; equal scores may come in either order"""
+    return [[round(result["score"], 5) for result in ranking] for ranking in results]
+
+def search_concurrently(batcher, searches):
+    async def run():
+        return await asyncio.gather(*(batcher.search(query, **kwargs) for query, kwargs in searches))
+    return asyncio.run(run())
+
+def test_concurrent_searches_share_one_batch(store, encoder):
+    batcher = QueryBatcher(store, max_wait_ms=50)
+    searches = [("a chunk 1", {"top_k": 2}), ("b chunk 4", {"top_k": 3}), ("widgets", {"top_k": 1})]
+    encoded = encoder.encoded
+
+    results = search_concurrently(batcher, searches)
+
+    assert batcher.get_stats()["batches"] == 1
+    assert encoder.encoded == encoded + 3
+    assert scores(results) == scores(store.search(query, **kwargs) for query, kwargs in searches)
+    batcher.shutdown()
+
+def test_full_batch_is_searched_without_waiting(store):
+    batcher = QueryBatcher(store, max_wait_ms=60000, max_batch_size=2)
+
+    results = search_concurrently(batcher, [("a chunk 1", {}), ("b chunk 2", {})])
+
+    assert scores(results) == scores([store.search("a chunk 1"), store.search("b chunk 2")])
+    batcher.shutdown()
+
+def test_modes_and_filters_are_searched_separately(store):
+    batcher = QueryBatcher(store)
+    searches = [
+        ("chunk 2", {"mode": "keyword"}),
+        ("chunk 2", {"mode": "hybrid"}),
+        ("chunk 2", {"filters": {"document_ids": ["b"]}}),
+        ("chunk 2", {}),
+    ]
+
+    results = search_concurrently(batcher, searches)
+
+    assert scores(results) == scores(store.search(query, **kwargs) for query, kwargs in searches)
+    assert {result["document_id"] for result in results[2]} == {"b"}
+    assert batcher.get_stats()["queries"] == 4
+    batcher.shutdown()
+
+def test_batcher_sees_rows_committed_by_another_store(make_store):
+    batcher = QueryBatcher(make_store())
+    make_store().add_documents(make_chunks("a", 3), "a", "a.pdf")
+
+    results = search_concurrently(batcher, [("a chunk 1", {})])
+
+    assert results[0][0]["text"] == "a chunk 1 about widgets"
+    batcher.shutdown()
+
+def test_search_errors_reach_every_caller(store, monkeypatch):
+    batcher = QueryBatcher(store)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("index unavailable")
+    monkeypatch.setattr(store, "search_vectors", fail)
+
+    async def run():
+        return await asyncio.gather(batcher.search("a"), batcher.search("b"), return_exceptions=True)
+    errors = asyncio.run(run())
+
+    assert [str(error) for error in errors] == ["index unavailable", "index unavailable"]
+    with pytest.raises(ValueError):
+        asyncio.run(batcher.search("a", mode="fuzzy"))
+    batcher.shutdown()
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from backend.services.vector_store import ReadWriteLock
+
+def start(target) -> threading.Thread:
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    both_inside = threading.Barrier(2, timeout=5)
+
+    def read():
+        with lock.read():
+            both_inside.wait()
+
+    threads = [start(read), start(read)]
+    for thread in threads:
+        thread.join(5)
+    assert not both_inside.broken
+
+def test_writer_waits_for_readers_and_holds_back_new_ones():
+    lock = ReadWriteLock()
+    events = []
+    reading = threading.Event()
+    release_reader = threading.Event()
+
+    def first_reader():
+        with lock.read():
+            reading.set()
+            release_reader.wait(5)
+            events.append("first read done")
+
+    def writer():
+        with lock.write():
+            events.append("write")
+
+    def late_reader():
+        with lock.read():
+            events.append("late read")
+
+    threads = [start(first_reader)]
+    reading.wait(5)
+    threads.append(start(writer))
+    time.sleep(0.05)
+    threads.append(start(late_reader))
+    time.sleep(0.05)
+    # Neither the writer nor the reader that came after it got in
+    assert events == []
+
+    release_reader.set()
+    for thread in threads:
+        thread.join(5)
+    assert events == ["first read done", "write", "late read"]
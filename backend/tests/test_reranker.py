@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+import pytest
+
+from backend.services import reranker
+from backend.services.context_builder import ApproximateTokenizer, ContextBuilder
+from backend.services.reranker import CrossEncoderReranker
+
+class FakeCrossEncoder:
+    """Scores a pair by how many query words the text contains"""
+
+    def __init__(self, model_name, device=None, delay: float = 0.0):
+        self.model_name = model_name
+        self.delay = delay
+        self.batches = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.batches.append(len(pairs))
+        time.sleep(self.delay)
+        return np.array([
+            sum(word in text.split() for word in query.split()) - len(text) / 1000
+            for query, text in pairs
+        ], dtype='float32')
+
+@pytest.fixture(autouse=True)
+def fake_cross_encoder(monkeypatch):
+    monkeypatch.setattr(reranker, "CrossEncoder", FakeCrossEncoder)
+
+def results(*texts):
+    return [{"text": text, "score": 1.0 - i / 10, "chunk_id": i, "document_id": "doc-1"} for i, text in enumerate(texts)]
+
+def test_disabled_without_a_model():
+    ranker = CrossEncoderReranker()
+
+    assert not ranker.is_available()
+    assert ranker.candidates(5) == 5
+
+def test_best_candidates_by_cross_encoder_score_are_kept():
+    ranker = CrossEncoderReranker("fake", candidates_factor=3, batch_size=2, budget_ms=10000)
+    candidates = results("gaskets seal", "pump timer", "the pump timer fixes", "pump timer firmware fixes")
+
+    reranked = ranker.rerank("pump timer fixes", candidates, top_k=2)
+
+    assert ranker.candidates(5) == 15
+    assert [result["chunk_id"] for result in reranked] == [2, 3]
+    assert reranked[0]["rerank_score"] > reranked[1]["rerank_score"]
+    assert "rerank_score" not in candidates[2]
+    assert ranker.model.batches == [2, 2]
+    assert ranker.get_stats()["reranked"] == 1
+
+def test_budget_overrun_falls_back_to_retrieval_order(monkeypatch):
+    ranker = CrossEncoderReranker("fake", batch_size=2, budget_ms=50)
+    ranker.model.delay = 0.04
+
+    assert ranker.rerank("pump", results("a", "b", "c", "d", "e", "f"), top_k=3) is None
+    # The first batch shows the next would not finish in time
+    assert ranker.model.batches == [2]
+    assert ranker.get_stats()["fallbacks"] == 1
+
+def test_context_follows_the_reranked_order():
+    ranker = CrossEncoderReranker("fake", budget_ms=10000)
+    reranked = ranker.rerank("pump timer", results("gaskets seal the housing", "the pump timer"), top_k=2)
+
+    _, selected = ContextBuilder(context_tokens=1000, tokenizer=ApproximateTokenizer()).build_context(reranked)
+
+    assert [result["chunk_id"] for result in selected] == [1, 0]
@@ -0,0 +1,38 @@
+import pytest
+
+from .helpers import make_chunks
+
+QUERIES = ["a chunk 1", "b chunk 4 widgets", "nothing alike", "chunk about"]
+
+@pytest.fixture
+def store(make_store):
+    store = make_store()
+    store.add_documents(make_chunks("a", 6), "a", "a.pdf")
+    store.add_documents(make_chunks("b", 6), "b", "b.pdf")
+    return store
+
+@pytest.mark.parametrize("mode", ["dense", "keyword", "hybrid"])
+def test_batch_matches_one_search_per_query(store, mode):
+    batch = store.search_batch(QUERIES, top_k=4, mode=mode)
+
+    assert batch == [store.search(query, top_k=4, mode=mode) for query in QUERIES]
+
+def test_batch_encodes_all_queries_in_one_call(store, encoder):
+    encoded = encoder.encoded
+
+    store.search_batch(QUERIES, top_k=2)
+
+    assert encoder.encoded == encoded + len(QUERIES)
+    # Cached query embeddings are not encoded again
+    store.search_batch(QUERIES, top_k=2)
+    assert encoder.encoded == encoded + len(QUERIES)
+
+def test_empty_store_and_empty_batch(make_store):
+    store = make_store()
+
+    assert store.search_batch(QUERIES) == [[], [], [], []]
+    assert store.search_batch([]) == []
+
+def test_unknown_mode_is_rejected(store):
+    with pytest.raises(ValueError):
+        store.search_batch(QUERIES, mode="fuzzy")
@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from backend.services.segment_store import SegmentStore, fcntl
+from .helpers import segment_chunks
+
+DIMENSION = 8
+
+def vectors(rows: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).random((rows, DIMENSION), dtype='float32')
+
+def documents(segments):
+    return [document_id for segment in segments for document_id, _ in segment.documents]
+
+def test_appended_segments_survive_a_reload(tmp_path):
+    store = SegmentStore(str(tmp_path), DIMENSION)
+    store.load_segments()
+    first = vectors(3, seed=1)
+    store.append(first, segment_chunks("a", 3))
+    store.append(vectors(2, seed=2), segment_chunks("b", 2))
+
+    segments = SegmentStore(str(tmp_path), DIMENSION).load_segments()
+
+    assert [segment.rows for segment in segments] == [3, 2]
+    assert [segment.start for segment in segments] == [0, 3]
+    assert documents(segments) == ["a", "b"]
+    np.testing.assert_array_equal(segments[0].embeddings, first)
+    assert segments[1].chunk(1).to_dict()["text"] == "b row 1"
+    assert segments[1].chunk(1).index_id == 4
+
+def test_torn_log_tail_is_truncated(tmp_path):
+    store = SegmentStore(str(tmp_path), DIMENSION)
+    store.load_segments()
+    store.append(vectors(2), segment_chunks("a", 2))
+    # A crash in the middle of appending the next record
+    with open(store.log_file, 'ab') as f:
+        f.write(b'{"segment": "seg-0000')
+
+    store = SegmentStore(str(tmp_path), DIMENSION)
+    assert documents(store.load_segments()) == ["a"]
+    store.append(vectors(1), segment_chunks("b", 1))
+
+    assert documents(SegmentStore(str(tmp_path), DIMENSION).load_segments()) == ["a", "b"]
+
+def test_uncommitted_segment_files_are_removed_on_load(tmp_path):
+    store = SegmentStore(str(tmp_path), DIMENSION)
+    store.load_segments()
+    store.append(vectors(2), segment_chunks("a", 2))
+    for extension in SegmentStore.SEGMENT_FILES:
+        open(tmp_path / f"seg-000099{extension}", 'wb').close()
+    if fcntl is None:
+        store.ORPHAN_GRACE_SECONDS = 0
+
+    assert documents(store.load_segments()) == ["a"]
+    assert not any(name.startswith("seg-000099") for name in os.listdir(tmp_path))
+
+def test_deleted_rows_are_dropped_by_compaction(tmp_path):
+    store = SegmentStore(str(tmp_path), DIMENSION, max_segments=1)
+    store.load_segments()
+    store.append(vectors(2), segment_chunks("a", 2))
+    kept = store.append(vectors(3), segment_chunks("b", 3))
+    store.delete_document("a", ["seg-000001"])
+
+    reloaded = SegmentStore(str(tmp_path), DIMENSION, max_segments=1)
+    reloaded.load_segments()
+    assert reloaded.tombstones() == {"seg-000001": {"a"}}
+
+    store.compact()
+    segments = SegmentStore(str(tmp_path), DIMENSION).load_segments()
+    assert documents(segments) == ["b"]
+    assert sum(segment.rows for segment in segments) == 3
+    np.testing.assert_array_equal(segments[0].embeddings, kept.embeddings)
+
+def write_slowly(path: str, started, release):
+    store = SegmentStore(path, DIMENSION)
+    store.load_segments()
+    writer = store.create_writer()
+    writer.write(vectors(2), segment_chunks("slow", 2))
+    started.put(writer.name)
+    release.wait(30)
+    writer.commit()
+
+@pytest.mark.skipif(fcntl is None, reason="needs advisory file locks")
+def test_segment_being_written_by_another_process_is_not_reaped(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    started, release = context.Queue(), context.Event()
+    writer = context.Process(target=write_slowly, args=(str(tmp_path), started, release))
+    writer.start()
+    try:
+        name = started.get(timeout=60)
+        SegmentStore(str(tmp_path), DIMENSION).load_segments()
+        assert os.path.exists(tmp_path / f"{name}.f32")
+    finally:
+        release.set()
+        writer.join(60)
+    assert writer.exitcode == 0
+    assert documents(SegmentStore(str(tmp_path), DIMENSION).load_segments()) == ["slow"]
+
+def append_many(path: str, tag: str, uploads: int):
+    store = SegmentStore(path, DIMENSION, max_segments=4)
+    store.load_segments()
+    for i in range(uploads):
+        store.append(vectors(3, seed=i), segment_chunks(f"{tag}-{i}", 3))
+        if i % 5 == 0:
+            store.compact()
+
+@pytest.mark.skipif(fcntl is None, reason="needs advisory file locks")
+def test_processes_appending_and_compacting_together_lose_no_rows(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    writers = [context.Process(target=append_many, args=(str(tmp_path), tag, 20)) for tag in "abc"]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(120)
+    assert [writer.exitcode for writer in writers] == [0, 0, 0]
+
+    segments = SegmentStore(str(tmp_path), DIMENSION).load_segments()
+    assert sorted(documents(segments)) == sorted(f"{tag}-{i}" for tag in "abc" for i in range(20))
+    assert sum(segment.rows for segment in segments) == 180
+    # Every segment file left on disk is committed
+    names = {segment.name for segment in segments}
+    assert {name.split(".")[0] for name in os.listdir(tmp_path) if name.startswith("seg-")} == names
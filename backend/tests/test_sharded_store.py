@@ -0,0 +1,91 @@
+import pytest
+
+from backend.services import sharded_store
+from backend.services.sharded_store import ShardedVectorStore
+from .helpers import HashEncoder, make_chunks
+
+QUERIES = ["doc3 chunk 4 about widgets", "chunk 7", "doc0 widgets", "nothing alike"]
+DOCUMENTS = [f"d{k}" for k in range(8)]
+FILTERS = [None, {"document_ids": ["d1", "d5"]}, {"filenames": ["f2.pdf"], "page_from": 2}]
+
+@pytest.fixture(autouse=True)
+def hash_encoder(monkeypatch):
+    monkeypatch.setattr(sharded_store, "SentenceTransformer", HashEncoder)
+
+def fill(store):
+    for k, document_id in enumerate(DOCUMENTS):
+        store.add_documents(make_chunks(f"doc{k}", 9), document_id, f"f{k % 3}.pdf")
+
+@pytest.fixture
+def single(make_store):
+    store = make_store()
+    fill(store)
+    return store
+
+@pytest.fixture
+def sharded(tmp_path):
+    store = ShardedVectorStore(store_path=str(tmp_path / "sharded"), shards=3)
+    fill(store)
+    return store
+
+def ranked(results):
+    """(document, chunk, score) of results; equal scores may come in either order"""
+    return sorted((round(result["score"], 5), result["document_id"], result["chunk_id"]) for result in results)
+
+def scores(results):
+    return [round(result["score"], 5) for result in results]
+
+def test_documents_are_spread_over_the_shards(sharded):
+    assert sharded.ntotal == 72
+    assert all(shard.ntotal for shard in sharded.shards)
+    for document_id in DOCUMENTS:
+        assert sharded.shard_for(document_id).has_document(document_id)
+
+def chunk_keys(results):
+    return {(result["document_id"], result["chunk_id"]) for result in results}
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_sharded_dense_search_matches_one_store(single, sharded, filters):
+    for query in QUERIES:
+        expected = single.search(query, top_k=8, filters=filters)
+        assert scores(sharded.search(query, top_k=8, filters=filters)) == scores(expected)
+    full = single.search(QUERIES[0], top_k=72, filters=filters)
+    assert ranked(sharded.search(QUERIES[0], top_k=72, filters=filters)) == ranked(full)
+
+@pytest.mark.parametrize("mode", ["keyword", "hybrid"])
+@pytest.mark.parametrize("filters", FILTERS)
+def test_sharded_lexical_search_finds_the_same_chunks(single, sharded, mode, filters):
+    # BM25 statistics are per shard, so scores differ from one store's
+    for query in QUERIES:
+        matching = chunk_keys(single.search(query, top_k=72, mode=mode, filters=filters))
+        results = sharded.search(query, top_k=8, mode=mode, filters=filters)
+        assert chunk_keys(results) <= matching
+        assert len(results) == min(8, len(matching))
+    best = sharded.search("doc3 chunk 4 about widgets", top_k=1, mode=mode)
+    assert chunk_keys(best) == {("d3", 4)}
+
+def test_batch_search_matches_single_searches(sharded):
+    batch = sharded.search_batch(QUERIES, top_k=5)
+
+    assert [scores(results) for results in batch] == [scores(sharded.search(query, top_k=5)) for query in QUERIES]
+
+def test_deletes_and_reload(sharded, tmp_path):
+    assert sharded.delete_document("d3") == 9
+    assert "d3" not in {result["document_id"] for result in sharded.search("doc3 chunk 4", top_k=72)}
+    # A background compaction may purge the deleted rows; let it finish first
+    for shard in sharded.shards:
+        if shard._compaction_thread is not None:
+            shard._compaction_thread.join(60)
+
+    reopened = ShardedVectorStore(store_path=str(tmp_path / "sharded"), shards=3)
+
+    assert reopened.ntotal == sharded.ntotal
+    assert not reopened.has_document("d3")
+    assert scores(reopened.search(QUERIES[0], top_k=5)) == scores(sharded.search(QUERIES[0], top_k=5))
+
+def test_shard_count_cannot_change(sharded, tmp_path, make_store):
+    with pytest.raises(ValueError):
+        ShardedVectorStore(store_path=str(tmp_path / "sharded"), shards=2)
+    make_store(tmp_path / "plain").add_documents(make_chunks("a", 2), "a", "a.pdf")
+    with pytest.raises(ValueError):
+        ShardedVectorStore(store_path=str(tmp_path / "plain"), shards=2)
@@ -0,0 +1,90 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from backend.services.segment_store import fcntl
+from backend.services.vector_store import VectorStore
+from .helpers import HashEncoder, make_chunks
+
+def document_ids(results):
+    return {result["document_id"] for result in results}
+
+@pytest.mark.parametrize("storage_mode", ["memory", "mmap"])
+def test_store_reopens_from_its_segments(make_store, storage_mode):
+    store = make_store(storage_mode=storage_mode)
+    store.add_documents(make_chunks("a", 5), "a", "a.pdf")
+    store.add_documents(make_chunks("b", 4), "b", "b.pdf")
+    expected = store.search("b chunk 2 about widgets", top_k=3)
+
+    reopened = make_store(storage_mode=storage_mode)
+
+    assert reopened.ntotal == 9
+    assert reopened.search("b chunk 2 about widgets", top_k=3) == expected
+    assert expected[0]["text"] == "b chunk 2 about widgets"
+
+def test_mmap_store_keeps_no_vectors_on_the_heap(make_store):
+    make_store().add_documents(make_chunks("a", 6), "a", "a.pdf")
+
+    store = make_store(storage_mode="mmap")
+
+    assert store.get_stats()["index_memory_bytes"] == 0
+    np.testing.assert_allclose(
+        store._row_embeddings(np.arange(6)),
+        make_store()._row_embeddings(np.arange(6))
+    )
+
+def serve_commands(path: str, commands, replies):
+    store = VectorStore(store_path=path, model=HashEncoder())
+    for operation, document_id in iter(commands.get, None):
+        if operation == "add":
+            store.add_documents(make_chunks(document_id, 6), document_id, "f.pdf")
+        elif operation == "delete":
+            store.delete_document(document_id)
+        elif operation == "replace":
+            writer = store.create_document_writer(document_id, "g.pdf", replace=True)
+            writer.add(make_chunks("new" + document_id, 2))
+            writer.commit()
+        elif operation == "compact":
+            store.compact()
+        replies.put(operation)
+
+@pytest.mark.skipif(fcntl is None, reason="needs advisory file locks")
+def test_store_sees_changes_made_by_another_process(tmp_path, make_store):
+    path = str(tmp_path / "store")
+    context = multiprocessing.get_context("spawn")
+    commands, replies = context.Queue(), context.Queue()
+    worker = context.Process(target=serve_commands, args=(path, commands, replies))
+    worker.start()
+
+    def run(operation, document_id=None):
+        commands.put((operation, document_id))
+        assert replies.get(timeout=120) == operation
+
+    try:
+        store = make_store(path)
+        events = []
+        store.add_change_listener(events.append)
+        for document_id in ("d0", "d1", "d2"):
+            run("add", document_id)
+        assert document_ids(store.search("widgets", top_k=100)) == {"d0", "d1", "d2"}
+
+        run("delete", "d1")
+        assert "d1" not in document_ids(store.search("widgets", top_k=100, mode="hybrid"))
+        assert not store.has_document("d1")
+
+        run("replace", "d2")
+        replaced = [result for result in store.search("widgets", top_k=100) if result["document_id"] == "d2"]
+        assert sorted(result["text"] for result in replaced) == ["newd2 chunk 0 about widgets", "newd2 chunk 1 about widgets"]
+
+        # Rows written here survive a compaction by the other process
+        store.add_documents(make_chunks("b0", 6), "b0", "f.pdf")
+        run("compact")
+        assert document_ids(store.search("widgets", top_k=100, mode="keyword")) == {"d0", "d2", "b0"}
+        assert events
+    finally:
+        commands.put(None)
+        worker.join(60)
+    assert worker.exitcode == 0
+
+    assert len(make_store(path).search("widgets", top_k=100, mode="keyword")) == 6 + 2 + 6
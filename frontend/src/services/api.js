@@ -24,6 +24,43 @@ export const apiService = {
     return response.data
   },
 
+  // Upload a new version of a document
+  async replaceDocument(documentId, file) {
+    const formData = new FormData()
+    formData.append('file', file)
+    
+    const response = await api.put(`/documents/${documentId}`, formData, {
+      headers: {
+        'Content-Type': 'multipart/form-data'
+      }
+    })
+    return response.data
+  },
+
+  // Delete document
+  async deleteDocument(documentId) {
+    const response = await api.delete(`/documents/${documentId}`)
+    return response.data
+  },
+
+  // Get ingestion job progress
+  async getJob(jobId) {
+    const response = await api.get(`/jobs/${jobId}`)
+    return response.data
+  },
+
+  // Poll an ingestion job until it completes or fails
+  async waitForJob(jobId, onProgress = null, intervalMs = 1000) {
+    for (;;) {
+      const job = await this.getJob(jobId)
+      if (onProgress) onProgress(job)
+      if (job.status === 'completed' || job.status === 'failed') {
+        return job
+      }
+      await new Promise(resolve => setTimeout(resolve, intervalMs))
+    }
+  },
+
   // Send query to get AI response
   async sendQuery(query, conversationId = null, topK = 5) {
     const response = await api.post('/query', {
@@ -34,6 +71,52 @@ export const apiService = {
     return response.data
   },
 
+  // Send query and receive the AI response as it is generated.
+  // handlers: onSources(data), onToken(text), onDone(data)
+  async streamQuery(query, conversationId = null, topK = 5, handlers = {}) {
+    const response = await fetch(`${API_BASE_URL}/query/stream`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        query,
+        conversation_id: conversationId,
+        top_k: topK
+      })
+    })
+    if (!response.ok) {
+      throw new Error(`Request failed with status ${response.status}`)
+    }
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    for (;;) {
+      const { value, done } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      // Server-Sent Events are separated by a blank line
+      let boundary
+      while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+        const rawEvent = buffer.slice(0, boundary)
+        buffer = buffer.slice(boundary + 2)
+
+        let event = 'message'
+        let data = ''
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event: ')) event = line.slice(7)
+          else if (line.startsWith('data: ')) data += line.slice(6)
+        }
+        const payload = data ? JSON.parse(data) : {}
+
+        if (event === 'sources' && handlers.onSources) handlers.onSources(payload)
+        else if (event === 'token' && handlers.onToken) handlers.onToken(payload.text)
+        else if (event === 'done' && handlers.onDone) handlers.onDone(payload)
+        else if (event === 'error') throw new Error(payload.detail || 'Streaming failed')
+      }
+    }
+  },
+
   // Request web search permission and perform search
   async performWebSearch(conversationId, approved) {
     const response = await api.post('/web-search', {
@@ -49,9 +132,9 @@ export const apiService = {
     return response.data
   },
 
-  // Get all conversations
-  async getAllConversations() {
-    const response = await api.get('/conversations')
+  // Get a page of conversations ({ limit, cursor, search })
+  async getAllConversations(params = {}) {
+    const response = await api.get('/conversations', { params })
     return response.data
   },
 